@@ -0,0 +1,35 @@
+"""Hourly latency sketches per restaurant and stage
+
+Revision ID: add_latency_sketches_008
+Revises: partition_search_logs_007
+Create Date: 2024-04-10 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'add_latency_sketches_008'
+down_revision = 'partition_search_logs_007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('latency_sketches_hourly',
+        sa.Column('restaurant_id', sa.Integer(), nullable=False),
+        sa.Column('stage', sa.String(length=20), nullable=False),
+        sa.Column('hour', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.Column('sum_ms', sa.Float(), nullable=False),
+        sa.Column('max_ms', sa.Float(), nullable=False),
+        sa.Column('buckets', postgresql.ARRAY(sa.Integer()), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['restaurant_id'], ['restaurants.id'], ),
+        sa.PrimaryKeyConstraint('restaurant_id', 'stage', 'hour')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('latency_sketches_hourly')
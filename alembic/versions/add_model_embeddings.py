@@ -0,0 +1,71 @@
+"""Store embeddings of non-default models in model_embeddings
+
+Revision ID: add_model_embeddings_005
+Revises: add_quantized_vectors_004
+Create Date: 2024-03-01 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_model_embeddings_005'
+down_revision = 'add_quantized_vectors_004'
+branch_labels = None
+depends_on = None
+
+
+# Models stored in model_embeddings at the time of this revision (name, dimension).
+# Models registered later get their index from app/services/ann_indexes.py.
+MODELS = [
+    ('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2', 384),
+    ('text-embedding-3-small', 1536),
+    ('text-embedding-ada-002', 1536),
+]
+
+
+def _index_name(model_name: str) -> str:
+    slug = ''.join(c if c.isalnum() else '_' for c in model_name.rsplit('/', 1)[-1].lower())
+    return f"ix_model_embeddings_{slug}_halfvec"
+
+
+def upgrade() -> None:
+    op.create_table('model_embeddings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('model_name', sa.String(length=100), nullable=False),
+        sa.Column('source_type', sa.String(length=20), nullable=False),
+        sa.Column('source_id', sa.Integer(), nullable=False),
+        sa.Column('restaurant_id', sa.Integer(), nullable=True),
+        sa.Column('customer_phone', sa.String(), nullable=True),
+        sa.Column('content_hash', sa.String(length=64), nullable=True),
+        sa.Column('embedding', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['restaurant_id'], ['restaurants.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('model_name', 'source_type', 'source_id', name='uq_model_embeddings_source')
+    )
+    op.create_index(op.f('ix_model_embeddings_id'), 'model_embeddings', ['id'], unique=False)
+    op.create_index(
+        'ix_model_embeddings_lookup', 'model_embeddings',
+        ['model_name', 'source_type', 'restaurant_id'], unique=False
+    )
+
+    # Untyped vector column: each model gets its own dimension
+    op.execute('ALTER TABLE model_embeddings ALTER COLUMN embedding TYPE vector USING embedding::vector')
+
+    # One partial index per model; an expression index needs a fixed dimension
+    for model_name, dimension in MODELS:
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS {_index_name(model_name)} ON model_embeddings "
+            f"USING hnsw ((embedding::halfvec({dimension})) halfvec_ip_ops) "
+            f"WITH (m = 16, ef_construction = 64) WHERE model_name = '{model_name}'"
+        )
+
+
+def downgrade() -> None:
+    for model_name, _ in MODELS:
+        op.execute(f"DROP INDEX IF EXISTS {_index_name(model_name)}")
+    op.drop_index('ix_model_embeddings_lookup', table_name='model_embeddings')
+    op.drop_index(op.f('ix_model_embeddings_id'), table_name='model_embeddings')
+    op.drop_table('model_embeddings')
@@ -0,0 +1,26 @@
+"""Add content hash and builder version to product embeddings
+
+Revision ID: add_product_embedding_hash_003
+Revises: add_vector_indexes_002
+Create Date: 2024-02-15 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_product_embedding_hash_003'
+down_revision = 'add_vector_indexes_002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows keep NULL and are re-embedded once on the next run
+    op.add_column('product_embeddings', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.add_column('product_embeddings', sa.Column('content_version', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('product_embeddings', 'content_version')
+    op.drop_column('product_embeddings', 'content_hash')
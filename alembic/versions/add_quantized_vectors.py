@@ -0,0 +1,107 @@
+"""Unit-normalize embeddings and index compact halfvec / binary forms
+
+Revision ID: add_quantized_vectors_004
+Revises: add_product_embedding_hash_003
+Create Date: 2024-02-15 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_quantized_vectors_004'
+down_revision = 'add_product_embedding_hash_003'
+branch_labels = None
+depends_on = None
+
+
+# halfvec, binary_quantize and halfvec_ip_ops / bit_hamming_ops
+MIN_PGVECTOR_VERSION = (0, 7)
+
+# Searched tables keep full precision in the heap for the rerank; only the indexes are compact
+SEARCH_TABLES = ['product_embeddings', 'knowledge_base', 'conversation_memories']
+
+
+def _drop_partial_indexes(pattern: str) -> None:
+    op.execute(f"""
+        DO $$
+        DECLARE idx record;
+        BEGIN
+            FOR idx IN SELECT indexname FROM pg_indexes WHERE indexname LIKE '{pattern}' LOOP
+                EXECUTE 'DROP INDEX IF EXISTS ' || quote_ident(idx.indexname);
+            END LOOP;
+        END $$;
+    """)
+
+
+def _require_pgvector() -> None:
+    """Stop before touching any index when the server's pgvector is too old"""
+    version = op.get_bind().execute(
+        sa.text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    ).scalar()
+    try:
+        installed = tuple(int(part) for part in version.split('.')[:2])
+    except (AttributeError, ValueError):
+        installed = None
+    if installed is None or installed < MIN_PGVECTOR_VERSION:
+        minimum = '.'.join(map(str, MIN_PGVECTOR_VERSION))
+        raise RuntimeError(
+            f"add_quantized_vectors needs pgvector >= {minimum} (installed: {version}). "
+            f"Install a newer pgvector on the server and run the migration again; "
+            f"see PGVECTOR_GUIDE.md"
+        )
+
+
+def upgrade() -> None:
+    # Newest version the server has installed; older servers stop here
+    op.execute("ALTER EXTENSION vector UPDATE")
+    _require_pgvector()
+
+    # Unit vectors let inner product (<#>) stand in for cosine distance
+    for table in SEARCH_TABLES + ['search_logs']:
+        op.execute(f"UPDATE {table} SET embedding = l2_normalize(embedding) WHERE embedding IS NOT NULL")
+
+    # Full-precision cosine graphs are replaced by compact expression indexes
+    for table in SEARCH_TABLES + ['search_logs']:
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_embedding_hnsw")
+    _drop_partial_indexes('ix\\_%\\_embedding\\_hnsw\\_r%')
+
+    for table in SEARCH_TABLES:
+        # settings.vector_storage = 'halfvec': 2 bytes per dimension
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_embedding_halfvec ON {table} "
+            f"USING hnsw ((embedding::halfvec(384)) halfvec_ip_ops) WITH (m = 16, ef_construction = 64)"
+        )
+        # settings.vector_storage = 'binary': 1 bit per dimension
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_embedding_binary ON {table} "
+            f"USING hnsw ((binary_quantize(embedding)::bit(384)) bit_hamming_ops) WITH (m = 16, ef_construction = 64)"
+        )
+
+    # Search logs are never reranked, so the column itself is stored at half precision
+    op.execute("ALTER TABLE search_logs ALTER COLUMN embedding TYPE halfvec(384) USING embedding::halfvec(384)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_search_logs_embedding_halfvec ON search_logs "
+        "USING hnsw (embedding halfvec_ip_ops) WITH (m = 16, ef_construction = 64)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_search_logs_embedding_halfvec")
+    op.execute("ALTER TABLE search_logs ALTER COLUMN embedding TYPE vector(384) USING embedding::vector(384)")
+
+    for table in SEARCH_TABLES:
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_embedding_binary")
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_embedding_halfvec")
+
+    # Per-restaurant partial indexes created at runtime (see app/services/ann_indexes.py)
+    for mode in ('full', 'halfvec', 'binary'):
+        _drop_partial_indexes(f'ix\\_%\\_embedding\\_{mode}\\_r%')
+
+    for table in SEARCH_TABLES + ['search_logs']:
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_embedding_hnsw ON {table} "
+            f"USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )
+
+    # Normalized vectors are still valid for cosine distance; nothing to restore
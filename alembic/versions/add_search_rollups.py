@@ -0,0 +1,57 @@
+"""Hourly search analytics rollups
+
+Revision ID: add_search_rollups_006
+Revises: add_model_embeddings_005
+Create Date: 2024-03-15 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'add_search_rollups_006'
+down_revision = 'add_model_embeddings_005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('search_stats_hourly',
+        sa.Column('restaurant_id', sa.Integer(), nullable=False),
+        sa.Column('search_type', sa.String(length=20), nullable=False),
+        sa.Column('hour', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('searches', sa.Integer(), nullable=False),
+        sa.Column('zero_results', sa.Integer(), nullable=False),
+        sa.Column('results_found_sum', sa.BigInteger(), nullable=False),
+        sa.Column('search_time_ms_sum', sa.BigInteger(), nullable=False),
+        sa.Column('embedding_time_ms_sum', sa.BigInteger(), nullable=False),
+        sa.Column('latency_histogram', postgresql.ARRAY(sa.Integer()), nullable=False),
+        sa.Column('similarity_histogram', postgresql.ARRAY(sa.Integer()), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['restaurant_id'], ['restaurants.id'], ),
+        sa.PrimaryKeyConstraint('restaurant_id', 'search_type', 'hour')
+    )
+
+    op.create_table('search_query_stats_daily',
+        sa.Column('restaurant_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('query', sa.Text(), nullable=False),
+        sa.Column('searches', sa.Integer(), nullable=False),
+        sa.Column('top_similarity_sum', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['restaurant_id'], ['restaurants.id'], ),
+        sa.PrimaryKeyConstraint('restaurant_id', 'day', 'query')
+    )
+
+    op.create_table('analytics_rollup_state',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('last_id', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('analytics_rollup_state')
+    op.drop_table('search_query_stats_daily')
+    op.drop_table('search_stats_hourly')
@@ -0,0 +1,65 @@
+"""Add ANN indexes for vector tables
+
+Revision ID: add_vector_indexes_002
+Revises: add_embeddings_001
+Create Date: 2024-02-01 12:00:00
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'add_vector_indexes_002'
+down_revision = 'add_embeddings_001'
+branch_labels = None
+depends_on = None
+
+
+VECTOR_TABLES = ['product_embeddings', 'knowledge_base', 'conversation_memories', 'search_logs']
+
+
+def upgrade() -> None:
+    # The first migration stored embeddings as text; ANN indexes need a typed vector column
+    for table in VECTOR_TABLES:
+        op.execute(
+            f"ALTER TABLE {table} ALTER COLUMN embedding TYPE vector(384) "
+            f"USING embedding::vector(384)"
+        )
+
+    # HNSW graphs for cosine distance (<=>), pgvector defaults for m / ef_construction
+    for table in VECTOR_TABLES:
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS ix_{table}_embedding_hnsw ON {table} "
+            f"USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )
+
+    # B-tree filters used next to every vector lookup
+    op.create_index('ix_product_embeddings_restaurant_id', 'product_embeddings', ['restaurant_id'])
+    op.create_index('ix_knowledge_base_restaurant_id', 'knowledge_base', ['restaurant_id'])
+    op.create_index(
+        'ix_conversation_memories_restaurant_customer', 'conversation_memories',
+        ['restaurant_id', 'customer_phone']
+    )
+    op.create_index('ix_search_logs_restaurant_created', 'search_logs', ['restaurant_id', 'created_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_search_logs_restaurant_created', table_name='search_logs')
+    op.drop_index('ix_conversation_memories_restaurant_customer', table_name='conversation_memories')
+    op.drop_index('ix_knowledge_base_restaurant_id', table_name='knowledge_base')
+    op.drop_index('ix_product_embeddings_restaurant_id', table_name='product_embeddings')
+
+    for table in VECTOR_TABLES:
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_embedding_hnsw")
+
+    # Per-restaurant partial indexes created at runtime (see app/services/ann_indexes.py)
+    op.execute("""
+        DO $$
+        DECLARE idx record;
+        BEGIN
+            FOR idx IN SELECT indexname FROM pg_indexes WHERE indexname LIKE 'ix\\_%\\_embedding\\_hnsw\\_r%' LOOP
+                EXECUTE 'DROP INDEX IF EXISTS ' || quote_ident(idx.indexname);
+            END LOOP;
+        END $$;
+    """)
+
+    # Columns stay typed as vector; the text representation is not worth restoring
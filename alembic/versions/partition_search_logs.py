@@ -0,0 +1,168 @@
+"""Partition search_logs by day and move query text and embedding to search_queries
+
+Revision ID: partition_search_logs_007
+Revises: add_search_rollups_006
+Create Date: 2024-04-01 12:00:00
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'partition_search_logs_007'
+down_revision = 'add_search_rollups_006'
+branch_labels = None
+depends_on = None
+
+
+# Days of partitions created ahead of today; the application keeps this window filled
+DAYS_AHEAD = 7
+
+
+def _normalized(column: str) -> str:
+    # Matches app.services.search_result_cache.normalize_query except for accent folding,
+    # which needs the unaccent extension; accented historical queries may get a second
+    # search_queries row once they are searched again
+    return f"lower(regexp_replace(btrim({column}), '\\s+', ' ', 'g'))"
+
+
+def _query_hash(column: str) -> str:
+    return f"encode(sha256(convert_to({_normalized(column)}, 'UTF8')), 'hex')"
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE TABLE search_queries (
+            id bigserial PRIMARY KEY,
+            query_hash varchar(64) NOT NULL UNIQUE,
+            query text NOT NULL,
+            embedding halfvec(384),
+            created_at timestamptz DEFAULT now()
+        )
+    """)
+
+    # One row per distinct normalized query, keeping the latest embedding seen for it
+    op.execute(f"""
+        INSERT INTO search_queries (query_hash, query, embedding)
+        SELECT DISTINCT ON (query_hash) query_hash, normalized, embedding
+        FROM (
+            SELECT {_query_hash('query')} AS query_hash,
+                {_normalized('query')} AS normalized, embedding, created_at
+            FROM search_logs
+            WHERE query IS NOT NULL
+        ) q
+        ORDER BY query_hash, embedding IS NULL, created_at DESC
+    """)
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_search_queries_embedding_halfvec ON search_queries "
+        "USING hnsw (embedding halfvec_ip_ops) WITH (m = 16, ef_construction = 64)"
+    )
+
+    op.execute("""
+        CREATE TABLE search_logs_partitioned (
+            id bigserial,
+            created_at timestamptz NOT NULL DEFAULT now(),
+            conversation_id integer REFERENCES conversations (id),
+            restaurant_id integer REFERENCES restaurants (id),
+            query_id bigint REFERENCES search_queries (id),
+            search_type varchar(20),
+            results_found integer,
+            top_similarity double precision,
+            results_used json,
+            search_time_ms integer,
+            embedding_time_ms integer,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+
+    # A partition per UTC day from the oldest log to DAYS_AHEAD days from now
+    op.execute(f"""
+        DO $$
+        DECLARE
+            day date;
+            today date := (now() AT TIME ZONE 'UTC')::date;
+            first_day date := COALESCE((SELECT MIN(created_at AT TIME ZONE 'UTC')::date FROM search_logs), today);
+        BEGIN
+            FOR day IN SELECT generate_series(first_day, today + {DAYS_AHEAD}, interval '1 day')::date LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF search_logs_partitioned FOR VALUES FROM (%L) TO (%L)',
+                    'search_logs_p' || to_char(day, 'YYYYMMDD'),
+                    day::timestamp AT TIME ZONE 'UTC', (day + 1)::timestamp AT TIME ZONE 'UTC'
+                );
+            END LOOP;
+        END $$;
+    """)
+    # Catches rows outside every daily partition if maintenance ever falls behind
+    op.execute("CREATE TABLE search_logs_default PARTITION OF search_logs_partitioned DEFAULT")
+
+    op.execute(f"""
+        INSERT INTO search_logs_partitioned (
+            id, created_at, conversation_id, restaurant_id, query_id, search_type,
+            results_found, top_similarity, results_used, search_time_ms, embedding_time_ms
+        )
+        SELECT l.id, COALESCE(l.created_at, now()), l.conversation_id, l.restaurant_id, q.id, l.search_type,
+            l.results_found, l.top_similarity, l.results_used, l.search_time_ms, l.embedding_time_ms
+        FROM search_logs l
+        LEFT JOIN search_queries q ON q.query_hash = {_query_hash('l.query')}
+    """)
+    # Ids continue where the old table stopped, so the analytics rollup watermark stays valid
+    op.execute("""
+        SELECT setval(
+            pg_get_serial_sequence('search_logs_partitioned', 'id'),
+            COALESCE((SELECT MAX(id) FROM search_logs_partitioned), 0) + 1,
+            false
+        )
+    """)
+
+    op.execute("DROP TABLE search_logs")
+    op.execute("ALTER TABLE search_logs_partitioned RENAME TO search_logs")
+    op.execute("ALTER SEQUENCE search_logs_partitioned_id_seq RENAME TO search_logs_id_seq")
+
+    op.execute("CREATE INDEX IF NOT EXISTS ix_search_logs_restaurant_created ON search_logs (restaurant_id, created_at)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_search_logs_query_id ON search_logs (query_id)")
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE TABLE search_logs_flat (
+            id serial PRIMARY KEY,
+            conversation_id integer REFERENCES conversations (id),
+            restaurant_id integer REFERENCES restaurants (id),
+            query text,
+            search_type varchar,
+            embedding halfvec(384),
+            results_found integer,
+            top_similarity double precision,
+            results_used json,
+            search_time_ms integer,
+            embedding_time_ms integer,
+            created_at timestamptz DEFAULT now()
+        )
+    """)
+    op.execute("""
+        INSERT INTO search_logs_flat (
+            id, conversation_id, restaurant_id, query, search_type, embedding,
+            results_found, top_similarity, results_used, search_time_ms, embedding_time_ms, created_at
+        )
+        SELECT l.id, l.conversation_id, l.restaurant_id, q.query, l.search_type, q.embedding,
+            l.results_found, l.top_similarity, l.results_used, l.search_time_ms, l.embedding_time_ms, l.created_at
+        FROM search_logs l
+        LEFT JOIN search_queries q ON q.id = l.query_id
+    """)
+    op.execute("""
+        SELECT setval(
+            pg_get_serial_sequence('search_logs_flat', 'id'),
+            COALESCE((SELECT MAX(id) FROM search_logs_flat), 0) + 1,
+            false
+        )
+    """)
+
+    # Dropping the parent drops every partition
+    op.execute("DROP TABLE search_logs")
+    op.execute("DROP TABLE search_queries")
+    op.execute("ALTER TABLE search_logs_flat RENAME TO search_logs")
+    op.execute("ALTER SEQUENCE search_logs_flat_id_seq RENAME TO search_logs_id_seq")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_search_logs_id ON search_logs (id)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_search_logs_embedding_halfvec ON search_logs "
+        "USING hnsw (embedding halfvec_ip_ops) WITH (m = 16, ef_construction = 64)"
+    )
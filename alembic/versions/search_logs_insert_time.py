@@ -0,0 +1,24 @@
+"""Stamp search_logs.created_at when the row is inserted
+
+Revision ID: search_logs_insert_time_009
+Revises: add_latency_sketches_008
+Create Date: 2024-04-15 12:00:00
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'search_logs_insert_time_009'
+down_revision = 'add_latency_sketches_008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # clock_timestamp() is read per row, next to the id's nextval(); now() would be the
+    # transaction start. The analytics rollup's lag relies on the two being close.
+    op.execute("ALTER TABLE search_logs ALTER COLUMN created_at SET DEFAULT clock_timestamp()")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE search_logs ALTER COLUMN created_at SET DEFAULT now()")
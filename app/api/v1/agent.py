@@ -1,11 +1,17 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.services.conversational_agent import conversational_agent
+from app.services.context_budget import context_assembler
 from app.models.conversation import Conversation, ConversationStatus
 from app.models.restaurant import Restaurant
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
+from typing import AsyncIterator, Dict, Any, Optional, Tuple
+import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -30,11 +36,11 @@ class AgentConfigResponse(BaseModel):
     current_model: str
     response_length: int
     temperature: float
+    context_budget: Optional[Dict[str, Any]] = None
 
 
-@router.post("/chat", response_model=ChatResponse)
-def chat_with_agent(request: ChatRequest, db: Session = Depends(get_db)):
-    """Test chat with the conversational agent"""
+def _get_chat_conversation(request: ChatRequest, db: Session) -> Tuple[Restaurant, Conversation]:
+    """Restaurant and active test conversation for a chat request (blocking)"""
     
     # Verify restaurant exists
     restaurant = db.query(Restaurant).filter(Restaurant.id == request.restaurant_id).first()
@@ -61,33 +67,94 @@ def chat_with_agent(request: ChatRequest, db: Session = Depends(get_db)):
         db.commit()
         db.refresh(conversation)
     
+    return restaurant, conversation
+
+
+def _chat_response(request: ChatRequest, restaurant: Restaurant, conversation: Conversation, response: str, db: Session) -> ChatResponse:
+    """Intent analysis and restaurant context around a generated reply (blocking)"""
+    
+    # Keep the turn's prompt budget, set on conversation.context while preparing the prompt
+    db.commit()
+    
+    # Analyze intent
+    context = conversational_agent._build_conversation_context(conversation, db)
+    intent_analysis = conversational_agent.analyze_intent(request.message, context)
+    
+    return ChatResponse(
+        response=response,
+        intent_analysis=intent_analysis,
+        conversation_id=conversation.id,
+        restaurant_context={
+            "restaurant_name": restaurant.name,
+            "available_products": len(context.get('products_by_category', {})),
+            "current_order_items": len((context.get('current_order') or {}).get('items', [])),
+            "prompt_budget": (conversation.context or {}).get('prompt_budget')
+        }
+    )
+
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat_with_agent(request: ChatRequest, db: Session = Depends(get_db)):
+    """Test chat with the conversational agent"""
+    
+    # Database work runs on the agent's threads, the LLM call is awaited on the event loop
+    restaurant, conversation = await conversational_agent.run_blocking(_get_chat_conversation, request, db)
+    
     # Generate response
     try:
-        response = conversational_agent.generate_response(
+        response = await conversational_agent.generate_response(
             request.message, 
             conversation, 
             db
         )
         
-        # Analyze intent
-        context = conversational_agent._build_conversation_context(conversation, db)
-        intent_analysis = conversational_agent.analyze_intent(request.message, context)
-        
-        return ChatResponse(
-            response=response,
-            intent_analysis=intent_analysis,
-            conversation_id=conversation.id,
-            restaurant_context={
-                "restaurant_name": restaurant.name,
-                "available_products": len(context.get('products_by_category', {})),
-                "current_order_items": len(context.get('current_order', {}).get('items', []))
-            }
+        return await conversational_agent.run_blocking(
+            _chat_response, request, restaurant, conversation, response, db
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
 
 
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_with_agent_stream(request: ChatRequest, db: Session = Depends(get_db)):
+    """Chat with the agent as Server-Sent Events
+    
+    Events: `start` with the conversation id, one `delta` per text fragment as the
+    LLM generates it, then `done` with the same body as POST /chat (full response
+    and intent analysis), or `error`.
+    """
+    
+    restaurant, conversation = await conversational_agent.run_blocking(_get_chat_conversation, request, db)
+    
+    async def events() -> AsyncIterator[str]:
+        yield _sse("start", {"conversation_id": conversation.id})
+        try:
+            parts = []
+            async for delta in conversational_agent.stream_response(request.message, conversation, db):
+                parts.append(delta)
+                yield _sse("delta", {"text": delta})
+            
+            result = await conversational_agent.run_blocking(
+                _chat_response, request, restaurant, conversation, "".join(parts).strip(), db
+            )
+            yield _sse("done", result.model_dump())
+        except Exception as e:
+            logger.error(f"Error streaming agent response: {e}")
+            yield _sse("error", {"detail": f"Error generating response: {str(e)}"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # No caching and no proxy buffering, or the deltas arrive all at once
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/config", response_model=AgentConfigResponse)
 def get_agent_config():
     """Get agent configuration and capabilities"""
@@ -115,7 +182,8 @@ def get_agent_config():
         available_models=available_models,
         current_model=current_model,
         response_length=300,
-        temperature=0.7
+        temperature=0.7,
+        context_budget=context_assembler.info
     )
 
 
@@ -2,6 +2,17 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.core.database import get_db
 from app.services.vector_search import vector_search_service
+from app.services.embedding_models import EMBEDDING_MODEL_SPECS, embedding_model_registry
+from app.services.embedding_migration import embedding_migration_job, embedding_model_status
+from app.services.remote_embeddings import remote_embedding_stats
+from app.services.vector_index import restaurant_vector_index
+from app.services.ann_indexes import ensure_restaurant_partial_indexes
+from app.services.search_log_writer import search_log_writer
+from app.services.search_analytics import search_analytics_rollup
+from app.services.latency_stats import latency_recorder
+from app.services.search_log_partitions import search_log_partitions
+from app.services.search_result_cache import search_result_cache
+from app.services.access_stats import access_stats
 from app.models.restaurant import Restaurant
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
@@ -13,6 +24,7 @@ class EmbeddingStats(BaseModel):
     created: int
     updated: int
     errors: int
+    skipped: int = 0
 
 
 class SemanticSearchRequest(BaseModel):
@@ -29,6 +41,38 @@ class SemanticSearchResponse(BaseModel):
     total_results: int
 
 
+class BatchSearchQuery(BaseModel):
+    query: str
+    restaurant_id: int
+
+
+class BatchSemanticSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery]
+    limit: int = 5
+    similarity_threshold: float = 0.3
+    log_searches: bool = False  # offline jobs usually should not count as customer searches
+
+
+class BatchSearchResult(BaseModel):
+    query: str
+    restaurant_id: int
+    results: List[Dict[str, Any]]
+    total_results: int
+
+
+class BatchSemanticSearchResponse(BaseModel):
+    results: List[BatchSearchResult]
+    search_time_ms: int
+    total_queries: int
+
+
+MAX_BATCH_QUERIES = 1000
+
+
+class EmbeddingModelRequest(BaseModel):
+    model_name: str
+
+
 class KnowledgeBaseEntry(BaseModel):
     question: str
     answer: str
@@ -92,6 +136,51 @@ def search_products_semantic(request: SemanticSearchRequest, db: Session = Depen
         raise HTTPException(status_code=500, detail=f"Error in semantic search: {str(e)}")
 
 
+@router.post("/search/products/batch", response_model=BatchSemanticSearchResponse)
+def search_products_semantic_batch(request: BatchSemanticSearchRequest, db: Session = Depends(get_db)):
+    """Search products for many queries at once, optionally across restaurants"""
+    
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch")
+    
+    # Verify restaurants exist with a single lookup
+    restaurant_ids = {item.restaurant_id for item in request.queries}
+    found = {row.id for row in db.query(Restaurant.id).filter(Restaurant.id.in_(restaurant_ids)).all()}
+    missing = sorted(restaurant_ids - found)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Restaurants not found: {missing}")
+    
+    try:
+        import time
+        start_time = time.time()
+        
+        results = vector_search_service.search_products_batch(
+            [(item.query, item.restaurant_id) for item in request.queries],
+            db,
+            request.limit,
+            request.similarity_threshold,
+            log_searches=request.log_searches
+        )
+        
+        search_time = int((time.time() - start_time) * 1000)
+        
+        return BatchSemanticSearchResponse(
+            results=[
+                BatchSearchResult(
+                    query=item.query,
+                    restaurant_id=item.restaurant_id,
+                    results=products,
+                    total_results=len(products)
+                )
+                for item, products in zip(request.queries, results)
+            ],
+            search_time_ms=search_time,
+            total_queries=len(request.queries)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error in batch semantic search: {str(e)}")
+
+
 @router.post("/search/knowledge", response_model=SemanticSearchResponse)
 def search_knowledge_base(request: SemanticSearchRequest, db: Session = Depends(get_db)):
     """Search knowledge base using semantic similarity"""
@@ -205,6 +294,66 @@ def get_search_analytics(restaurant_id: int, days: int = 7, db: Session = Depend
         raise HTTPException(status_code=500, detail=f"Error getting analytics: {str(e)}")
 
 
+@router.post("/indexes/{restaurant_id}")
+def ensure_partial_indexes(restaurant_id: int, db: Session = Depends(get_db)):
+    """Create per-restaurant partial ANN indexes for tables above the size threshold"""
+    
+    restaurant = db.query(Restaurant).filter(Restaurant.id == restaurant_id).first()
+    if not restaurant:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    
+    try:
+        return {
+            "restaurant_id": restaurant_id,
+            "indexes": ensure_restaurant_partial_indexes(restaurant_id)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating indexes: {str(e)}")
+
+
+@router.get("/models")
+def list_embedding_models():
+    """Embedding models a restaurant can switch to"""
+    return {"models": [spec.to_dict() for spec in EMBEDDING_MODEL_SPECS.values()]}
+
+
+@router.get("/models/{restaurant_id}")
+def get_embedding_model_status(restaurant_id: int, db: Session = Depends(get_db)):
+    """Active embedding model and re-embedding progress of a restaurant"""
+    try:
+        return embedding_model_status(restaurant_id, db)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.post("/models/{restaurant_id}")
+def switch_embedding_model(restaurant_id: int, request: EmbeddingModelRequest, db: Session = Depends(get_db)):
+    """Switch a restaurant to another embedding model
+
+    Rows are re-embedded in the background and searches keep using the current model
+    until every row is done; the switch itself is atomic.
+    """
+    if request.model_name not in EMBEDDING_MODEL_SPECS:
+        raise HTTPException(status_code=400, detail=f"Unknown embedding model: {request.model_name}")
+    
+    try:
+        return embedding_migration_job.request(restaurant_id, request.model_name, db)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error switching embedding model: {str(e)}")
+
+
+@router.delete("/models/{restaurant_id}/migration")
+def cancel_embedding_migration(restaurant_id: int, db: Session = Depends(get_db)):
+    """Cancel a pending re-embedding; the current model stays active"""
+    try:
+        return embedding_migration_job.cancel(restaurant_id, db)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
 @router.get("/status")
 def get_vector_search_status():
     """Get vector search service status"""
@@ -214,7 +363,25 @@ def get_vector_search_status():
         "embedding_model": vector_search_service.model_name,
         "embedding_dimension": vector_search_service.embedding_dimension,
         "use_openai_embeddings": vector_search_service.use_openai_embeddings,
-        "model_loaded": vector_search_service.embedding_model is not None,
+        "model_loaded": embedding_model_registry.is_loaded(vector_search_service.model_name),
+        "embedding_models": embedding_model_registry.status,
+        "embedding_batcher": (
+            vector_search_service.embedding_batcher.stats
+            if vector_search_service.embedding_batcher else None
+        ),
+        "embedding_cache": vector_search_service.embedding_cache.stats,
+        "search_log_writer": search_log_writer.stats,
+        "search_analytics_rollup": search_analytics_rollup.info,
+        "latency_stats": latency_recorder.info,
+        "search_log_partitions": search_log_partitions.info,
+        "search_result_cache": search_result_cache.info,
+        "access_stats": access_stats.info,
+        "embedding_migration": embedding_migration_job.info,
+        "remote_embeddings": remote_embedding_stats(),
+        "vector_index": {
+            "enabled": restaurant_vector_index.enabled,
+            **restaurant_vector_index.stats
+        },
         "supported_operations": [
             "product_embeddings",
             "semantic_search", 
@@ -11,6 +11,9 @@ class Settings(BaseSettings):
     
     # Telegram
     telegram_bot_token: str = ""
+    telegram_concurrent_updates: int = 64  # chats handled at once (1 processes updates in order)
+    telegram_stream_responses: bool = True  # edit the reply as the LLM generates it
+    telegram_stream_edit_interval_seconds: float = 1.0  # minimum time between edits of one reply
     
     # Mercado Pago
     mercadopago_access_token: str = ""
@@ -19,6 +22,99 @@ class Settings(BaseSettings):
     openai_api_key: str = ""
     anthropic_api_key: str = ""
     
+    # Agent turns: blocking work (DB, embedding, search) runs on this many threads; LLM calls are async.
+    # Keep it at or below the SQLAlchemy pool size (5 + 10 overflow by default)
+    agent_worker_threads: int = 12
+    
+    # LLM prompt size: instructions and the message always go, then order, semantic hits,
+    # recent history and the menu fill the rest of the budget in that order
+    llm_context_token_budget: int = 3000
+    llm_context_menu_min_tokens: int = 600  # kept for the menu before history, so history cannot crowd it out
+    llm_history_max_messages: int = 20  # newest messages considered for the history
+    llm_tokenizer_encoding: str = "o200k_base"  # tiktoken encoding (gpt-4o family)
+    
+    # Embeddings
+    embedding_warm_up: bool = True  # load the model at startup instead of on the first search
+    embedding_model_retry_seconds: float = 30.0  # wait before retrying a failed load, doubled per failure
+    embedding_model_retry_max_seconds: float = 600.0
+    embedding_backend: str = "torch"  # 'torch', 'onnx' (needs onnxruntime) or 'worker'
+    embedding_worker_socket: str = "/tmp/sales_agent_embeddings.sock"  # comma-separated for a pool
+    embedding_worker_backend: str = "torch"  # what the worker processes run
+    embedding_onnx_dir: str = ".cache/onnx"
+    embedding_onnx_quantize: bool = True  # int8 dynamic quantization
+    embedding_onnx_threads: int = 0  # intra-op threads, 0 = min(4, cpu count)
+    embedding_batch_size: int = 32
+    embedding_batch_wait_ms: float = 5.0
+    embedding_cache_dir: str = ".cache/embeddings"  # empty disables the disk level
+    embedding_cache_memory_entries: int = 4096
+    embedding_cache_disk_entries: int = 100000
+    
+    # In-process vector index (empty dir disables it and searches go to pgvector)
+    vector_index_dir: str = ".cache/vector_index"
+    vector_index_max_age_seconds: int = 3600
+    
+    # Semantic search result cache (0 entries disables it); keys include the menu epoch
+    search_result_cache_entries: int = 2048
+    search_result_cache_ttl_seconds: int = 900
+    menu_epoch_dir: str = ".cache/menu_epochs"  # empty keeps epochs in-process only
+    
+    # Hourly search analytics rollups (log rows younger than the lag wait for the next run;
+    # the lag must exceed the time between a search log INSERT and its COMMIT)
+    analytics_rollup_interval_seconds: float = 60.0
+    analytics_rollup_lag_seconds: float = 60.0
+    analytics_rollup_batch_rows: int = 50000
+    
+    # Per-stage latency sketches (p50/p95/p99), flushed into hourly rows
+    latency_stats_flush_seconds: float = 10.0
+    
+    # Deferred access counters (memories access_count, knowledge base usage_count)
+    access_stats_flush_seconds: float = 5.0
+    
+    # Remote (OpenAI-compatible) embeddings: batched requests, concurrency cap, retries, token budget
+    remote_embedding_base_url: str = "https://api.openai.com/v1"
+    remote_embedding_max_batch_size: int = 256
+    remote_embedding_max_batch_tokens: int = 8000
+    remote_embedding_concurrency: int = 4
+    remote_embedding_max_retries: int = 5
+    remote_embedding_tokens_per_minute: int = 1000000
+    remote_embedding_timeout_seconds: float = 30.0
+    
+    # Re-embedding when a restaurant switches embedding model (rows per batch, pause between batches)
+    embedding_migration_batch_size: int = 64
+    embedding_migration_pause_seconds: float = 1.0
+    embedding_migration_poll_seconds: float = 30.0
+    
+    # Memory retrieval: limit * factor nearest candidates, reranked with these weights
+    memory_candidate_factor: int = 8
+    memory_weight_similarity: float = 0.6
+    memory_weight_importance: float = 0.2
+    memory_weight_recency: float = 0.15
+    memory_weight_access: float = 0.05
+    memory_recency_half_life_days: float = 30.0
+    
+    # pgvector ANN search tuning (0 leaves the server default)
+    hnsw_ef_search: int = 40
+    ivfflat_probes: int = 0
+    hnsw_iterative_scan: str = ""  # 'relaxed_order' on pgvector >= 0.8 keeps filtered scans from running dry
+    ann_partial_index_min_rows: int = 2000
+    
+    # First-pass vector scan: 'full', 'halfvec' or 'binary'; compact modes rerank
+    # vector_rerank_factor * limit candidates at full precision (pgvector >= 0.7, checked by
+    # the add_quantized_vectors migration)
+    vector_storage: str = "halfvec"
+    vector_rerank_factor: int = 4
+    
+    # Buffered search log writer
+    search_log_queue_size: int = 10000
+    search_log_batch_size: int = 500
+    search_log_flush_seconds: float = 2.0
+    search_query_id_cache_entries: int = 10000  # normalized query hash -> search_queries.id
+    
+    # search_logs daily partitions; retention drops whole days (0 keeps everything)
+    search_log_retention_days: int = 90
+    search_log_partition_days_ahead: int = 7
+    search_log_maintenance_interval_seconds: float = 3600.0
+    
     # JWT
     secret_key: str = "your-secret-key-change-in-production"
     algorithm: str = "HS256"
@@ -1,17 +1,80 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
 
 engine = create_engine(settings.database_url)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Connections opened with / without pgvector's adapters; vector_param only binds
+# NumPy arrays while no connection is missing them
+_vector_adapters = {'registered': 0, 'failed': 0}
+
+
+@event.listens_for(engine, "connect")
+def register_vector_types(dbapi_connection, connection_record):
+    """Register pgvector's driver adapters so NumPy arrays bind directly as vector parameters
+
+    psycopg (3) sends them in binary format; psycopg2 only speaks the text protocol,
+    there the adapter still saves building Python lists and the numeric[] -> vector cast.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+
+    try:
+        if engine.dialect.driver == "psycopg":
+            from pgvector.psycopg import register_vector
+        else:
+            from pgvector.psycopg2 import register_vector
+        register_vector(dbapi_connection)
+        _vector_adapters['registered'] += 1
+    except Exception as e:
+        # The vector extension may not exist yet (first setup). The driver cannot adapt
+        # NumPy arrays on this connection, so vectors are bound as lists from now on
+        _vector_adapters['failed'] += 1
+        logger.warning(
+            f"pgvector adapters not registered ({e}); binding vectors as lists until restart"
+        )
+    finally:
+        # Type lookups open a transaction; do not hand the connection to the pool inside it
+        dbapi_connection.rollback()
+
+
+def vector_adapters_registered() -> bool:
+    return _vector_adapters['registered'] > 0 and not _vector_adapters['failed']
+
+
+def vector_param(embedding):
+    """Float32 NumPy vector for binding as a pgvector parameter
+
+    Without the adapters it is a list: psycopg2 sends it as float8[], which casts to
+    vector, and the ORM Vector type accepts it too.
+    """
+    vector = np.ascontiguousarray(embedding, dtype=np.float32).reshape(-1)
+    return vector if vector_adapters_registered() else vector.tolist()
+
+
+def vector_array_param(embeddings) -> list:
+    """Vectors for a CAST(:param AS vector[]) parameter
+
+    Without the adapters each one is a '[x,y,...]' text literal: a list of lists would
+    bind as a two-dimensional float8[], which has no cast to vector[].
+    """
+    vectors = [np.ascontiguousarray(embedding, dtype=np.float32).reshape(-1) for embedding in embeddings]
+    if vector_adapters_registered():
+        return vectors
+    return ['[' + ','.join(repr(float(v)) for v in vector) + ']' for vector in vectors]
+
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
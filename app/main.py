@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from app.core.config import settings
@@ -49,7 +49,19 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    """Liveness: the process is up and serving requests"""
+    from app.services.embedding_models import embedding_model_registry
+    return {"status": "healthy", "ready": embedding_model_registry.ready}
+
+
+@app.get("/health/ready")
+def readiness_check(response: Response):
+    """Readiness: 503 until the warm-up embedding models are loaded"""
+    from app.services.embedding_models import embedding_model_registry
+    ready = embedding_model_registry.ready
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, "embedding_models": embedding_model_registry.status}
 
 
 @app.post("/setup")
@@ -140,12 +152,48 @@ async def startup_event():
     else:
         print("Telegram bot token not configured. Set TELEGRAM_BOT_TOKEN in .env file to enable bot.")
     
+    # Load the embedding model in the background; /health/ready reports when it is done
+    if settings.embedding_warm_up:
+        from app.services.embedding_models import embedding_model_registry
+        embedding_model_registry.warm_up()
+        print("Embedding model warm-up started in background")
+    
+    # Resume embedding model migrations left running by a previous process
+    from app.services.embedding_migration import embedding_migration_job
+    embedding_migration_job.start()
+    
+    # Keep the search analytics rollups current
+    from app.services.search_analytics import search_analytics_rollup
+    search_analytics_rollup.start()
+    
+    # Create upcoming search_logs partitions and drop expired ones
+    from app.services.search_log_partitions import search_log_partitions
+    search_log_partitions.start()
+    
     # Start inventory scheduler
     scheduler_thread = threading.Thread(target=start_inventory_scheduler, daemon=True)
     scheduler_thread.start()
     print("Inventory scheduler started in background")
 
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """Flush buffered background writers before the process exits"""
+    from app.services.search_log_writer import search_log_writer
+    from app.services.access_stats import access_stats
+    from app.services.embedding_migration import embedding_migration_job
+    from app.services.search_analytics import search_analytics_rollup
+    from app.services.search_log_partitions import search_log_partitions
+    from app.services.latency_stats import latency_recorder
+    search_log_writer.stop()
+    access_stats.stop()
+    embedding_migration_job.stop()
+    search_analytics_rollup.stop()
+    search_log_partitions.stop()
+    # After the log writer, whose final flush records log_write latencies
+    latency_recorder.stop()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -1,9 +1,9 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, JSON, Float
+from sqlalchemy import Column, Integer, BigInteger, String, Text, ForeignKey, DateTime, JSON, Float, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import ARRAY
 from app.core.database import Base
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC
 
 
 class ProductEmbedding(Base):
@@ -16,6 +16,8 @@ class ProductEmbedding(Base):
     
     # Text content that was embedded
     content = Column(Text)  # Combined name + description + category
+    content_hash = Column(String(64))  # sha256 of content, skips re-embedding unchanged products
+    content_version = Column(Integer)  # Version of the content builder that produced content
     
     # Vector embedding (1536 dimensions for OpenAI, 384 for sentence-transformers)
     embedding = Column(Vector(384))  # Using sentence-transformers default
@@ -92,18 +94,64 @@ class KnowledgeBase(Base):
     restaurant = relationship("Restaurant")
 
 
+class ModelEmbedding(Base):
+    """Embeddings from models other than the default, one row per (model, source row)"""
+    __tablename__ = "model_embeddings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    model_name = Column(String(100), nullable=False)
+    source_type = Column(String(20), nullable=False)  # 'product', 'knowledge', 'memory'
+    source_id = Column(Integer, nullable=False)  # products.id, knowledge_base.id or conversation_memories.id
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"))
+    customer_phone = Column(String)  # Memories only, for the per-customer filter
+
+    content_hash = Column(String(64))  # sha256 of the embedded text, skips unchanged rows
+    # Dimension depends on the model; searches cast to vector(n) per model
+    embedding = Column(Vector())
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('model_name', 'source_type', 'source_id', name='uq_model_embeddings_source'),
+        Index('ix_model_embeddings_lookup', 'model_name', 'source_type', 'restaurant_id'),
+    )
+
+    # Relationships
+    restaurant = relationship("Restaurant")
+
+
+class SearchQuery(Base):
+    """Distinct normalized search queries, shared by every log row that searched them"""
+    __tablename__ = "search_queries"
+
+    id = Column(BigInteger, primary_key=True)
+    query_hash = Column(String(64), unique=True, nullable=False)  # sha256 of the normalized query
+    query = Column(Text, nullable=False)  # normalized: lowercase, no accents, single spaces
+    embedding = Column(HALFVEC(384))  # Half precision, only kept for analytics
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
 class SearchLog(Base):
-    """Log semantic searches for analytics and improvement"""
+    """Log semantic searches for analytics and improvement
+
+    Range-partitioned by created_at, one partition per day; retention drops whole
+    partitions (see app/services/search_log_partitions.py).
+    """
     __tablename__ = "search_logs"
+    __table_args__ = {'postgresql_partition_by': 'RANGE (created_at)'}
 
-    id = Column(Integer, primary_key=True, index=True)
+    # The partition key has to be part of the primary key
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    # Stamped at insert, next to the id (the analytics rollup relies on it)
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.clock_timestamp())
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=True)
     restaurant_id = Column(Integer, ForeignKey("restaurants.id"))
     
     # Search details
-    query = Column(Text)
-    search_type = Column(String)  # 'products', 'knowledge', 'memory'
-    embedding = Column(Vector(384))
+    query_id = Column(BigInteger, ForeignKey("search_queries.id"))
+    search_type = Column(String(20))  # 'products', 'knowledge', 'memory'
     
     # Results
     results_found = Column(Integer)
@@ -113,9 +161,8 @@ class SearchLog(Base):
     # Performance
     search_time_ms = Column(Integer)
     embedding_time_ms = Column(Integer)
-    
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationships
     conversation = relationship("Conversation")
-    restaurant = relationship("Restaurant")
\ No newline at end of file
+    restaurant = relationship("Restaurant")
+    search_query = relationship("SearchQuery")
@@ -0,0 +1,62 @@
+from sqlalchemy import Column, Integer, BigInteger, String, Text, ForeignKey, DateTime, Float
+from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import ARRAY
+from app.core.database import Base
+
+
+class SearchStatsHourly(Base):
+    """Search counts, latency and similarity histograms per restaurant, search type and hour"""
+    __tablename__ = "search_stats_hourly"
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), primary_key=True)
+    search_type = Column(String(20), primary_key=True)  # 'products', 'knowledge', 'memory'
+    hour = Column(DateTime(timezone=True), primary_key=True)
+
+    searches = Column(Integer, nullable=False, default=0)
+    zero_results = Column(Integer, nullable=False, default=0)
+    results_found_sum = Column(BigInteger, nullable=False, default=0)
+    search_time_ms_sum = Column(BigInteger, nullable=False, default=0)
+    embedding_time_ms_sum = Column(BigInteger, nullable=False, default=0)
+
+    # Counts per bucket, see app/services/search_analytics.py for the bounds
+    latency_histogram = Column(ARRAY(Integer), nullable=False)
+    similarity_histogram = Column(ARRAY(Integer), nullable=False)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SearchQueryStatsDaily(Base):
+    """How often each normalized query was searched per restaurant and day"""
+    __tablename__ = "search_query_stats_daily"
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), primary_key=True)
+    day = Column(DateTime(timezone=True), primary_key=True)
+    query = Column(Text, primary_key=True)
+
+    searches = Column(Integer, nullable=False, default=0)
+    top_similarity_sum = Column(Float, nullable=False, default=0)
+
+
+class LatencySketchHourly(Base):
+    """Latency sketch per restaurant, stage and hour (bucket counts, see app/services/latency_stats.py)"""
+    __tablename__ = "latency_sketches_hourly"
+
+    restaurant_id = Column(Integer, ForeignKey("restaurants.id"), primary_key=True)
+    stage = Column(String(20), primary_key=True)  # see STAGES in app/services/latency_stats.py
+    hour = Column(DateTime(timezone=True), primary_key=True)
+
+    count = Column(BigInteger, nullable=False, default=0)
+    sum_ms = Column(Float, nullable=False, default=0)
+    max_ms = Column(Float, nullable=False, default=0)
+    buckets = Column(ARRAY(Integer), nullable=False)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class AnalyticsRollupState(Base):
+    """Watermark of each incremental rollup: the last source row already folded in"""
+    __tablename__ = "analytics_rollup_state"
+
+    name = Column(String(50), primary_key=True)
+    last_id = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,156 @@
+"""
+Deferred access statistics for conversation memories and knowledge base entries
+Searches record which rows they returned; a background thread folds the increments
+together and writes them with one bulk UPDATE per table, off the chat turn.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import text
+from app.core.config import settings
+from app.core.database import SessionLocal
+import logging
+
+logger = logging.getLogger(__name__)
+
+# table -> (count column, timestamp column)
+ACCESS_COLUMNS = {
+    'conversation_memories': ('access_count', 'last_accessed'),
+    'knowledge_base': ('usage_count', 'last_used'),
+}
+
+# Rows per UPDATE ... FROM (VALUES ...) statement
+FLUSH_CHUNK_SIZE = 1000
+
+Pending = Dict[int, Tuple[int, datetime]]
+
+
+class AccessStatsAccumulator:
+    """Coalesces access increments and last-access times in memory, flushed in bulk"""
+
+    def __init__(self, flush_interval_seconds: float = 5.0):
+        self.flush_interval = flush_interval_seconds
+        self._pending: Dict[str, Pending] = {table: {} for table in ACCESS_COLUMNS}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+
+        self.stats = {'recorded': 0, 'rows_written': 0, 'flushes': 0, 'errors': 0}
+
+    def record_memories(self, memory_ids: Iterable[int]):
+        """Count one retrieval for each memory"""
+        self._record('conversation_memories', memory_ids)
+
+    def record_knowledge(self, knowledge_ids: Iterable[int]):
+        """Count one use for each knowledge base entry"""
+        self._record('knowledge_base', knowledge_ids)
+
+    def _record(self, table: str, row_ids: Iterable[int]):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            pending = self._pending[table]
+            for row_id in row_ids:
+                count, _ = pending.get(row_id, (0, now))
+                pending[row_id] = (count + 1, now)
+                self.stats['recorded'] += 1
+        self._ensure_started()
+
+    def start(self):
+        """Start the flush thread"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._thread = threading.Thread(target=self._run, name="access-stats", daemon=True)
+            self._thread.start()
+            logger.info("Access stats accumulator started")
+
+    def stop(self):
+        """Stop the flush thread after writing what is still pending"""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.flush()
+        logger.info("Access stats accumulator stopped")
+
+    def _ensure_started(self):
+        if not self.running:
+            self.start()
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write all pending increments, one bulk UPDATE per table (and chunk)"""
+        with self._flush_lock:
+            with self._lock:
+                batches = {table: pending for table, pending in self._pending.items() if pending}
+                self._pending = {table: {} for table in ACCESS_COLUMNS}
+
+            for table, pending in batches.items():
+                if not self._write(table, pending):
+                    self._restore(table, pending)
+
+    def _restore(self, table: str, pending: Pending):
+        """Merge a failed batch back so the increments are retried on the next flush"""
+        with self._lock:
+            current = self._pending[table]
+            for row_id, (count, last_at) in pending.items():
+                existing_count, existing_at = current.get(row_id, (0, last_at))
+                current[row_id] = (existing_count + count, max(existing_at, last_at))
+
+    def _write(self, table: str, pending: Pending) -> bool:
+        count_column, time_column = ACCESS_COLUMNS[table]
+        # Sorted ids give every process the same row lock order
+        rows: List[Tuple[int, int, datetime]] = [
+            (row_id, count, last_at) for row_id, (count, last_at) in sorted(pending.items())
+        ]
+
+        db = SessionLocal()
+        try:
+            for offset in range(0, len(rows), FLUSH_CHUNK_SIZE):
+                chunk = rows[offset:offset + FLUSH_CHUNK_SIZE]
+                values = ", ".join(
+                    f"(CAST(:id_{i} AS integer), CAST(:hits_{i} AS integer), CAST(:at_{i} AS timestamptz))"
+                    for i in range(len(chunk))
+                )
+                params = {}
+                for i, (row_id, count, last_at) in enumerate(chunk):
+                    params.update({f"id_{i}": row_id, f"hits_{i}": count, f"at_{i}": last_at})
+
+                db.execute(text(f"""
+                    UPDATE {table} AS t
+                    SET {count_column} = COALESCE(t.{count_column}, 0) + v.hits,
+                        {time_column} = GREATEST(t.{time_column}, v.last_at)
+                    FROM (VALUES {values}) AS v(id, hits, last_at)
+                    WHERE t.id = v.id
+                """), params)
+
+            db.commit()
+            self.stats['rows_written'] += len(rows)
+            self.stats['flushes'] += 1
+            return True
+        except Exception as e:
+            logger.error(f"Error flushing access stats for {table} ({len(rows)} rows): {e}")
+            db.rollback()
+            self.stats['errors'] += 1
+            return False
+        finally:
+            db.close()
+
+    @property
+    def info(self) -> Dict[str, int]:
+        with self._lock:
+            pending = {f"pending_{table}": len(rows) for table, rows in self._pending.items()}
+        return {**self.stats, **pending}
+
+
+# Global accumulator instance
+access_stats = AccessStatsAccumulator(flush_interval_seconds=settings.access_stats_flush_seconds)
@@ -0,0 +1,110 @@
+"""
+ANN index helpers for pgvector
+Per-query search tuning and per-restaurant partial HNSW indexes
+"""
+from typing import Dict, Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import engine
+from app.services.vector_quantization import index_method, storage_mode
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Tables whose lookups are always filtered by restaurant_id
+PARTIAL_INDEX_TABLES = ['product_embeddings', 'knowledge_base', 'conversation_memories']
+
+
+def apply_search_tuning(
+    db: Session,
+    ef_search: Optional[int] = None,
+    probes: Optional[int] = None
+):
+    """Set ANN search parameters for the current transaction only
+
+    hnsw.ef_search is the candidate list size of an HNSW scan (recall vs latency);
+    ivfflat.probes is the number of lists an IVFFlat scan visits.
+    """
+    if ef_search is None:
+        ef_search = settings.hnsw_ef_search
+    if probes is None:
+        probes = settings.ivfflat_probes
+
+    # SET does not take bind parameters; values are forced to int
+    if ef_search:
+        db.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+    # Filtered HNSW scans (e.g. one customer's memories) keep walking the graph until LIMIT is met
+    if settings.hnsw_iterative_scan in ('relaxed_order', 'strict_order'):
+        db.execute(text(f"SET LOCAL hnsw.iterative_scan = {settings.hnsw_iterative_scan}"))
+    if probes:
+        db.execute(text(f"SET LOCAL ivfflat.probes = {int(probes)}"))
+
+
+def ensure_restaurant_partial_indexes(restaurant_id: int, min_rows: Optional[int] = None) -> Dict[str, str]:
+    """Build a partial HNSW index per table for a restaurant once it has enough rows
+
+    A global HNSW scan returns ef_search candidates from every restaurant and the
+    restaurant filter is applied afterwards, so small tenants in a large table get
+    too few results. A partial index limited to one restaurant avoids that.
+    """
+    if min_rows is None:
+        min_rows = settings.ann_partial_index_min_rows
+
+    restaurant_id = int(restaurant_id)
+    results = {}
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table in PARTIAL_INDEX_TABLES:
+            index_name = f"ix_{table}_embedding_{storage_mode()}_r{restaurant_id}"
+            try:
+                row_count = conn.execute(
+                    text(f"SELECT COUNT(*) FROM {table} WHERE restaurant_id = :restaurant_id"),
+                    {'restaurant_id': restaurant_id}
+                ).scalar()
+
+                if row_count < min_rows:
+                    results[table] = f"skipped ({row_count} rows)"
+                    continue
+
+                conn.execute(text(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table} "
+                    f"USING {index_method()} "
+                    f"WHERE restaurant_id = {restaurant_id}"
+                ))
+                results[table] = index_name
+                logger.info(f"Ensured partial ANN index {index_name} ({row_count} rows)")
+
+            except Exception as e:
+                logger.error(f"Error creating partial ANN index {index_name}: {e}")
+                results[table] = f"error: {e}"
+
+    return results
+
+
+def model_embedding_index_name(model_name: str) -> str:
+    """Name of a model's partial index on model_embeddings (same scheme as the migration)"""
+    slug = ''.join(c if c.isalnum() else '_' for c in model_name.rsplit('/', 1)[-1].lower())
+    return f"ix_model_embeddings_{slug}_halfvec"
+
+
+def ensure_model_embedding_index(model_name: str, dimension: int) -> str:
+    """Build the partial HNSW index for one model's rows in model_embeddings
+
+    Vectors of different dimensions share the table, so every model needs its own
+    expression index at its fixed dimension.
+    """
+    index_name = model_embedding_index_name(model_name)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(
+            text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON model_embeddings "
+                f"USING hnsw ((embedding::halfvec({int(dimension)})) halfvec_ip_ops) "
+                f"WITH (m = 16, ef_construction = 64) "
+                f"WHERE model_name = '{model_name.replace(chr(39), '')}'"
+            )
+        )
+    logger.info(f"Ensured model embedding index {index_name}")
+    return index_name
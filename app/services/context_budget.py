@@ -0,0 +1,159 @@
+"""
+Token-budgeted context for LLM prompts
+A turn's prompt is sized by llm_context_token_budget instead of fixed caps. The
+instructions, restaurant facts and the customer's message are always sent; the rest
+fills what is left, in priority order:
+
+    1. order state      the pending order (never dropped)
+    2. semantic hits    products, knowledge and memories found for the message
+    3. recent history   newest messages first, up to llm_history_max_messages
+    4. menu             the compiled menu, one product per category per round,
+                        with a note telling the model how many products were left out
+
+History leaves llm_context_menu_min_tokens for the menu (less when the whole menu is
+smaller); the note on a partial menu is only sent when it fits.
+
+Items that do not fit are skipped, so a long knowledge answer gives way to shorter
+ones behind it. What was dropped is returned in the turn's metadata.
+"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.services.system_prompt import (
+    CompiledPrompt, SEMANTIC_INSTRUCTION, SEMANTIC_SECTIONS, format_order, format_partial_menu_note
+)
+from app.services.token_counter import token_counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ContextAssembler:
+    """Fits system prompt and history of a turn into a token budget"""
+
+    def __init__(self, budget_tokens: int, menu_min_tokens: int = 0):
+        self.budget_tokens = budget_tokens
+        self.menu_min_tokens = menu_min_tokens
+        self._lock = threading.Lock()
+
+        self.stats = {'turns': 0, 'trimmed_turns': 0, 'over_budget_turns': 0}
+
+    def assemble(
+        self,
+        compiled: CompiledPrompt,
+        context: Dict[str, Any],
+        history: List[Dict[str, str]],
+        user_message: str
+    ) -> Tuple[str, List[Dict[str, str]], Dict[str, Any]]:
+        """System prompt, history to send and the turn's budget metadata"""
+        count = token_counter.count
+        customer_name = context.get('customer_name') or "cliente"
+
+        # Always sent
+        remaining = self.budget_tokens - (
+            compiled.base_tokens
+            + count(customer_name) * (len(compiled.instructions) - 1)
+            + token_counter.count_message(user_message)
+        )
+        dropped: Dict[str, int] = {}
+
+        # 1. Order state
+        remaining -= count(format_order(context.get('current_order')))
+
+        # 2. Semantic hits, the shared instruction paid with the first one kept
+        hits: Dict[str, List[Dict[str, Any]]] = {key: [] for key in SEMANTIC_SECTIONS}
+        kept_any = False
+        for key, (header, format_item) in SEMANTIC_SECTIONS.items():
+            for item in context.get(key) or []:
+                cost = count(format_item(item))
+                if not hits[key]:
+                    cost += count(header)
+                if not kept_any:
+                    cost += count(SEMANTIC_INSTRUCTION)
+                if cost <= remaining:
+                    hits[key].append(item)
+                    remaining -= cost
+                    kept_any = True
+                else:
+                    dropped[key] = dropped.get(key, 0) + 1
+
+        # 3. Recent history, leaving the menu its floor; stops at the first message that
+        # does not fit, a gap in the middle of the conversation would read as a different one
+        menu_floor = max(0, min(self.menu_min_tokens, compiled.menu_tokens, remaining))
+        kept_history: List[Dict[str, str]] = []
+        for message in reversed(history):
+            cost = token_counter.count_message(message['content'])
+            if cost > remaining - menu_floor:
+                break
+            kept_history.append(message)
+            remaining -= cost
+        kept_history.reverse()
+        if len(kept_history) < len(history):
+            dropped['history_messages'] = len(history) - len(kept_history)
+
+        # 4. Menu
+        menu, menu_sent, remaining = self._fit_menu(compiled, remaining)
+        if menu_sent < len(compiled.menu_entries):
+            dropped['menu_products'] = len(compiled.menu_entries) - menu_sent
+
+        prompt = compiled.render(customer_name, context.get('current_order'), {**context, **hits}, menu)
+
+        metadata = {
+            'budget_tokens': self.budget_tokens,
+            'tokens': self.budget_tokens - remaining,
+            'tokenizer': token_counter.info['backend'],
+            'menu_products': menu_sent,
+            'history_messages': len(kept_history),
+            'dropped': dropped
+        }
+
+        with self._lock:
+            self.stats['turns'] += 1
+            if dropped:
+                self.stats['trimmed_turns'] += 1
+            if remaining < 0:
+                self.stats['over_budget_turns'] += 1
+        if dropped:
+            logger.info(f"Prompt for restaurant {compiled.restaurant_id} trimmed to the token budget: {dropped}")
+
+        return prompt, kept_history, metadata
+
+    @staticmethod
+    def _fit_menu(compiled: CompiledPrompt, remaining: int) -> Tuple[Optional[str], int, int]:
+        """(menu text or None for the whole menu, products sent, tokens left)"""
+        entries = compiled.menu_entries
+        if compiled.menu_tokens <= remaining:
+            return None, len(entries), remaining - compiled.menu_tokens
+
+        # The note on the products left out is paid up front; without room for it
+        # no entry fits either
+        note_cost = token_counter.count(format_partial_menu_note(len(entries)))
+        if note_cost > remaining:
+            return "", 0, remaining
+        remaining -= note_cost
+        selected = []
+        categories = set()
+        for index in compiled.menu_fill_order:
+            category = entries[index][0]
+            cost = compiled.menu_entry_tokens[index]
+            if category not in categories:
+                cost += compiled.category_tokens[category]
+            if cost <= remaining:
+                selected.append(index)
+                categories.add(category)
+                remaining -= cost
+
+        return compiled.render_menu(selected), len(selected), remaining
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            'budget_tokens': self.budget_tokens,
+            'menu_min_tokens': self.menu_min_tokens,
+            'tokenizer': token_counter.info
+        }
+
+
+# Global assembler
+context_assembler = ContextAssembler(settings.llm_context_token_budget, settings.llm_context_menu_min_tokens)
@@ -1,19 +1,38 @@
+import asyncio
+import functools
 import openai
 import anthropic
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.orm import Session
 from app.models.conversation import Conversation
 from app.models.message import Message
-from app.models.product import Product
-from app.models.restaurant import Restaurant
 from app.models.order import Order, OrderItem
 from app.core.config import settings
-from typing import Dict, Any, List, Optional
+from app.services.latency_stats import latency_recorder
+from app.services.context_budget import context_assembler
+from app.services.system_prompt import system_prompt_cache
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional, Tuple
 import json
 import logging
+import time
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Shared by the blocking and the streaming calls
+OPENAI_COMPLETION_PARAMS = {
+    'model': "gpt-4o-mini",
+    'max_tokens': 300,
+    'temperature': 0.7,
+    'presence_penalty': 0.1,
+    'frequency_penalty': 0.1
+}
+ANTHROPIC_COMPLETION_PARAMS = {
+    'model': "claude-3-haiku-20240307",
+    'max_tokens_to_sample': 300,
+    'temperature': 0.7
+}
+
 
 class ConversationalAgent:
     """AI-powered conversational agent for restaurant sales"""
@@ -22,17 +41,28 @@ class ConversationalAgent:
         self.openai_client = None
         self.anthropic_client = None
         
-        # Initialize available LLM clients
+        # Initialize available LLM clients (async: a turn waiting on the LLM holds no thread)
         if hasattr(settings, 'openai_api_key') and settings.openai_api_key:
-            self.openai_client = openai.OpenAI(api_key=settings.openai_api_key)
+            self.openai_client = openai.AsyncOpenAI(api_key=settings.openai_api_key)
             
         if hasattr(settings, 'anthropic_api_key') and settings.anthropic_api_key:
-            self.anthropic_client = anthropic.Anthropic(api_key=settings.anthropic_api_key)
+            self.anthropic_client = anthropic.AsyncAnthropic(api_key=settings.anthropic_api_key)
         
         # Default to simple responses if no LLM configured
         self.use_llm = bool(self.openai_client or self.anthropic_client)
         
-    def generate_response(
+        # Blocking work of a turn (SQLAlchemy session, embedding, vector search) runs here,
+        # off the event loop and outside the server's shared threadpool
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.agent_worker_threads, thread_name_prefix="agent-turn"
+        )
+    
+    async def run_blocking(self, func: Callable, *args, **kwargs):
+        """Run a blocking call (DB access, embedding) on the agent's worker threads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        
+    async def generate_response(
         self, 
         user_message: str, 
         conversation: Conversation, 
@@ -42,11 +72,11 @@ class ConversationalAgent:
         """Generate intelligent response using LLM or fallback to keyword matching"""
         
         if self.use_llm:
-            return self._generate_llm_response(user_message, conversation, db, restaurant_context)
+            return await self._generate_llm_response(user_message, conversation, db, restaurant_context)
         else:
             return self._generate_simple_response(user_message)
     
-    def _generate_llm_response(
+    async def _generate_llm_response(
         self, 
         user_message: str, 
         conversation: Conversation, 
@@ -56,37 +86,57 @@ class ConversationalAgent:
         """Generate response using LLM"""
         
         try:
-            # Build context with semantic search
-            context = self._build_conversation_context(conversation, db, restaurant_context)
-            
-            # Enhance context with semantic search results
-            context = self._enhance_context_with_semantic_search(
-                user_message, conversation, db, context
+            # The session is only ever used by one worker thread at a time
+            prompt, recent_messages, restaurant_id = await self.run_blocking(
+                self._prepare_llm_request, user_message, conversation, db, restaurant_context
             )
             
-            # Create enhanced prompt with semantic results
-            if context.get('semantic_products') or context.get('relevant_knowledge') or context.get('customer_memories'):
-                prompt = self._create_enhanced_system_prompt(context)
-            else:
-                prompt = self._create_system_prompt(context)
-            
-            # Get conversation history
-            recent_messages = self._get_recent_messages(conversation.id, db)
-            
             # Generate response
             if self.openai_client:
-                return self._generate_openai_response(prompt, recent_messages, user_message)
+                with latency_recorder.measure('llm', restaurant_id):
+                    return await self._generate_openai_response(prompt, recent_messages, user_message)
             elif self.anthropic_client:
-                return self._generate_anthropic_response(prompt, recent_messages, user_message)
+                with latency_recorder.measure('llm', restaurant_id):
+                    return await self._generate_anthropic_response(prompt, recent_messages, user_message)
             else:
                 return self._generate_simple_response(user_message)
                 
         except Exception as e:
             logger.error(f"Error generating LLM response: {e}")
             # Rollback the database session to recover from error
-            db.rollback()
+            await self.run_blocking(db.rollback)
             return self._generate_simple_response(user_message)
     
+    def _prepare_llm_request(
+        self,
+        user_message: str,
+        conversation: Conversation,
+        db: Session,
+        restaurant_context: Optional[Dict] = None
+    ) -> Tuple[str, List[Dict[str, str]], int]:
+        """System prompt, recent history and restaurant id for a turn (blocking)"""
+        
+        # Build context with semantic search
+        context = self._build_conversation_context(conversation, db, restaurant_context)
+        
+        # Enhance context with semantic search results
+        context = self._enhance_context_with_semantic_search(
+            user_message, conversation, db, context
+        )
+        
+        # Get conversation history
+        recent_messages = self._get_recent_messages(conversation.id, db, limit=settings.llm_history_max_messages)
+        
+        # Order, semantic hits, history and menu, fitted to the token budget
+        prompt, recent_messages, budget = context_assembler.assemble(
+            context['compiled_prompt'], context, recent_messages, user_message
+        )
+        
+        # What the turn's prompt left out stays with the conversation (committed by the caller)
+        conversation.context = {**(conversation.context or {}), 'prompt_budget': budget}
+        
+        return prompt, recent_messages, conversation.restaurant_id
+    
     def _build_conversation_context(
         self, 
         conversation: Conversation, 
@@ -95,27 +145,8 @@ class ConversationalAgent:
     ) -> Dict[str, Any]:
         """Build comprehensive context for the conversation"""
         
-        # Get restaurant info
-        restaurant = db.query(Restaurant).filter(
-            Restaurant.id == conversation.restaurant_id
-        ).first()
-        
-        # Get available products by category (limit to avoid large prompts)
-        products = db.query(Product).filter(
-            Product.restaurant_id == conversation.restaurant_id,
-            Product.available == True
-        ).limit(20).all()  # Limit for prompt efficiency
-        
-        products_by_category = {}
-        for product in products:
-            if product.category not in products_by_category:
-                products_by_category[product.category] = []
-            products_by_category[product.category].append({
-                'id': product.id,
-                'name': product.name,
-                'description': product.description,
-                'price': product.price
-            })
+        # Restaurant and menu come from the compiled prompt, cached per menu epoch
+        compiled = system_prompt_cache.get(conversation.restaurant_id, db)
         
         # Get current order if exists
         current_order = db.query(Order).filter(
@@ -139,113 +170,14 @@ class ConversationalAgent:
             }
         
         return {
-            'restaurant': {
-                'name': restaurant.name if restaurant else 'Restaurante',
-                'description': restaurant.description if restaurant else '',
-                'config': restaurant.config if restaurant else {}
-            },
-            'products_by_category': products_by_category,
+            'restaurant': compiled.restaurant,
+            'products_by_category': compiled.products_by_category,
             'current_order': order_summary,
             'customer_name': conversation.customer_name,
-            'conversation_context': conversation.context or {}
+            'conversation_context': conversation.context or {},
+            'compiled_prompt': compiled
         }
     
-    def _create_system_prompt(self, context: Dict[str, Any]) -> str:
-        """Create comprehensive system prompt for the LLM"""
-        
-        restaurant = context['restaurant']
-        products_by_category = context['products_by_category']
-        current_order = context['current_order']
-        customer_name = context['customer_name']
-        
-        prompt = f"""Eres un asistente virtual especializado en ventas para {restaurant['name']}, un restaurante colombiano. 
-
-TU OBJETIVO PRINCIPAL: Ayudar al cliente a realizar pedidos de comida de manera amigable y eficiente.
-
-INFORMACIÓN DEL RESTAURANTE:
-- Nombre: {restaurant['name']}
-- Descripción: {restaurant.get('description', 'Restaurante colombiano tradicional')}
-- Horario: Lunes a Domingo, 10:00 AM - 10:00 PM
-- Entrega: 30-45 minutos en toda la ciudad
-- Costo de entrega: $3,000 COP
-
-MENÚ DISPONIBLE:"""
-
-        # Add products by category
-        for category, products in products_by_category.items():
-            prompt += f"\n\n--- {category.upper()} ---"
-            for product in products:
-                prompt += f"\n• {product['name']} - ${product['price']:,.0f}"
-                if product['description']:
-                    prompt += f"\n  {product['description']}"
-        
-        # Add current order info
-        if current_order:
-            prompt += f"\n\nPEDIDO ACTUAL DEL CLIENTE:"
-            for item in current_order['items']:
-                prompt += f"\n• {item['name']} x{item['quantity']} = ${item['total']:,.0f}"
-            prompt += f"\nTotal actual: ${current_order['total']:,.0f}"
-        else:
-            prompt += f"\n\nEL CLIENTE AÚN NO TIENE PRODUCTOS EN SU PEDIDO."
-        
-        prompt += f"""
-
-INSTRUCCIONES DE COMPORTAMIENTO:
-
-1. PERSONALIZACIÓN:
-   - Dirígete al cliente como "{customer_name}" cuando sea apropiado
-   - Sé cálido, amigable y profesional
-   - Usa el contexto colombiano naturalmente
-
-2. PROCESO DE VENTA:
-   - Saluda al cliente y presenta el restaurante
-   - Pregunta por sus preferencias o antoja
-   - Recomienda productos específicos del menú
-   - Explica los productos cuando lo pidas
-   - Ayuda a construir el pedido paso a paso
-   - Confirma cada item agregado
-   - Sugiere complementos apropiados
-
-3. RECOMENDACIONES INTELIGENTES:
-   - Si pide "algo típico": recomienda Bandeja Paisa o Sancocho
-   - Si pregunta por entradas: sugiere empanadas o patacones
-   - Si quiere bebidas: recomienda limonada de coco o jugos naturales
-   - Para postres: sugiere tres leches o flan de coco
-   - Siempre menciona el precio cuando recomiendes
-
-4. RESPUESTAS A CONSULTAS:
-   - Horarios: "Estamos abiertos todos los días de 10:00 AM a 10:00 PM"
-   - Entrega: "Hacemos entregas en 30-45 minutos por $3,000 adicionales"
-   - Precios: Siempre menciona precios específicos del menú
-   - Disponibilidad: Solo ofrece productos que están en el menú actual
-
-5. MANEJO DEL PEDIDO:
-   - Usa frases como "perfecto, he agregado..." cuando confirmes items
-   - Mantén un resumen claro del pedido
-   - Sugiere cuando el pedido esté completo para proceder al pago
-   - Pregunta por detalles de entrega si es necesario
-
-6. TONO Y ESTILO:
-   - Natural y conversacional
-   - Entusiasta pero no agresivo
-   - Usa emojis moderadamente (🍽️ 🥘 😊)
-   - Evita ser repetitivo
-   - Responde de manera concisa pero completa
-
-7. LIMITACIONES:
-   - NO agregues productos automáticamente al pedido
-   - NO inventes productos que no están en el menú
-   - NO prometas tiempos de entrega diferentes a 30-45 minutos
-   - Si no sabes algo específico, ofrece contactar directamente
-
-EJEMPLO DE CONVERSACIÓN IDEAL:
-Cliente: "Hola, tengo hambre"
-Tú: "¡Hola {customer_name}! 😊 ¿Qué antojo tienes hoy? Tenemos deliciosos platos típicos colombianos. ¿Te provoca algo contundente como una Bandeja Paisa ($28,000) o prefieres empezar con unas empanadas ($8,000)?"
-
-RESPONDE SIEMPRE EN ESPAÑOL y mantén el foco en ayudar al cliente a completar su pedido de manera natural y eficiente."""
-
-        return prompt
-    
     def _get_recent_messages(self, conversation_id: int, db: Session, limit: int = 10) -> List[Dict[str, str]]:
         """Get recent conversation messages for context"""
         
@@ -266,7 +198,7 @@ RESPONDE SIEMPRE EN ESPAÑOL y mantén el foco en ayudar al cliente a completar
         
         return conversation_history
     
-    def _generate_openai_response(
+    async def _generate_openai_response(
         self, 
         system_prompt: str, 
         conversation_history: List[Dict[str, str]], 
@@ -275,23 +207,9 @@ RESPONDE SIEMPRE EN ESPAÑOL y mantén el foco en ayudar al cliente a completar
         """Generate response using OpenAI GPT"""
         
         try:
-            messages = [
-                {"role": "system", "content": system_prompt}
-            ]
-            
-            # Add conversation history
-            messages.extend(conversation_history)
-            
-            # Add current message
-            messages.append({"role": "user", "content": user_message})
-            
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=300,
-                temperature=0.7,
-                presence_penalty=0.1,
-                frequency_penalty=0.1
+            response = await self.openai_client.chat.completions.create(
+                messages=self._openai_messages(system_prompt, conversation_history, user_message),
+                **OPENAI_COMPLETION_PARAMS
             )
             
             return response.choices[0].message.content.strip()
@@ -300,7 +218,7 @@ RESPONDE SIEMPRE EN ESPAÑOL y mantén el foco en ayudar al cliente a completar
             logger.error(f"OpenAI API error: {e}")
             return self._generate_simple_response(user_message)
     
-    def _generate_anthropic_response(
+    async def _generate_anthropic_response(
         self, 
         system_prompt: str, 
         conversation_history: List[Dict[str, str]], 
@@ -309,23 +227,9 @@ RESPONDE SIEMPRE EN ESPAÑOL y mantén el foco en ayudar al cliente a completar
         """Generate response using Anthropic Claude"""
         
         try:
-            # Build conversation for Claude
-            conversation_text = ""
-            for msg in conversation_history:
-                if msg["role"] == "user":
-                    conversation_text += f"\n\nHuman: {msg['content']}"
-                else:
-                    conversation_text += f"\n\nAssistant: {msg['content']}"
-            
-            conversation_text += f"\n\nHuman: {user_message}\n\nAssistant:"
-            
-            full_prompt = system_prompt + conversation_text
-            
-            response = self.anthropic_client.completions.create(
-                model="claude-3-haiku-20240307",
-                prompt=full_prompt,
-                max_tokens_to_sample=300,
-                temperature=0.7
+            response = await self.anthropic_client.completions.create(
+                prompt=self._anthropic_prompt(system_prompt, conversation_history, user_message),
+                **ANTHROPIC_COMPLETION_PARAMS
             )
             
             return response.completion.strip()
@@ -334,6 +238,99 @@ RESPONDE SIEMPRE EN ESPAÑOL y mantén el foco en ayudar al cliente a completar
             logger.error(f"Anthropic API error: {e}")
             return self._generate_simple_response(user_message)
     
+    @staticmethod
+    def _openai_messages(
+        system_prompt: str,
+        conversation_history: List[Dict[str, str]],
+        user_message: str
+    ) -> List[Dict[str, str]]:
+        """Chat messages: system prompt, history, current message"""
+        return [
+            {"role": "system", "content": system_prompt},
+            *conversation_history,
+            {"role": "user", "content": user_message}
+        ]
+    
+    @staticmethod
+    def _anthropic_prompt(
+        system_prompt: str,
+        conversation_history: List[Dict[str, str]],
+        user_message: str
+    ) -> str:
+        """Human/Assistant completion prompt for Claude"""
+        turns = [
+            f"\n\nHuman: {msg['content']}" if msg["role"] == "user" else f"\n\nAssistant: {msg['content']}"
+            for msg in conversation_history
+        ]
+        return system_prompt + "".join(turns) + f"\n\nHuman: {user_message}\n\nAssistant:"
+    
+    async def stream_response(
+        self,
+        user_message: str,
+        conversation: Conversation,
+        db: Session,
+        restaurant_context: Optional[Dict] = None
+    ) -> AsyncIterator[str]:
+        """Yield the reply as text deltas while the LLM generates it
+        
+        Without an LLM, or if it fails before producing any text, the keyword
+        fallback is yielded as a single delta.
+        """
+        
+        if not self.use_llm:
+            yield self._generate_simple_response(user_message)
+            return
+        
+        produced = False
+        try:
+            prompt, recent_messages, restaurant_id = await self.run_blocking(
+                self._prepare_llm_request, user_message, conversation, db, restaurant_context
+            )
+            
+            start = time.perf_counter()
+            with latency_recorder.measure('llm', restaurant_id):
+                async for delta in self._stream_llm(prompt, recent_messages, user_message):
+                    if not produced:
+                        latency_recorder.record('llm_first_token', restaurant_id, (time.perf_counter() - start) * 1000)
+                        produced = True
+                    yield delta
+        
+        except Exception as e:
+            logger.error(f"Error streaming LLM response: {e}")
+            await self.run_blocking(db.rollback)
+        
+        if not produced:
+            yield self._generate_simple_response(user_message)
+    
+    async def _stream_llm(
+        self,
+        system_prompt: str,
+        conversation_history: List[Dict[str, str]],
+        user_message: str
+    ) -> AsyncIterator[str]:
+        """Text deltas from whichever LLM is configured"""
+        
+        if self.openai_client:
+            stream = await self.openai_client.chat.completions.create(
+                messages=self._openai_messages(system_prompt, conversation_history, user_message),
+                stream=True,
+                **OPENAI_COMPLETION_PARAMS
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        
+        elif self.anthropic_client:
+            stream = await self.anthropic_client.completions.create(
+                prompt=self._anthropic_prompt(system_prompt, conversation_history, user_message),
+                stream=True,
+                **ANTHROPIC_COMPLETION_PARAMS
+            )
+            async for event in stream:
+                if event.completion:
+                    yield event.completion
+    
     def _generate_simple_response(self, message: str) -> str:
         """Fallback to simple keyword-based responses"""
         message_lower = message.lower()
@@ -429,43 +426,28 @@ RESPONDE SIEMPRE EN ESPAÑOL y mantén el foco en ayudar al cliente a completar
             
             enhanced_context = context.copy()
             
-            # Semantic product search
-            relevant_products = vector_search_service.search_products_semantic(
-                user_message, 
-                conversation.restaurant_id, 
-                db, 
-                limit=3
-            )
-            
-            if relevant_products:
-                enhanced_context['semantic_products'] = relevant_products
-                logger.info(f"Found {len(relevant_products)} semantically relevant products")
-            
-            # Search knowledge base
-            knowledge_items = vector_search_service.search_knowledge_base(
+            # One embedding and one DB round trip for products, knowledge and memories
+            hits = vector_search_service.search_all(
                 user_message,
                 conversation.restaurant_id,
                 db,
-                limit=2
+                customer_phone=conversation.customer_phone,
+                product_limit=3,
+                knowledge_limit=2,
+                memory_limit=2
             )
             
-            if knowledge_items:
-                enhanced_context['relevant_knowledge'] = knowledge_items
-                logger.info(f"Found {len(knowledge_items)} relevant knowledge items")
+            if hits['products']:
+                enhanced_context['semantic_products'] = hits['products']
+                logger.info(f"Found {len(hits['products'])} semantically relevant products")
             
-            # Search conversation memory for this customer
-            if conversation.customer_phone:
-                memories = vector_search_service.search_conversation_memory(
-                    user_message,
-                    conversation.customer_phone,
-                    conversation.restaurant_id,
-                    db,
-                    limit=2
-                )
-                
-                if memories:
-                    enhanced_context['customer_memories'] = memories
-                    logger.info(f"Found {len(memories)} relevant customer memories")
+            if hits['knowledge']:
+                enhanced_context['relevant_knowledge'] = hits['knowledge']
+                logger.info(f"Found {len(hits['knowledge'])} relevant knowledge items")
+            
+            if hits['memories']:
+                enhanced_context['customer_memories'] = hits['memories']
+                logger.info(f"Found {len(hits['memories'])} relevant customer memories")
             
             return enhanced_context
             
@@ -474,34 +456,6 @@ RESPONDE SIEMPRE EN ESPAÑOL y mantén el foco en ayudar al cliente a completar
             # Rollback the database session to recover from error
             db.rollback()
             return context  # Return original context without semantic enhancement
-    
-    def _create_enhanced_system_prompt(self, context: Dict[str, Any]) -> str:
-        """Create enhanced system prompt with semantic search results"""
-        
-        base_prompt = self._create_system_prompt(context)
-        
-        # Add semantic search results to prompt
-        if context.get('semantic_products'):
-            base_prompt += "\n\n🎯 PRODUCTOS MÁS RELEVANTES PARA ESTA CONSULTA:"
-            for product in context['semantic_products']:
-                base_prompt += f"\n• {product['name']} - ${product['price']:,.0f}"
-                if product['description']:
-                    base_prompt += f" - {product['description']}"
-                base_prompt += f" (relevancia: {product['similarity_score']:.1f})"
-        
-        if context.get('relevant_knowledge'):
-            base_prompt += "\n\n📚 INFORMACIÓN RELEVANTE DEL RESTAURANTE:"
-            for item in context['relevant_knowledge']:
-                base_prompt += f"\nP: {item['question']}\nR: {item['answer']}"
-        
-        if context.get('customer_memories'):
-            base_prompt += "\n\n🧠 RECORDAR SOBRE ESTE CLIENTE:"
-            for memory in context['customer_memories']:
-                base_prompt += f"\n• {memory['summary']} ({memory['memory_type']})"
-        
-        base_prompt += "\n\n⚡ INSTRUCCIÓN ESPECIAL: Usa la información de relevancia semántica arriba para dar respuestas más precisas y personalizadas."
-        
-        return base_prompt
 
 
 # Global agent instance
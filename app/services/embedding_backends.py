@@ -0,0 +1,210 @@
+"""
+Embedding inference backends
+PyTorch through sentence-transformers, or the same model exported to ONNX and run
+with ONNX Runtime (optionally int8 dynamically quantized) on CPU. Hosted OpenAI
+embedding models go through the embeddings API.
+
+Tolerance against the PyTorch output, mean-pooled and unit-normalized
+(checked with benchmark_embedding_backends.py):
+    onnx, fp32  cosine >= 0.9999
+    onnx, int8  cosine >= 0.98
+"""
+import os
+import tempfile
+import numpy as np
+from typing import List, Optional
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKENDS = ('torch', 'onnx', 'worker')
+
+# Minimum cosine similarity to the PyTorch embedding of the same text
+ONNX_COSINE_TOLERANCE = {'fp32': 0.9999, 'int8': 0.98}
+
+
+class SentenceTransformerBackend:
+    """PyTorch inference via sentence-transformers"""
+
+    name = 'torch'
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts, batch_size=len(texts), convert_to_numpy=True, normalize_embeddings=True
+        )
+
+
+class OnnxEmbeddingBackend:
+    """ONNX Runtime inference of a sentence-transformers model (mean pooling + L2 norm)"""
+
+    name = 'onnx'
+
+    def __init__(
+        self,
+        model_name: str,
+        model_dir: str,
+        quantize: bool = True,
+        intra_op_threads: int = 0,
+        max_seq_length: int = 256
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.max_seq_length = max_seq_length
+        self.path = os.path.join(model_dir, model_name.replace("/", "__"))
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model_path = self._ensure_exported()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads or min(4, os.cpu_count() or 1)
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        logger.info(
+            f"ONNX embedding backend ready: {model_path} "
+            f"({options.intra_op_num_threads} intra-op threads)"
+        )
+
+    @property
+    def variant(self) -> str:
+        return 'int8' if self.quantize else 'fp32'
+
+    def _ensure_exported(self) -> str:
+        """Export the transformer to ONNX once, then quantize; files are reused across processes"""
+        fp32_path = os.path.join(self.path, "model.onnx")
+        int8_path = os.path.join(self.path, "model.int8.onnx")
+
+        if not os.path.exists(fp32_path):
+            os.makedirs(self.path, exist_ok=True)
+            self._export(fp32_path)
+
+        if not self.quantize:
+            return fp32_path
+
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            tmp_path = self._temp_path(int8_path)
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+            logger.info(f"Quantized ONNX embedding model to int8: {int8_path}")
+
+        return int8_path
+
+    def _temp_path(self, path: str) -> str:
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".onnx.tmp")
+        os.close(fd)
+        return tmp_path
+
+    def _export(self, path: str):
+        import torch
+        from transformers import AutoModel
+
+        model = AutoModel.from_pretrained(self.model_name)
+        model.eval()
+
+        sample = self.tokenizer(["hola"], return_tensors="pt")
+        names = ["input_ids", "attention_mask", "token_type_ids"]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        # Write to a temp file so a concurrent process never loads a half-written graph
+        tmp_path = self._temp_path(path)
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in names),
+                tmp_path,
+                input_names=names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14
+            )
+        os.replace(tmp_path, path)
+        logger.info(f"Exported {self.model_name} to ONNX: {path}")
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        tokens = self.tokenizer(
+            texts, padding=True, truncation=True,
+            max_length=self.max_seq_length, return_tensors="np"
+        )
+        inputs = {name: tokens[name].astype(np.int64) for name in self.input_names if name in tokens}
+        hidden = self.session.run(None, inputs)[0]
+
+        # Mean pooling over real tokens, as sentence-transformers does for this model
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+class OpenAIEmbeddingBackend:
+    """OpenAI (or OpenAI-compatible) embeddings endpoint through the batched remote client"""
+
+    name = 'openai'
+
+    def __init__(self, model_name: str, api_key: Optional[str] = None, base_url: Optional[str] = None):
+        # Local import: the remote client needs httpx, which local backends do not
+        from app.services.remote_embeddings import get_remote_embedding_client
+
+        api_key = api_key or settings.openai_api_key
+        base_url = base_url or settings.remote_embedding_base_url
+        if not api_key and "api.openai.com" in base_url:
+            raise ValueError("openai_api_key is not configured")
+
+        self.model_name = model_name
+        self.client = get_remote_embedding_client(base_url, api_key)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        # Split into batched requests, run concurrently and paced by the token budget
+        return self.client.embed(texts, self.model_name)
+
+
+def backend_identity(model_name: str, backend: Optional[str] = None) -> str:
+    """Name cached embeddings by the backend that produced them"""
+    backend = backend or settings.embedding_backend
+    if backend == 'worker':
+        # Embeddings come from whatever backend the worker processes run
+        return backend_identity(model_name, settings.embedding_worker_backend)
+    if backend == 'onnx':
+        return f"{model_name}@onnx-{'int8' if settings.embedding_onnx_quantize else 'fp32'}"
+    return model_name
+
+
+def create_embedding_backend(model_name: str, backend: Optional[str] = None):
+    """Build the configured backend, falling back to PyTorch if ONNX Runtime is unavailable"""
+    backend = backend or settings.embedding_backend
+
+    if backend == 'worker':
+        # Local import: embedding_worker imports this module inside the worker process
+        from app.services.embedding_worker import RemoteEmbeddingBackend
+        return RemoteEmbeddingBackend(model_name)
+
+    if backend == 'onnx':
+        try:
+            return OnnxEmbeddingBackend(
+                model_name,
+                settings.embedding_onnx_dir,
+                quantize=settings.embedding_onnx_quantize,
+                intra_op_threads=settings.embedding_onnx_threads
+            )
+        except ImportError as e:
+            logger.warning(f"ONNX backend unavailable ({e}), using sentence-transformers")
+    elif backend != 'torch':
+        logger.warning(f"Unknown embedding backend '{backend}', using sentence-transformers")
+
+    return SentenceTransformerBackend(model_name)
@@ -0,0 +1,111 @@
+"""
+Micro-batching dispatcher for embedding models
+Collects concurrent encode requests for a few milliseconds and runs them as one batch
+"""
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Coalesce concurrent single-text encode calls into batched model calls"""
+
+    def __init__(
+        self,
+        encode_batch: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "embedding-batcher"
+    ):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._in_flight: Dict[str, Future] = {}  # text -> future shared by every caller asking for it
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        self.stats = {'requests': 0, 'deduplicated': 0, 'batches': 0, 'encoded_texts': 0}
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for encoding and return a future resolving to its vector"""
+        with self._lock:
+            self.stats['requests'] += 1
+            future = self._in_flight.get(text)
+            if future is not None:
+                # Same text already waiting or encoding, share its result
+                self.stats['deduplicated'] += 1
+                return future
+
+            future = Future()
+            self._in_flight[text] = future
+            self._ensure_worker()
+
+        self._queue.put(text)
+        return future
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """Encode one text through the batch queue"""
+        # Callers that were deduplicated share the same array, hand each one its own copy
+        return np.array(self.submit(text).result(timeout), copy=True)
+
+    def encode_many(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        """Encode several texts through the batch queue, preserving order"""
+        futures = [self.submit(text) for text in texts]
+        return np.stack([np.array(future.result(timeout), copy=True) for future in futures])
+
+    def _ensure_worker(self):
+        """Start the dispatcher thread on first use (caller holds the lock)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _collect_batch(self) -> List[str]:
+        """Block for the first text, then gather more until the batch is full or the window closes"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        """Dispatcher loop"""
+        while True:
+            batch = self._collect_batch()
+
+            try:
+                vectors = self.encode_batch(batch)
+                error = None
+            except Exception as e:
+                logger.error(f"Error encoding batch of {len(batch)} texts: {e}")
+                vectors = None
+                error = e
+
+            with self._lock:
+                futures = [self._in_flight.pop(text) for text in batch]
+                self.stats['batches'] += 1
+                self.stats['encoded_texts'] += len(batch)
+
+            for i, future in enumerate(futures):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(vectors[i])
+
+            logger.debug(f"Encoded batch of {len(batch)} texts")
@@ -0,0 +1,243 @@
+"""
+Two-level embedding cache
+In-process LRU in front of a memory-mapped float32 store on disk, keyed by model and text hash
+"""
+import fcntl
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SIZE = 20  # sha1
+STORE_FORMAT = 3  # bump when stored vectors or slot placement change (2: unit-normalized, 3: hashed sets)
+SET_WAYS = 8  # slots a digest can live in
+
+
+def normalize_embedding_text(text: str) -> str:
+    """Normalize text before hashing so trivial whitespace differences share an entry"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class DiskEmbeddingStore:
+    """Fixed-capacity vector store on memory-mapped files, set-associative
+
+    A digest can only live in the SET_WAYS slots of the set its hash selects, so
+    the files themselves are the index: every process that opens the directory
+    finds entries written by the others, and a full set evicts its least recently
+    used slot. Writers take a cross-process lock; readers re-check the slot's key
+    after copying the vector, so a slot rewritten meanwhile is a miss, never the
+    wrong vector.
+    """
+
+    def __init__(self, path: str, dimension: int, capacity: int):
+        self.path = path
+        self.dimension = dimension
+        self.sets = max(1, -(-capacity // SET_WAYS))
+        self.capacity = self.sets * SET_WAYS
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(path, "store.lock"), "a+")
+        with self._file_lock():
+            self._open_files()
+
+        self.evictions = 0
+
+    @contextmanager
+    def _file_lock(self):
+        """Cross-process exclusive lock for writers"""
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _open_files(self):
+        """Open the memory-mapped files of this layout, creating any that are missing
+
+        Each layout (format, dimension, slot count) lives in its own subdirectory, so
+        processes still running with another layout keep their files untouched. A file
+        is created under a temporary name and moved into place, never truncated in place.
+        """
+        layout = f"f{STORE_FORMAT}-d{self.dimension}-s{self.sets}x{SET_WAYS}"
+        self.layout_path = os.path.join(self.path, layout)
+        os.makedirs(self.layout_path, exist_ok=True)
+
+        files = {
+            '_vectors': ("vectors.f32", np.float32, (self.capacity, self.dimension)),
+            '_keys': ("keys.bin", np.uint8, (self.capacity, DIGEST_SIZE)),
+            '_stamps': ("stamps.f64", np.float64, (self.capacity,)),
+        }
+        for attr, (name, dtype, shape) in files.items():
+            file_path = os.path.join(self.layout_path, name)
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            if not os.path.exists(file_path) or os.path.getsize(file_path) != size:
+                tmp_path = f"{file_path}.{os.getpid()}.tmp"
+                np.memmap(tmp_path, dtype=dtype, mode="w+", shape=shape).flush()
+                os.replace(tmp_path, file_path)
+            setattr(self, attr, np.memmap(file_path, dtype=dtype, mode="r+", shape=shape))
+
+        self._remove_stale_layouts(layout)
+
+    def _remove_stale_layouts(self, layout: str):
+        """Unlink files of other layouts; processes that still map them keep their copy
+        until they exit (caller holds the file lock)"""
+        for entry in os.listdir(self.path):
+            entry_path = os.path.join(self.path, entry)
+            if entry == layout or entry == "store.lock":
+                continue
+            try:
+                if os.path.isdir(entry_path):
+                    for name in os.listdir(entry_path):
+                        os.remove(os.path.join(entry_path, name))
+                    os.rmdir(entry_path)
+                else:
+                    # Files of the single-directory layout used before
+                    os.remove(entry_path)
+                logger.info(f"Removed stale embedding cache layout {entry_path}")
+            except OSError as e:
+                logger.warning(f"Could not remove stale embedding cache layout {entry_path}: {e}")
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._keys.any(axis=1)))
+
+    def _slots(self, digest: bytes) -> range:
+        first = int.from_bytes(digest[:8], "little") % self.sets * SET_WAYS
+        return range(first, first + SET_WAYS)
+
+    def _find(self, digest: bytes, slots: range) -> Optional[int]:
+        key = np.frombuffer(digest, dtype=np.uint8)
+        matches = np.flatnonzero((self._keys[slots.start:slots.stop] == key).all(axis=1))
+        return slots.start + int(matches[0]) if len(matches) else None
+
+    def get(self, digest: bytes) -> Optional[np.ndarray]:
+        """Return a copy of the stored vector or None"""
+        slot = self._find(digest, self._slots(digest))
+        if slot is None:
+            return None
+
+        vector = np.array(self._vectors[slot], copy=True)
+        if self._keys[slot].tobytes() != digest:
+            # Slot rewritten by another writer while we copied
+            return None
+
+        self._stamps[slot] = time.time()
+        return vector
+
+    def put(self, digest: bytes, vector: np.ndarray):
+        """Store a vector, evicting the least recently used slot of its set when full"""
+        slots = self._slots(digest)
+        with self._lock, self._file_lock():
+            slot = self._find(digest, slots)
+            if slot is None:
+                empty = np.flatnonzero(~self._keys[slots.start:slots.stop].any(axis=1))
+                if len(empty):
+                    slot = slots.start + int(empty[0])
+                else:
+                    slot = slots.start + int(np.argmin(self._stamps[slots.start:slots.stop]))
+                    self.evictions += 1
+
+            # Clear the key first so concurrent readers never match a half-written vector
+            self._keys[slot] = 0
+            self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+            self._keys[slot] = np.frombuffer(digest, dtype=np.uint8)
+            self._stamps[slot] = time.time()
+
+
+class EmbeddingCache:
+    """LRU in memory, memory-mapped store on disk, one instance per embedding model"""
+
+    def __init__(
+        self,
+        model_name: str,
+        dimension: int,
+        cache_dir: Optional[str] = None,
+        memory_entries: int = 4096,
+        disk_entries: int = 100000
+    ):
+        self.model_name = model_name
+        self.dimension = dimension
+        self.memory_entries = memory_entries
+
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'memory_evictions': 0}
+
+        self._disk = None
+        if cache_dir and disk_entries > 0:
+            model_dir = re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)
+            try:
+                self._disk = DiskEmbeddingStore(os.path.join(cache_dir, model_dir), dimension, disk_entries)
+                logger.info(f"Embedding disk cache for {model_name}: {len(self._disk)} entries")
+            except Exception as e:
+                logger.error(f"Error opening embedding disk cache: {e}")
+
+    def _digest(self, text: str) -> bytes:
+        return hashlib.sha1(normalize_embedding_text(text).encode("utf-8")).digest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Look up a text in memory, then on disk"""
+        digest = self._digest(text)
+
+        with self._lock:
+            vector = self._memory.get(digest)
+            if vector is not None:
+                self._memory.move_to_end(digest)
+                self._counters['memory_hits'] += 1
+                return vector.copy()
+
+        if self._disk is not None:
+            vector = self._disk.get(digest)
+            if vector is not None:
+                with self._lock:
+                    self._counters['disk_hits'] += 1
+                    # The caller owns the returned array
+                    self._remember(digest, vector.copy())
+                return vector
+
+        with self._lock:
+            self._counters['misses'] += 1
+        return None
+
+    def put(self, text: str, vector: np.ndarray):
+        """Store a freshly computed vector in both levels"""
+        digest = self._digest(text)
+        vector = np.asarray(vector, dtype=np.float32)
+
+        with self._lock:
+            self._remember(digest, vector)
+
+        if self._disk is not None:
+            try:
+                self._disk.put(digest, vector)
+            except Exception as e:
+                logger.error(f"Error writing embedding disk cache: {e}")
+
+    def _remember(self, digest: bytes, vector: np.ndarray):
+        """Insert into the in-memory LRU (caller holds the lock)"""
+        self._memory[digest] = vector
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self._counters['memory_evictions'] += 1
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and sizes"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 3) if lookups else 0.0
+        stats['disk_entries'] = len(self._disk) if self._disk is not None else 0
+        stats['disk_evictions'] = self._disk.evictions if self._disk is not None else 0
+        return stats
@@ -0,0 +1,158 @@
+"""
+Searchable content builders for embeddings
+Shared by every vector search service so the same product always yields the same text
+"""
+import hashlib
+import numpy as np
+from typing import Callable, Dict, List
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.models.embeddings import ProductEmbedding
+from app.models.product import Product
+from app.services.embedding_models import EmbeddingModelUnavailable
+from app.services.menu_epoch import menu_epochs
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when build_product_content changes so stored embeddings are rebuilt
+PRODUCT_CONTENT_VERSION = 1
+
+
+def build_product_content(product: Product) -> str:
+    """Build the text that gets embedded for a product"""
+    content_parts = [product.name]
+    if product.description:
+        content_parts.append(product.description)
+    content_parts.append(product.category)
+
+    # Add price context in Spanish
+    if product.price < 10000:
+        content_parts.append("económico barato accesible")
+    elif product.price > 25000:
+        content_parts.append("premium caro exclusivo")
+    else:
+        content_parts.append("precio medio estándar")
+
+    # Add Colombian food context
+    name = product.name.lower()
+    if 'bandeja' in name:
+        content_parts.append("típico tradicional colombiano completo")
+    elif 'empanada' in name:
+        content_parts.append("frito entrada aperitivo")
+    elif 'sancocho' in name:
+        content_parts.append("sopa caliente tradicional familiar")
+    elif 'arepa' in name:
+        content_parts.append("maíz tradicional desayuno")
+
+    return " ".join(content_parts)
+
+
+def content_hash(content: str) -> str:
+    """Stable hash of embedded content"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def upsert_product_embeddings(
+    restaurant_id: int,
+    db: Session,
+    embed_texts: Callable[[List[str]], np.ndarray],
+    model_name: str
+) -> Dict[str, int]:
+    """Embed only products whose content changed and write them with one upsert"""
+
+    products = db.query(Product).filter(
+        Product.restaurant_id == restaurant_id,
+        Product.available == True
+    ).all()
+
+    existing = {
+        row.product_id: row
+        for row in db.query(
+            ProductEmbedding.product_id,
+            ProductEmbedding.content_hash,
+            ProductEmbedding.content_version,
+            ProductEmbedding.embedding_model
+        ).filter(ProductEmbedding.restaurant_id == restaurant_id).all()
+    }
+
+    stats = {'created': 0, 'updated': 0, 'skipped': 0, 'errors': 0}
+    pending = []
+
+    for product in products:
+        try:
+            content = build_product_content(product)
+        except Exception as e:
+            logger.error(f"Error building embedding content for product {product.id}: {e}")
+            stats['errors'] += 1
+            continue
+        digest = content_hash(content)
+        current = existing.get(product.id)
+
+        if (current is not None
+                and current.content_hash == digest
+                and current.content_version == PRODUCT_CONTENT_VERSION
+                and current.embedding_model == model_name):
+            stats['skipped'] += 1
+            continue
+
+        pending.append((product, content, digest))
+
+    if not pending:
+        logger.info(f"Product embeddings: {stats}")
+        return stats
+
+    try:
+        # One encode call for every changed product
+        embeddings = embed_texts([content for _, content, _ in pending])
+
+        rows = [
+            {
+                'product_id': product.id,
+                'restaurant_id': restaurant_id,
+                'content': content,
+                'content_hash': digest,
+                'content_version': PRODUCT_CONTENT_VERSION,
+                'embedding': embedding,
+                'embedding_model': model_name
+            }
+            for (product, content, digest), embedding in zip(pending, embeddings)
+        ]
+
+        stmt = insert(ProductEmbedding).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ProductEmbedding.product_id],
+            set_={
+                'restaurant_id': stmt.excluded.restaurant_id,
+                'content': stmt.excluded.content,
+                'content_hash': stmt.excluded.content_hash,
+                'content_version': stmt.excluded.content_version,
+                'embedding': stmt.excluded.embedding,
+                'embedding_model': stmt.excluded.embedding_model,
+                'updated_at': func.now()
+            }
+        )
+        db.execute(stmt)
+        db.commit()
+        # Core upserts bypass the ORM flush events that normally advance the epoch
+        menu_epochs.bump(restaurant_id)
+
+        for product, _, _ in pending:
+            if product.id in existing:
+                stats['updated'] += 1
+            else:
+                stats['created'] += 1
+
+    except EmbeddingModelUnavailable as e:
+        # Nothing written: the rows keep their old hash and are embedded on the next run
+        logger.warning(f"Embedding model {e} unavailable, {len(pending)} product embeddings left for the next run")
+        stats['errors'] += len(pending)
+    except Exception as e:
+        logger.error(f"Error upserting product embeddings for restaurant {restaurant_id}: {e}")
+        db.rollback()
+        stats['errors'] += len(pending)
+
+    logger.info(f"Product embeddings: {stats}")
+    return stats
@@ -0,0 +1,301 @@
+"""
+Background re-embedding when a restaurant changes embedding model
+Products, knowledge base entries and memories are embedded with the target model in
+small throttled batches while searches keep using the current model. Progress lives in
+Restaurant.config['embedding_migration'], so a restart resumes where it stopped. Once
+every row is embedded the active model is switched in a single transaction.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.restaurant import Restaurant
+from app.services.ann_indexes import ensure_model_embedding_index
+from app.services.embedding_models import DEFAULT_EMBEDDING_MODEL, get_model_spec
+from app.services.menu_epoch import menu_epochs
+from app.services.model_embeddings import (
+    ACTIVE_MODEL_KEY, MIGRATION_KEY, SOURCE_TYPES, changed_items, encode_items, source_items,
+    store_model_embeddings, upsert_model_embeddings
+)
+from app.services.vector_index import restaurant_vector_index
+from sqlalchemy.orm import Session
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _locked_restaurant(restaurant_id: int, db: Session) -> Optional[Restaurant]:
+    return db.query(Restaurant).filter(Restaurant.id == restaurant_id).with_for_update().first()
+
+
+def _set_config(restaurant: Restaurant, config: Dict[str, Any]):
+    # Assign a new dict: in-place changes to a JSON column are not detected
+    restaurant.config = config
+
+
+def embedding_model_status(restaurant_id: int, db: Session) -> Dict[str, Any]:
+    """Active model and migration progress of a restaurant"""
+    restaurant = db.query(Restaurant).filter(Restaurant.id == restaurant_id).first()
+    if restaurant is None:
+        raise ValueError(f"Restaurant {restaurant_id} not found")
+    config = restaurant.config or {}
+    return {
+        'restaurant_id': restaurant_id,
+        'active_model': config.get(ACTIVE_MODEL_KEY) or DEFAULT_EMBEDDING_MODEL,
+        'migration': config.get(MIGRATION_KEY)
+    }
+
+
+class EmbeddingMigrationJob:
+    """Thread that re-embeds restaurants with running migrations, one batch at a time"""
+
+    def __init__(self, batch_size: int = 64, pause_seconds: float = 1.0, poll_seconds: float = 30.0):
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+
+        self.stats = {'batches': 0, 'embedded': 0, 'switched': 0, 'errors': 0}
+
+    def request(self, restaurant_id: int, model_name: str, db: Session) -> Dict[str, Any]:
+        """Start moving a restaurant to another embedding model
+
+        The default model is always kept current in the native columns, so switching
+        back to it is immediate; any other model is migrated in the background.
+        """
+        spec = get_model_spec(model_name)
+
+        restaurant = _locked_restaurant(restaurant_id, db)
+        if restaurant is None:
+            raise ValueError(f"Restaurant {restaurant_id} not found")
+
+        config = dict(restaurant.config or {})
+        active = config.get(ACTIVE_MODEL_KEY) or DEFAULT_EMBEDDING_MODEL
+
+        if model_name == active:
+            config.pop(MIGRATION_KEY, None)
+            _set_config(restaurant, config)
+            db.commit()
+        elif spec.native:
+            config.pop(MIGRATION_KEY, None)
+            _set_config(restaurant, config)
+            self._switch(restaurant_id, model_name, db, restaurant=restaurant)
+        else:
+            config[MIGRATION_KEY] = {
+                'target': model_name,
+                'status': 'running',
+                'source_type': SOURCE_TYPES[0],
+                'after_id': 0,
+                'embedded': 0,
+                'started_at': datetime.now(timezone.utc).isoformat(),
+                'error': None
+            }
+            _set_config(restaurant, config)
+            db.commit()
+            logger.info(f"Embedding migration requested for restaurant {restaurant_id}: {active} -> {model_name}")
+            self.start()
+            self._wake.set()
+
+        return embedding_model_status(restaurant_id, db)
+
+    def cancel(self, restaurant_id: int, db: Session) -> Dict[str, Any]:
+        """Drop a pending migration; rows already embedded stay for a later attempt"""
+        restaurant = _locked_restaurant(restaurant_id, db)
+        if restaurant is None:
+            raise ValueError(f"Restaurant {restaurant_id} not found")
+        config = dict(restaurant.config or {})
+        config.pop(MIGRATION_KEY, None)
+        _set_config(restaurant, config)
+        db.commit()
+        return embedding_model_status(restaurant_id, db)
+
+    def start(self):
+        """Start the migration thread; migrations left running by a previous process resume"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._thread = threading.Thread(target=self._run, name="embedding-migration", daemon=True)
+            self._thread.start()
+            logger.info("Embedding migration job started")
+
+    def stop(self):
+        """Stop after the current batch; progress is already committed"""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=30)
+        logger.info("Embedding migration job stopped")
+
+    def _run(self):
+        while self.running:
+            try:
+                worked = self.run_once()
+            except Exception as e:
+                logger.error(f"Error in embedding migration job: {e}")
+                self.stats['errors'] += 1
+                worked = False
+
+            if worked:
+                # Throttle: searches and regular embedding work share the model and database
+                time.sleep(self.pause_seconds)
+            else:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def run_once(self) -> bool:
+        """One batch for every restaurant with a running migration; False if there was nothing to do"""
+        db = SessionLocal()
+        try:
+            pending = [
+                (restaurant_id, config[MIGRATION_KEY]['target'])
+                for restaurant_id, config in db.query(Restaurant.id, Restaurant.config).all()
+                if config and (config.get(MIGRATION_KEY) or {}).get('status') == 'running'
+            ]
+            db.rollback()
+
+            for restaurant_id, target in pending:
+                if not self.running:
+                    break
+                self._step(restaurant_id, target, db)
+            return bool(pending)
+        finally:
+            db.close()
+
+    def _step(self, restaurant_id: int, target: str, db: Session):
+        """Embed the next batch of one restaurant, committing rows and progress together
+
+        The batch is read and encoded with no transaction open; the restaurant row is
+        locked only to write the vectors and advance the cursor, so config edits and
+        menu-epoch bumps never wait for the model. If the migration moved on while the
+        batch was encoded, the batch is dropped. A row edited meanwhile keeps the hash of
+        the content that was read, so _finish embeds it again.
+        """
+        try:
+            config = dict(db.query(Restaurant.config).filter(Restaurant.id == restaurant_id).scalar() or {})
+            state = dict(config.get(MIGRATION_KEY) or {})
+            if state.get('target') != target or state.get('status') != 'running':
+                db.rollback()  # cancelled or replaced meanwhile
+                return
+
+            if state['source_type'] == SOURCE_TYPES[0] and state['after_id'] == 0:
+                db.rollback()  # CREATE INDEX CONCURRENTLY waits for open transactions
+                spec = get_model_spec(target)
+                ensure_model_embedding_index(spec.name, spec.dimension)
+
+            items = source_items(
+                state['source_type'], restaurant_id, db,
+                after_id=state['after_id'], limit=self.batch_size
+            )
+            pending = changed_items(target, state['source_type'], items, db)
+            db.rollback()
+
+            embeddings = encode_items(target, pending) if pending else None
+
+            restaurant = _locked_restaurant(restaurant_id, db)
+            locked_config = dict(restaurant.config or {}) if restaurant else {}
+            if (
+                locked_config.get(MIGRATION_KEY) != config.get(MIGRATION_KEY)
+                or locked_config.get(ACTIVE_MODEL_KEY) != config.get(ACTIVE_MODEL_KEY)
+            ):
+                db.rollback()  # cursor or model changed while encoding
+                return
+            config = locked_config
+
+            if items:
+                store_model_embeddings(target, state['source_type'], restaurant_id, pending, embeddings, db)
+                state['after_id'] = items[-1][0]
+                state['embedded'] += len(pending)
+                self.stats['batches'] += 1
+                self.stats['embedded'] += len(pending)
+            else:
+                index = SOURCE_TYPES.index(state['source_type'])
+                if index + 1 < len(SOURCE_TYPES):
+                    state['source_type'] = SOURCE_TYPES[index + 1]
+                    state['after_id'] = 0
+                else:
+                    db.rollback()
+                    self._finish(restaurant_id, target, db)
+                    return
+
+            config[MIGRATION_KEY] = state
+            _set_config(restaurant, config)
+            db.commit()
+
+        except Exception as e:
+            db.rollback()
+            self.stats['errors'] += 1
+            logger.error(f"Embedding migration of restaurant {restaurant_id} to {target} failed: {e}")
+            self._mark_failed(restaurant_id, target, str(e), db)
+
+    def _finish(self, restaurant_id: int, target: str, db: Session):
+        """Catch up on rows that changed behind the cursor, then switch"""
+        for source_type in SOURCE_TYPES:
+            items = source_items(source_type, restaurant_id, db)
+            for offset in range(0, len(items), self.batch_size):
+                upsert_model_embeddings(
+                    target, source_type, restaurant_id, items[offset:offset + self.batch_size], db
+                )
+                db.commit()
+        self._switch(restaurant_id, target, db)
+
+    def _switch(
+        self,
+        restaurant_id: int,
+        target: str,
+        db: Session,
+        restaurant: Optional[Restaurant] = None
+    ):
+        """Make target the active model in one transaction, then invalidate derived caches"""
+        restaurant = restaurant or _locked_restaurant(restaurant_id, db)
+        config = dict(restaurant.config or {})
+        migration = config.get(MIGRATION_KEY) or {}
+        if migration and migration.get('target') not in (None, target):
+            db.rollback()
+            return
+
+        previous = config.get(ACTIVE_MODEL_KEY) or DEFAULT_EMBEDDING_MODEL
+        config[ACTIVE_MODEL_KEY] = target
+        config.pop(MIGRATION_KEY, None)
+        _set_config(restaurant, config)
+        db.commit()
+
+        # Cached results, snapshots and the active-model lookup are all keyed on the epoch
+        menu_epochs.bump(restaurant_id)
+        restaurant_vector_index.invalidate(restaurant_id)
+        self.stats['switched'] += 1
+        logger.info(f"Restaurant {restaurant_id} switched embedding model: {previous} -> {target}")
+
+    def _mark_failed(self, restaurant_id: int, target: str, error: str, db: Session):
+        try:
+            restaurant = _locked_restaurant(restaurant_id, db)
+            config = dict(restaurant.config or {})
+            state = dict(config.get(MIGRATION_KEY) or {})
+            if state.get('target') == target:
+                state.update({'status': 'failed', 'error': error[:500]})
+                config[MIGRATION_KEY] = state
+                _set_config(restaurant, config)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error recording failed embedding migration for restaurant {restaurant_id}: {e}")
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        return {**self.stats, 'running': self.running}
+
+
+# Global job instance
+embedding_migration_job = EmbeddingMigrationJob(
+    batch_size=settings.embedding_migration_batch_size,
+    pause_seconds=settings.embedding_migration_pause_seconds,
+    poll_seconds=settings.embedding_migration_poll_seconds
+)
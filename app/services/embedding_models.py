@@ -0,0 +1,202 @@
+"""
+Process-wide embedding model registry
+Every service asks the registry for its model, so each model is loaded at most once
+per process: on first use, or ahead of traffic through warm_up().
+
+EMBEDDING_MODEL_SPECS lists the models a restaurant can search with. The default model
+is stored in the native vector(384) columns; every other model is stored in the
+model_embeddings table, where vectors of any dimension live side by side.
+"""
+import threading
+import time
+import numpy as np
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.services.embedding_backends import OpenAIEmbeddingBackend, create_embedding_backend
+from app.services.embedding_batcher import EmbeddingBatcher
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class EmbeddingModelUnavailable(RuntimeError):
+    """The model could not be loaded; there is no vector to store or search with"""
+
+
+class EmbeddingModelSpec:
+    """What a model produces and where its vectors are stored"""
+
+    def __init__(self, name: str, dimension: int, provider: str = 'local', storage: str = 'model_embeddings'):
+        self.name = name
+        self.dimension = dimension
+        self.provider = provider  # 'local' (torch / onnx / worker) or 'openai'
+        self.storage = storage  # 'native' columns or the 'model_embeddings' table
+
+    @property
+    def native(self) -> bool:
+        return self.storage == 'native'
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            'name': self.name,
+            'dimension': self.dimension,
+            'provider': self.provider,
+            'storage': self.storage
+        }
+
+
+EMBEDDING_MODEL_SPECS: Dict[str, EmbeddingModelSpec] = {
+    spec.name: spec for spec in (
+        EmbeddingModelSpec(DEFAULT_EMBEDDING_MODEL, 384, 'local', 'native'),
+        EmbeddingModelSpec("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2", 384, 'local'),
+        EmbeddingModelSpec("text-embedding-3-small", 1536, 'openai'),
+        EmbeddingModelSpec("text-embedding-ada-002", 1536, 'openai'),
+    )
+}
+
+
+def get_model_spec(model_name: str) -> EmbeddingModelSpec:
+    """Spec of a registered model; ValueError for unknown models"""
+    spec = EMBEDDING_MODEL_SPECS.get(model_name)
+    if spec is None:
+        raise ValueError(f"Unknown embedding model: {model_name}")
+    return spec
+
+
+class LoadedEmbeddingModel:
+    """A loaded backend plus the micro-batcher every caller of that model shares"""
+
+    def __init__(self, model_name: str, backend):
+        self.model_name = model_name
+        self.backend = backend
+        self.batcher = EmbeddingBatcher(
+            self.encode_batch,
+            max_batch_size=settings.embedding_batch_size,
+            max_wait_ms=settings.embedding_batch_wait_ms,
+            name=f"embedding-batcher-{model_name.rsplit('/', 1)[-1]}"
+        )
+
+    @property
+    def backend_name(self) -> str:
+        return self.backend.name
+
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        """Encode a batch of texts in a single model call, unit-normalized"""
+        return self.backend.encode(texts)
+
+
+class EmbeddingModelRegistry:
+    """Loads embedding models lazily, once, and reports readiness"""
+
+    def __init__(self):
+        self._models: Dict[str, LoadedEmbeddingModel] = {}
+        self._errors: Dict[str, str] = {}
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}  # a failed load is tried again after this time
+        self._load_seconds: Dict[str, float] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._warm_up_models: List[str] = []
+
+    def _backing_off(self, model_name: str) -> bool:
+        return time.time() < self._retry_at.get(model_name, 0.0)
+
+    def get(self, model_name: str = DEFAULT_EMBEDDING_MODEL) -> Optional[LoadedEmbeddingModel]:
+        """Return the model, loading it on first use; None if it failed to load
+
+        A failed load (download timeout, out of memory) is retried once the backoff
+        since the last failure has passed.
+        """
+        model = self._models.get(model_name)
+        if model is not None or self._backing_off(model_name):
+            return model
+
+        with self._lock:
+            model_lock = self._locks.setdefault(model_name, threading.Lock())
+
+        # Per-model lock: concurrent first callers wait for one load instead of each loading
+        with model_lock:
+            model = self._models.get(model_name)
+            if model is not None or self._backing_off(model_name):
+                return model
+
+            start = time.time()
+            try:
+                spec = EMBEDDING_MODEL_SPECS.get(model_name)
+                if spec is not None and spec.provider == 'openai':
+                    backend = OpenAIEmbeddingBackend(model_name)
+                else:
+                    backend = create_embedding_backend(model_name)
+                model = LoadedEmbeddingModel(model_name, backend)
+            except Exception as e:
+                failures = self._failures.get(model_name, 0) + 1
+                delay = min(
+                    settings.embedding_model_retry_seconds * 2 ** (failures - 1),
+                    settings.embedding_model_retry_max_seconds
+                )
+                logger.error(f"Error loading embedding model {model_name} (retrying in {delay:.0f}s): {e}")
+                self._errors[model_name] = str(e)
+                self._failures[model_name] = failures
+                self._retry_at[model_name] = time.time() + delay
+                return None
+
+            self._models[model_name] = model
+            self._errors.pop(model_name, None)
+            self._failures.pop(model_name, None)
+            self._retry_at.pop(model_name, None)
+            self._load_seconds[model_name] = round(time.time() - start, 2)
+            logger.info(
+                f"Loaded embedding model: {model_name} ({model.backend_name}) "
+                f"in {self._load_seconds[model_name]}s"
+            )
+            return model
+
+    def is_loaded(self, model_name: str = DEFAULT_EMBEDDING_MODEL) -> bool:
+        """Check without triggering a load"""
+        return model_name in self._models
+
+    def peek(self, model_name: str = DEFAULT_EMBEDDING_MODEL) -> Optional[LoadedEmbeddingModel]:
+        """The model if it is already loaded, never loads"""
+        return self._models.get(model_name)
+
+    def warm_up(self, model_names: Optional[List[str]] = None, background: bool = True):
+        """Load models ahead of the first request"""
+        model_names = model_names or [DEFAULT_EMBEDDING_MODEL]
+        self._warm_up_models = list(model_names)
+
+        def load_all():
+            for model_name in model_names:
+                model = self.get(model_name)
+                if model is not None:
+                    # One tiny encode so lazy kernel / graph initialization happens now too
+                    model.encode_batch(["warm up"])
+
+        if background:
+            threading.Thread(target=load_all, name="embedding-warm-up", daemon=True).start()
+        else:
+            load_all()
+
+    @property
+    def ready(self) -> bool:
+        """True once every model requested by warm_up is loaded"""
+        return all(self.is_loaded(model_name) for model_name in self._warm_up_models)
+
+    @property
+    def status(self) -> Dict[str, Dict]:
+        names = set(self._models) | set(self._errors) | set(self._warm_up_models)
+        return {
+            model_name: {
+                'loaded': model_name in self._models,
+                'backend': self._models[model_name].backend_name if model_name in self._models else None,
+                'load_seconds': self._load_seconds.get(model_name),
+                'error': self._errors.get(model_name),
+                'failed_loads': self._failures.get(model_name, 0)
+            }
+            for model_name in sorted(names)
+        }
+
+
+# Global registry instance
+embedding_model_registry = EmbeddingModelRegistry()
@@ -0,0 +1,165 @@
+"""
+Out-of-process embedding worker
+One process holds the model weights and serves every API, Telegram and scheduler
+process over a local Unix socket, so inference does not run under their GIL.
+
+Run one worker per socket; list several sockets in EMBEDDING_WORKER_SOCKET
+(comma-separated) for a small pool that clients spread requests across:
+
+    python -m app.services.embedding_worker --socket /tmp/sales_agent_embeddings.sock
+
+API processes use it with EMBEDDING_BACKEND=worker.
+"""
+import argparse
+import hashlib
+import itertools
+import os
+import threading
+import numpy as np
+from multiprocessing.connection import Client, Listener
+from typing import List, Optional
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _authkey() -> bytes:
+    # Connections unpickle what they receive, so only peers that share the app secret may talk
+    return hashlib.sha256(f"embedding-worker:{settings.secret_key}".encode()).digest()
+
+
+def worker_sockets() -> List[str]:
+    return [path.strip() for path in settings.embedding_worker_socket.split(",") if path.strip()]
+
+
+class RemoteEmbeddingBackend:
+    """Thin client for embedding workers, used as a backend by the model registry"""
+
+    name = 'worker'
+
+    def __init__(self, model_name: str, socket_paths: Optional[List[str]] = None, timeout: float = 30.0):
+        self.model_name = model_name
+        self.socket_paths = socket_paths or worker_sockets()
+        if not self.socket_paths:
+            raise ValueError("EMBEDDING_WORKER_SOCKET is not configured")
+        self.timeout = timeout
+        self._next_socket = itertools.cycle(range(len(self.socket_paths)))
+        self._local = threading.local()  # one connection per calling thread
+
+    def _connection(self, index: int):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        if index not in connections:
+            connections[index] = Client(self.socket_paths[index], family='AF_UNIX', authkey=_authkey())
+        return connections[index]
+
+    def _drop_connection(self, index: int):
+        connection = getattr(self._local, 'connections', {}).pop(index, None)
+        if connection is not None:
+            try:
+                connection.close()
+            except OSError:
+                pass
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode on the next worker in the pool, trying the others if it is down"""
+        start = next(self._next_socket)
+        last_error = None
+
+        for offset in range(len(self.socket_paths)):
+            index = (start + offset) % len(self.socket_paths)
+            try:
+                connection = self._connection(index)
+                connection.send(('encode', self.model_name, list(texts)))
+                if not connection.poll(self.timeout):
+                    raise TimeoutError(f"no reply within {self.timeout}s")
+                status, payload = connection.recv()
+            except (OSError, EOFError, TimeoutError) as e:
+                last_error = e
+                self._drop_connection(index)
+                logger.warning(f"Embedding worker {self.socket_paths[index]} unavailable: {e}")
+                continue
+
+            if status != 'ok':
+                raise RuntimeError(f"Embedding worker error: {payload}")
+            return payload
+
+        raise ConnectionError(f"No embedding worker reachable: {last_error}")
+
+
+class EmbeddingWorkerServer:
+    """Serves encode requests for one socket; concurrent clients share a micro-batcher"""
+
+    def __init__(self, socket_path: str, backend: str):
+        self.socket_path = socket_path
+        self.backend = backend
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, model_name: str):
+        # Local import: the registry module is only needed inside the worker process
+        from app.services.embedding_backends import create_embedding_backend
+        from app.services.embedding_models import LoadedEmbeddingModel
+
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = LoadedEmbeddingModel(
+                    model_name, create_embedding_backend(model_name, self.backend)
+                )
+                logger.info(f"Embedding worker loaded {model_name} ({self.backend})")
+            return self._models[model_name]
+
+    def _serve_connection(self, connection):
+        with connection:
+            while True:
+                try:
+                    command, model_name, texts = connection.recv()
+                except EOFError:
+                    return
+
+                try:
+                    if command != 'encode':
+                        raise ValueError(f"unknown command {command!r}")
+                    embeddings = self._model(model_name).batcher.encode_many(texts)
+                    connection.send(('ok', np.asarray(embeddings, dtype=np.float32)))
+                except Exception as e:
+                    logger.error(f"Embedding worker request failed: {e}")
+                    connection.send(('error', str(e)))
+
+    def serve_forever(self, preload: Optional[List[str]] = None):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        for model_name in preload or []:
+            self._model(model_name)
+
+        with Listener(self.socket_path, family='AF_UNIX', authkey=_authkey()) as listener:
+            os.chmod(self.socket_path, 0o660)
+            logger.info(f"Embedding worker listening on {self.socket_path}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    # Failed handshakes (wrong authkey) must not stop the worker
+                    logger.warning(f"Embedding worker rejected a connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+
+def main():
+    from app.services.embedding_models import DEFAULT_EMBEDDING_MODEL
+
+    parser = argparse.ArgumentParser(description="Embedding worker process")
+    parser.add_argument("--socket", default=(worker_sockets() or ["/tmp/sales_agent_embeddings.sock"])[0])
+    parser.add_argument("--backend", default=settings.embedding_worker_backend, choices=['torch', 'onnx'])
+    parser.add_argument("--model", action="append", help="model to load at startup (repeatable)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    EmbeddingWorkerServer(args.socket, args.backend).serve_forever(args.model or [DEFAULT_EMBEDDING_MODEL])
+
+
+if __name__ == "__main__":
+    main()
@@ -326,6 +326,10 @@ class InventorySyncService:
             
             db.commit()
             
+            # Availability may have changed, drop the cached product vectors
+            from app.services.vector_index import restaurant_vector_index
+            restaurant_vector_index.invalidate(restaurant_id, 'products')
+            
         except Exception as e:
             logger.error(f"Error updating inventory: {e}")
             db.rollback()
@@ -0,0 +1,266 @@
+"""
+Latency percentiles per restaurant and stage
+Each timed stage (embedding, vector SQL, search log write, LLM call and its first
+streamed token, whole search) is added to a DDSketch-style histogram: logarithmic
+buckets with a fixed relative error, so sketches merge by adding bucket counts. A background thread folds the in-memory
+sketches into one row per restaurant, stage and hour; reading p50/p95/p99 for any
+window is a sum of those rows.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.search_analytics import LatencySketchHourly
+import logging
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('search', 'embedding', 'vector_sql', 'log_write', 'llm', 'llm_first_token')
+
+# Any quantile is reported within 2% of the true value between MIN_MS and MAX_MS;
+# faster samples land in the first bucket, slower ones in the last
+RELATIVE_ACCURACY = 0.02
+MIN_MS = 0.1
+MAX_MS = 300000.0
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+BUCKETS = int(math.ceil(math.log(MAX_MS / MIN_MS) / LOG_GAMMA)) + 1
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+SketchKey = Tuple[int, str, datetime]
+
+
+def bucket_index(ms: float) -> int:
+    """Bucket i holds values in (MIN_MS * GAMMA^(i-1), MIN_MS * GAMMA^i]"""
+    if ms <= MIN_MS:
+        return 0
+    return min(BUCKETS - 1, int(math.ceil(math.log(ms / MIN_MS) / LOG_GAMMA)))
+
+
+def bucket_value(index: int) -> float:
+    """Value within RELATIVE_ACCURACY of everything in the bucket"""
+    if index == 0:
+        return MIN_MS
+    return MIN_MS * 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class LatencySketch:
+    """Mergeable latency histogram with relative-error quantiles"""
+
+    def __init__(self, buckets: Optional[List[int]] = None, count: int = 0, sum_ms: float = 0.0, max_ms: float = 0.0):
+        self.buckets = list(buckets or [])
+        self.count = count
+        self.sum_ms = sum_ms
+        self.max_ms = max_ms
+
+    def add(self, ms: float):
+        ms = max(0.0, ms)
+        index = bucket_index(ms)
+        if index >= len(self.buckets):
+            self.buckets.extend([0] * (index + 1 - len(self.buckets)))
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def merge(self, other: "LatencySketch"):
+        if len(other.buckets) > len(self.buckets):
+            self.buckets.extend([0] * (len(other.buckets) - len(self.buckets)))
+        for index, count in enumerate(other.buckets):
+            self.buckets[index] += count
+        self.count += other.count
+        self.sum_ms += other.sum_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen > rank:
+                return min(bucket_value(index), self.max_ms)
+        return self.max_ms
+
+    def summary(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {
+            'count': self.count,
+            'avg_ms': round(self.sum_ms / self.count, 1) if self.count else 0
+        }
+        for q in PERCENTILES:
+            value = self.quantile(q)
+            result[f"p{int(q * 100)}_ms"] = round(value, 1) if value is not None else None
+        result['max_ms'] = round(self.max_ms, 1)
+        return result
+
+
+class LatencyRecorder:
+    """Accumulates sketches per (restaurant, stage, hour) in memory, flushed in bulk"""
+
+    def __init__(self, flush_interval_seconds: float = 10.0):
+        self.flush_interval = flush_interval_seconds
+        self._pending: Dict[SketchKey, LatencySketch] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+
+        self.stats = {'recorded': 0, 'rows_written': 0, 'flushes': 0, 'errors': 0}
+
+    def record(self, stage: str, restaurant_id: Optional[int], ms: float):
+        """Add one measurement of a stage; measurements without a restaurant are ignored"""
+        if restaurant_id is None:
+            return
+        hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        with self._lock:
+            key = (restaurant_id, stage, hour)
+            sketch = self._pending.get(key)
+            if sketch is None:
+                sketch = self._pending[key] = LatencySketch()
+            sketch.add(ms)
+            self.stats['recorded'] += 1
+        self._ensure_started()
+
+    def record_many(self, stage: str, restaurant_ids: Iterable[int], ms: float):
+        for restaurant_id in set(restaurant_ids):
+            self.record(stage, restaurant_id, ms)
+
+    @contextmanager
+    def measure(self, stage: str, restaurant_id: Optional[int]):
+        """Time the block and record it, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, restaurant_id, (time.perf_counter() - start) * 1000)
+
+    def start(self):
+        """Start the flush thread"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._thread = threading.Thread(target=self._run, name="latency-stats", daemon=True)
+            self._thread.start()
+            logger.info("Latency recorder started")
+
+    def stop(self):
+        """Stop the flush thread after writing what is still pending"""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+        logger.info("Latency recorder stopped")
+
+    def _ensure_started(self):
+        if not self.running:
+            self.start()
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Add every pending sketch to its hourly row"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if pending and not self._write(pending):
+                self._restore(pending)
+
+    def _restore(self, pending: Dict[SketchKey, LatencySketch]):
+        """Merge a failed batch back so it is retried on the next flush"""
+        with self._lock:
+            for key, sketch in pending.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = sketch
+                else:
+                    current.merge(sketch)
+
+    def _write(self, pending: Dict[SketchKey, LatencySketch]) -> bool:
+        # Sorted keys give every process the same row lock order
+        values = [
+            {
+                'restaurant_id': restaurant_id,
+                'stage': stage,
+                'hour': hour,
+                'count': sketch.count,
+                'sum_ms': sketch.sum_ms,
+                'max_ms': sketch.max_ms,
+                'buckets': sketch.buckets
+            }
+            for (restaurant_id, stage, hour), sketch in sorted(pending.items(), key=lambda item: item[0])
+        ]
+
+        stmt = insert(LatencySketchHourly).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[LatencySketchHourly.restaurant_id, LatencySketchHourly.stage, LatencySketchHourly.hour],
+            set_={
+                'count': LatencySketchHourly.count + stmt.excluded.count,
+                'sum_ms': LatencySketchHourly.sum_ms + stmt.excluded.sum_ms,
+                'max_ms': func.greatest(LatencySketchHourly.max_ms, stmt.excluded.max_ms),
+                # Element-wise sum; arrays only reach the highest bucket used, unnest pads the shorter one
+                'buckets': literal_column(
+                    "ARRAY(SELECT COALESCE(a, 0) + COALESCE(b, 0) "
+                    "FROM unnest(latency_sketches_hourly.buckets, excluded.buckets) WITH ORDINALITY AS u(a, b, n) "
+                    "ORDER BY n)"
+                ),
+                'updated_at': literal_column('now()')
+            }
+        )
+
+        db = SessionLocal()
+        try:
+            db.execute(stmt)
+            db.commit()
+            self.stats['rows_written'] += len(values)
+            self.stats['flushes'] += 1
+            return True
+        except Exception as e:
+            logger.error(f"Error flushing latency sketches ({len(values)} rows): {e}")
+            db.rollback()
+            self.stats['errors'] += 1
+            return False
+        finally:
+            db.close()
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {**self.stats, 'pending_sketches': pending, 'running': self.running}
+
+
+def get_latency_percentiles(restaurant_id: int, db: Session, days: int = 7) -> Dict[str, Dict[str, Any]]:
+    """p50/p95/p99 per stage over the last `days` days, merged from the hourly sketches"""
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+
+    rows = db.query(LatencySketchHourly).filter(
+        LatencySketchHourly.restaurant_id == restaurant_id,
+        LatencySketchHourly.hour >= since
+    ).all()
+
+    sketches: Dict[str, LatencySketch] = {}
+    for row in rows:
+        sketch = sketches.setdefault(row.stage, LatencySketch())
+        sketch.merge(LatencySketch(row.buckets, row.count, row.sum_ms, row.max_ms))
+
+    return {stage: sketches[stage].summary() for stage in STAGES if stage in sketches}
+
+
+# Global recorder instance
+latency_recorder = LatencyRecorder(flush_interval_seconds=settings.latency_stats_flush_seconds)
@@ -0,0 +1,82 @@
+"""
+Memory reranking
+Stage two of memory retrieval: the nearest candidates by vector distance are
+scored on similarity, importance, recency and access frequency in one
+vectorized pass.
+"""
+import math
+import numpy as np
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+
+
+def memory_weights() -> Dict[str, float]:
+    return {
+        'similarity': settings.memory_weight_similarity,
+        'importance': settings.memory_weight_importance,
+        'recency': settings.memory_weight_recency,
+        'access': settings.memory_weight_access,
+    }
+
+
+def score_memories(
+    similarity: np.ndarray,
+    importance: np.ndarray,
+    age_days: np.ndarray,
+    access_count: np.ndarray,
+    weights: Optional[Dict[str, float]] = None,
+    half_life_days: Optional[float] = None
+) -> np.ndarray:
+    """Weighted score per memory; every component is scaled to roughly 0-1"""
+    weights = weights or memory_weights()
+    half_life_days = half_life_days or settings.memory_recency_half_life_days
+
+    recency = np.exp(-math.log(2) * np.maximum(age_days, 0) / half_life_days)
+
+    # Log scale so a handful of very popular memories do not dominate
+    access = np.log1p(np.maximum(access_count, 0))
+    if access.size and access.max() > 0:
+        access = access / access.max()
+
+    return (
+        weights['similarity'] * similarity
+        + weights['importance'] * np.clip(importance, 0, 1)
+        + weights['recency'] * recency
+        + weights['access'] * access
+    )
+
+
+def rerank_memories(
+    candidates: List[Dict[str, Any]],
+    limit: int,
+    now: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """Top `limit` candidates by combined score; each needs similarity_score, importance_score,
+    created_at and access_count"""
+    if not candidates:
+        return []
+
+    now = now or datetime.now(timezone.utc)
+
+    def age_days(created_at) -> float:
+        if created_at is None:
+            return 0.0
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        return (now - created_at).total_seconds() / 86400
+
+    scores = score_memories(
+        np.array([c['similarity_score'] for c in candidates], dtype=np.float32),
+        np.array([c['importance_score'] or 0 for c in candidates], dtype=np.float32),
+        np.array([age_days(c['created_at']) for c in candidates], dtype=np.float32),
+        np.array([c.get('access_count') or 0 for c in candidates], dtype=np.float32),
+    )
+
+    order = np.argsort(-scores, kind='stable')[:limit]
+    ranked = []
+    for i in order:
+        memory = candidates[i]
+        memory['relevance_score'] = round(float(scores[i]), 3)
+        ranked.append(memory)
+    return ranked
@@ -0,0 +1,132 @@
+"""
+Per-restaurant menu epochs
+A counter that advances whenever a restaurant's products, product embeddings,
+knowledge base entries or its own prompt-visible fields (name, description, config)
+change. Anything derived from the menu can key on the epoch
+instead of being invalidated by hand. Epochs live in small files so every worker
+process sees the same value.
+"""
+import fcntl
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from itertools import chain
+from typing import Dict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.embeddings import KnowledgeBase, ProductEmbedding
+from app.models.product import Product
+from app.models.restaurant import Restaurant
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ORM classes whose changes advance the owning restaurant's epoch
+MENU_MODELS = (Product, ProductEmbedding, KnowledgeBase)
+
+# Restaurant columns rendered into the compiled system prompt
+RESTAURANT_FIELDS = ('name', 'description', 'config')
+
+# Config keys rewritten by every embedding migration batch; they do not change the menu
+_UNVERSIONED_CONFIG_KEYS = {'embedding_migration'}
+
+_SESSION_KEY = 'menu_epoch_restaurants'
+
+
+class MenuEpochs:
+    """File-backed epoch counters, one per restaurant"""
+
+    def __init__(self, epoch_dir: str):
+        self.epoch_dir = epoch_dir
+        self._local: Dict[int, int] = {}  # used when epoch_dir is empty (single process)
+        self._lock = threading.Lock()
+        if self.epoch_dir:
+            os.makedirs(self.epoch_dir, exist_ok=True)
+
+    def _path(self, restaurant_id: int) -> str:
+        return os.path.join(self.epoch_dir, f"{int(restaurant_id)}.epoch")
+
+    @contextmanager
+    def _file_lock(self):
+        with open(os.path.join(self.epoch_dir, "epochs.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def current(self, restaurant_id: int) -> int:
+        """Current epoch; a single small file read, no database access"""
+        if not self.epoch_dir:
+            return self._local.get(restaurant_id, 0)
+        try:
+            with open(self._path(restaurant_id)) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def bump(self, restaurant_id: int) -> int:
+        """Advance the epoch, making everything keyed on the old one unreachable"""
+        if not self.epoch_dir:
+            with self._lock:
+                self._local[restaurant_id] = self._local.get(restaurant_id, 0) + 1
+                return self._local[restaurant_id]
+
+        try:
+            with self._file_lock():
+                epoch = self.current(restaurant_id) + 1
+                # Replace rather than rewrite so readers never see a partial file
+                fd, tmp_path = tempfile.mkstemp(dir=self.epoch_dir, suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    f.write(str(epoch))
+                os.replace(tmp_path, self._path(restaurant_id))
+            logger.debug(f"Menu epoch for restaurant {restaurant_id} is now {epoch}")
+            return epoch
+        except Exception as e:
+            logger.error(f"Error advancing menu epoch for restaurant {restaurant_id}: {e}")
+            return self.current(restaurant_id)
+
+
+# Global epochs instance
+menu_epochs = MenuEpochs(settings.menu_epoch_dir)
+
+
+def _restaurant_changed(restaurant: Restaurant) -> bool:
+    """Whether a flushed Restaurant changed anything the system prompt shows"""
+    state = inspect(restaurant)
+    for field in RESTAURANT_FIELDS:
+        history = state.attrs[field].history
+        if not history.has_changes():
+            continue
+        if field != 'config':
+            return True
+        old = (history.deleted or [None])[0] or {}
+        new = (history.added or [None])[0] or {}
+        if {k: v for k, v in old.items() if k not in _UNVERSIONED_CONFIG_KEYS} != \
+                {k: v for k, v in new.items() if k not in _UNVERSIONED_CONFIG_KEYS}:
+            return True
+    return False
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_menu_changes(session, flush_context):
+    """Remember which restaurants had menu rows written in this transaction"""
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, MENU_MODELS) and obj.restaurant_id is not None:
+            session.info.setdefault(_SESSION_KEY, set()).add(obj.restaurant_id)
+        elif isinstance(obj, Restaurant) and obj.id is not None and _restaurant_changed(obj):
+            session.info.setdefault(_SESSION_KEY, set()).add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _advance_menu_epochs(session):
+    """Advance epochs only once the changes are visible to other sessions"""
+    for restaurant_id in session.info.pop(_SESSION_KEY, ()):
+        menu_epochs.bump(restaurant_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_menu_changes(session):
+    session.info.pop(_SESSION_KEY, None)
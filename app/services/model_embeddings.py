@@ -0,0 +1,395 @@
+"""
+Per-restaurant embedding model selection and model_embeddings storage
+A restaurant searches with the model named in Restaurant.config['embedding_model']
+(the default model when unset). The default model uses the native embedding columns;
+any other model reads and writes the model_embeddings table, cast to its dimension.
+"""
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import vector_param
+from app.models.embeddings import ConversationMemory, KnowledgeBase, ModelEmbedding
+from app.models.product import Product
+from app.models.restaurant import Restaurant
+from app.services.ann_indexes import apply_search_tuning
+from app.services.embedding_cache import EmbeddingCache
+from app.services.embedding_content import build_product_content, content_hash
+from app.services.embedding_models import (
+    DEFAULT_EMBEDDING_MODEL, EMBEDDING_MODEL_SPECS, embedding_model_registry, get_model_spec
+)
+from app.services.latency_stats import latency_recorder
+from app.services.memory_ranking import rerank_memories
+from app.services.menu_epoch import menu_epochs
+import logging
+
+logger = logging.getLogger(__name__)
+
+SOURCE_TYPES = ('product', 'knowledge', 'memory')
+
+# Restaurant.config keys
+ACTIVE_MODEL_KEY = 'embedding_model'
+MIGRATION_KEY = 'embedding_migration'
+
+# (source_id, text, customer_phone)
+SourceItem = Tuple[int, str, Optional[str]]
+# (source_id, text, customer_phone, content hash)
+PendingItem = Tuple[int, str, Optional[str], str]
+
+_active_models: Dict[int, Tuple[int, str]] = {}  # restaurant_id -> (menu epoch, model name)
+_query_caches: Dict[str, EmbeddingCache] = {}
+_cache_lock = threading.Lock()
+
+
+def restaurant_config(restaurant_id: int, db: Session) -> Dict[str, Any]:
+    return db.query(Restaurant.config).filter(Restaurant.id == restaurant_id).scalar() or {}
+
+
+def active_embedding_model(restaurant_id: int, db: Session) -> str:
+    """Model the restaurant searches with
+
+    Cached per menu epoch; switching models advances the epoch, so every process
+    picks up the change on its next lookup.
+    """
+    epoch = menu_epochs.current(restaurant_id)
+    cached = _active_models.get(restaurant_id)
+    if cached is not None and cached[0] == epoch:
+        return cached[1]
+
+    model_name = restaurant_config(restaurant_id, db).get(ACTIVE_MODEL_KEY) or DEFAULT_EMBEDDING_MODEL
+    if model_name not in EMBEDDING_MODEL_SPECS:
+        logger.warning(f"Restaurant {restaurant_id} uses unknown embedding model {model_name}, using default")
+        model_name = DEFAULT_EMBEDDING_MODEL
+
+    _active_models[restaurant_id] = (epoch, model_name)
+    return model_name
+
+
+def stored_models(restaurant_id: int, db: Session) -> List[str]:
+    """Non-native models whose vectors must be kept current: the active one and a migration target"""
+    config = restaurant_config(restaurant_id, db)
+    names = [config.get(ACTIVE_MODEL_KEY), (config.get(MIGRATION_KEY) or {}).get('target')]
+    models = []
+    for name in names:
+        spec = EMBEDDING_MODEL_SPECS.get(name) if name else None
+        if spec is not None and not spec.native and name not in models:
+            models.append(name)
+    return models
+
+
+def source_items(
+    source_type: str,
+    restaurant_id: int,
+    db: Session,
+    after_id: int = 0,
+    limit: Optional[int] = None
+) -> List[SourceItem]:
+    """Texts to embed for one source table, in id order, with the same content as the native columns"""
+    if source_type == 'product':
+        query = db.query(Product).filter(
+            Product.restaurant_id == restaurant_id,
+            Product.available == True,
+            Product.id > after_id
+        ).order_by(Product.id)
+        rows = query.limit(limit).all() if limit else query.all()
+        return [(p.id, build_product_content(p), None) for p in rows]
+
+    if source_type == 'knowledge':
+        query = db.query(KnowledgeBase.id, KnowledgeBase.searchable_content).filter(
+            KnowledgeBase.restaurant_id == restaurant_id,
+            KnowledgeBase.active.is_(True),  # boolean in the database
+            KnowledgeBase.id > after_id
+        ).order_by(KnowledgeBase.id)
+        rows = query.limit(limit).all() if limit else query.all()
+        return [(row.id, row.searchable_content or "", None) for row in rows]
+
+    if source_type == 'memory':
+        query = db.query(
+            ConversationMemory.id, ConversationMemory.content,
+            ConversationMemory.summary, ConversationMemory.customer_phone
+        ).filter(
+            ConversationMemory.restaurant_id == restaurant_id,
+            ConversationMemory.id > after_id
+        ).order_by(ConversationMemory.id)
+        rows = query.limit(limit).all() if limit else query.all()
+        return [(row.id, f"{row.content} {row.summary}", row.customer_phone) for row in rows]
+
+    raise ValueError(f"Unknown source type: {source_type}")
+
+
+def changed_items(
+    model_name: str,
+    source_type: str,
+    items: List[SourceItem],
+    db: Session
+) -> List[PendingItem]:
+    """Items whose stored vector for this model is missing or was built from other content"""
+    if not items:
+        return []
+
+    existing = dict(
+        db.query(ModelEmbedding.source_id, ModelEmbedding.content_hash).filter(
+            ModelEmbedding.model_name == model_name,
+            ModelEmbedding.source_type == source_type,
+            ModelEmbedding.source_id.in_([source_id for source_id, _, _ in items])
+        ).all()
+    )
+
+    pending = []
+    for source_id, content, customer_phone in items:
+        digest = content_hash(content)
+        if existing.get(source_id) != digest:
+            pending.append((source_id, content, customer_phone, digest))
+    return pending
+
+
+def encode_items(model_name: str, pending: List[PendingItem]) -> np.ndarray:
+    """Vectors for pending items in one model call; touches no database"""
+    model = embedding_model_registry.get(model_name)
+    if model is None:
+        raise RuntimeError(f"Embedding model {model_name} is not available")
+    return model.encode_batch([content for _, content, _, _ in pending])
+
+
+def store_model_embeddings(
+    model_name: str,
+    source_type: str,
+    restaurant_id: int,
+    pending: List[PendingItem],
+    embeddings: np.ndarray,
+    db: Session
+):
+    """Write encoded items with one upsert; does not commit"""
+    if not pending:
+        return
+
+    stmt = insert(ModelEmbedding).values([
+        {
+            'model_name': model_name,
+            'source_type': source_type,
+            'source_id': source_id,
+            'restaurant_id': restaurant_id,
+            'customer_phone': customer_phone,
+            'content_hash': digest,
+            'embedding': vector_param(embedding)
+        }
+        for (source_id, _, customer_phone, digest), embedding in zip(pending, embeddings)
+    ])
+    stmt = stmt.on_conflict_do_update(
+        constraint='uq_model_embeddings_source',
+        set_={
+            'restaurant_id': stmt.excluded.restaurant_id,
+            'customer_phone': stmt.excluded.customer_phone,
+            'content_hash': stmt.excluded.content_hash,
+            'embedding': stmt.excluded.embedding,
+            'updated_at': func.now()
+        }
+    )
+    db.execute(stmt)
+
+
+def upsert_model_embeddings(
+    model_name: str,
+    source_type: str,
+    restaurant_id: int,
+    items: List[SourceItem],
+    db: Session
+) -> Dict[str, int]:
+    """Embed items whose content changed for one model and write them with one upsert
+
+    Does not commit; the caller owns the transaction.
+    """
+    pending = changed_items(model_name, source_type, items, db)
+    stats = {'embedded': len(pending), 'skipped': len(items) - len(pending)}
+    if pending:
+        embeddings = encode_items(model_name, pending)
+        store_model_embeddings(model_name, source_type, restaurant_id, pending, embeddings, db)
+    return stats
+
+
+def write_model_embeddings(
+    restaurant_id: int,
+    source_type: str,
+    items: List[SourceItem],
+    db: Session
+):
+    """Keep the restaurant's non-default models current after a write to a source table
+
+    Failures are logged, not raised: the native write already succeeded, and a running
+    migration re-checks every row by content hash before it switches over.
+    """
+    try:
+        for model_name in stored_models(restaurant_id, db):
+            upsert_model_embeddings(model_name, source_type, restaurant_id, items, db)
+        db.commit()
+    except Exception as e:
+        logger.error(f"Error writing model embeddings for restaurant {restaurant_id} ({source_type}): {e}")
+        db.rollback()
+
+
+def embed_query(model_name: str, query: str) -> Optional[np.ndarray]:
+    """Query embedding for a non-default model, cached per model; None if the model is unavailable"""
+    with _cache_lock:
+        cache = _query_caches.get(model_name)
+        if cache is None:
+            cache = _query_caches[model_name] = EmbeddingCache(
+                model_name,
+                get_model_spec(model_name).dimension,
+                cache_dir=settings.embedding_cache_dir,
+                memory_entries=settings.embedding_cache_memory_entries,
+                disk_entries=settings.embedding_cache_disk_entries
+            )
+
+    cached = cache.get(query)
+    if cached is not None:
+        return cached
+
+    model = embedding_model_registry.get(model_name)
+    if model is None:
+        return None
+    embedding = model.batcher.encode(query)
+    cache.put(query, embedding)
+    return embedding
+
+
+def search_model_embeddings(
+    kind: str,
+    model_name: str,
+    query: str,
+    restaurant_id: int,
+    db: Session,
+    limit: int,
+    similarity_threshold: float = 0.0,
+    customer_phone: Optional[str] = None,
+    ef_search: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Products, knowledge or one customer's memories ranked by a non-default model
+
+    Same result shape as VectorSearchService. The first pass scans the model's partial
+    halfvec index; candidates are reranked at full precision.
+    """
+    query_embedding = embed_query(model_name, query)
+    if query_embedding is None:
+        logger.warning(f"Embedding model {model_name} not available, no results")
+        return []
+
+    dimension = get_model_spec(model_name).dimension
+    vector = f"me.embedding::vector({dimension})"
+    query_vector = f"CAST(:query_embedding AS vector({dimension}))"
+    first_pass = f"(me.embedding::halfvec({dimension})) <#> ({query_vector})::halfvec({dimension})"
+    distance = f"1 + ({vector} <#> {query_vector})"
+
+    params = {
+        'query_embedding': vector_param(query_embedding),
+        'model_name': model_name,
+        'restaurant_id': restaurant_id,
+        'threshold': 1 - similarity_threshold,
+        'limit': limit,
+        'candidates': limit * max(1, settings.vector_rerank_factor)
+    }
+
+    apply_search_tuning(db, ef_search)
+
+    if kind == 'products':
+        with latency_recorder.measure('vector_sql', restaurant_id):
+            rows = db.execute(text(f"""
+                SELECT * FROM (
+                    SELECT p.id AS product_id, pe.content, p.name, p.description, p.price, p.category,
+                        {distance} AS distance
+                    FROM (
+                        SELECT me.source_id, me.embedding
+                        FROM model_embeddings me
+                        JOIN products p ON p.id = me.source_id
+                        WHERE me.model_name = :model_name AND me.source_type = 'product'
+                            AND me.restaurant_id = :restaurant_id AND p.available = true
+                        ORDER BY {first_pass}
+                        LIMIT :candidates
+                    ) me
+                    JOIN products p ON p.id = me.source_id
+                    LEFT JOIN product_embeddings pe ON pe.product_id = p.id
+                    ORDER BY distance
+                    LIMIT :limit
+                ) ranked
+                WHERE distance < :threshold
+                ORDER BY distance
+            """), params).fetchall()
+        return [
+            {
+                'product_id': row.product_id,
+                'name': row.name,
+                'description': row.description,
+                'price': row.price,
+                'category': row.category,
+                'similarity_score': round(1 - row.distance, 3),
+                'content': row.content
+            }
+            for row in rows
+        ]
+
+    if kind == 'knowledge':
+        with latency_recorder.measure('vector_sql', restaurant_id):
+            rows = db.execute(text(f"""
+                SELECT * FROM (
+                    SELECT kb.id, kb.question, kb.answer, kb.category, kb.usage_count,
+                        {distance} AS distance
+                    FROM (
+                        SELECT me.source_id, me.embedding
+                        FROM model_embeddings me
+                        JOIN knowledge_base kb ON kb.id = me.source_id
+                        WHERE me.model_name = :model_name AND me.source_type = 'knowledge'
+                            AND me.restaurant_id = :restaurant_id AND kb.active = true
+                        ORDER BY {first_pass}
+                        LIMIT :candidates
+                    ) me
+                    JOIN knowledge_base kb ON kb.id = me.source_id
+                    ORDER BY distance
+                    LIMIT :limit
+                ) ranked
+                WHERE distance < :threshold
+                ORDER BY distance
+            """), params).fetchall()
+        return [
+            {
+                'id': row.id,
+                'question': row.question,
+                'answer': row.answer,
+                'category': row.category,
+                'similarity_score': round(1 - row.distance, 3),
+                'usage_count': row.usage_count
+            }
+            for row in rows
+        ]
+
+    if kind == 'memories':
+        params['customer_phone'] = customer_phone
+        params['candidates'] = limit * max(1, settings.memory_candidate_factor)
+        with latency_recorder.measure('vector_sql', restaurant_id):
+            rows = db.execute(text(f"""
+                SELECT cm.id, cm.memory_type, cm.content, cm.summary, cm.importance_score,
+                    cm.access_count, cm.created_at, {distance} AS distance
+                FROM model_embeddings me
+                JOIN conversation_memories cm ON cm.id = me.source_id
+                WHERE me.model_name = :model_name AND me.source_type = 'memory'
+                    AND me.restaurant_id = :restaurant_id AND me.customer_phone = :customer_phone
+                ORDER BY {first_pass}
+                LIMIT :candidates
+            """), params).fetchall()
+        candidates = [
+            {
+                'id': row.id,
+                'memory_type': row.memory_type,
+                'content': row.content,
+                'summary': row.summary,
+                'importance_score': row.importance_score,
+                'access_count': row.access_count,
+                'similarity_score': round(1 - row.distance, 3),
+                'created_at': row.created_at
+            }
+            for row in rows
+        ]
+        return rerank_memories(candidates, limit)
+
+    raise ValueError(f"Unknown search kind: {kind}")
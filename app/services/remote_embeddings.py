@@ -0,0 +1,212 @@
+"""
+Remote embedding client for OpenAI-compatible /embeddings endpoints
+Texts are packed into batched `input` arrays (bounded by item count and estimated
+tokens), sent with limited concurrency, retried with exponential backoff on rate
+limits and server errors, and paced by a per-minute token budget shared by every
+caller in the process. base_url can point at a local stub server.
+"""
+import random
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import httpx
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Responses worth retrying; everything else in 4xx is a caller error
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English, fewer for Spanish)"""
+    return len(text) // 3 + 1
+
+
+class TokenBudget:
+    """Token bucket refilled continuously at tokens_per_minute / 60 per second"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> float:
+        """Block until `tokens` fit in the budget; returns the seconds waited"""
+        if self.capacity <= 0:
+            return 0.0
+
+        # A single request larger than the whole budget waits for a full bucket
+        tokens = min(tokens, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.capacity / 60)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) * 60 / self.capacity
+            time.sleep(wait)
+            waited += wait
+
+
+class RemoteEmbeddingError(Exception):
+    """The endpoint rejected a request or kept failing after every retry"""
+
+
+class RemoteEmbeddingClient:
+    """Batched, concurrency-limited client for one embeddings endpoint"""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str = "",
+        max_batch_size: int = 256,
+        max_batch_tokens: int = 8000,
+        max_concurrency: int = 4,
+        max_retries: int = 5,
+        tokens_per_minute: int = 1000000,
+        timeout: float = 30.0
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.budget = TokenBudget(tokens_per_minute)
+
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._client = httpx.Client(
+            base_url=self.base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency)
+        )
+        # Caps in-flight requests across every thread using this client
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="remote-embeddings")
+        self._stats_lock = threading.Lock()
+
+        self.stats = {'texts': 0, 'requests': 0, 'retries': 0, 'errors': 0, 'budget_wait_seconds': 0.0}
+
+    def batches(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """(start, end) slices that respect both the item and the token limit"""
+        slices = []
+        start = 0
+        tokens = 0
+        for i, text in enumerate(texts):
+            cost = estimate_tokens(text)
+            if i > start and (i - start >= self.max_batch_size or tokens + cost > self.max_batch_tokens):
+                slices.append((start, i))
+                start, tokens = i, 0
+            tokens += cost
+        if start < len(texts):
+            slices.append((start, len(texts)))
+        return slices
+
+    def embed(self, texts: List[str], model: str) -> np.ndarray:
+        """Embeddings in input order, unit-normalized, shape (len(texts), dimension)"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        slices = self.batches(texts)
+        if len(slices) == 1:
+            parts = [self._request(texts, model)]
+        else:
+            parts = list(self._executor.map(lambda s: self._request(texts[s[0]:s[1]], model), slices))
+
+        vectors = np.vstack(parts).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+    def _request(self, texts: List[str], model: str) -> np.ndarray:
+        waited = self.budget.acquire(sum(estimate_tokens(text) for text in texts))
+        self._count('budget_wait_seconds', waited)
+
+        attempt = 0
+        while True:
+            retry_after: Optional[float] = None
+            try:
+                with self._semaphore:
+                    self._count('requests')
+                    response = self._client.post("/embeddings", json={"model": model, "input": texts})
+
+                if response.status_code == 200:
+                    data = sorted(response.json()["data"], key=lambda item: item["index"])
+                    if len(data) != len(texts):
+                        raise RemoteEmbeddingError(f"Expected {len(texts)} embeddings, got {len(data)}")
+                    self._count('texts', len(texts))
+                    return np.array([item["embedding"] for item in data], dtype=np.float32)
+
+                if response.status_code not in RETRY_STATUS_CODES:
+                    self._count('errors')
+                    raise RemoteEmbeddingError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+                error = f"HTTP {response.status_code}"
+                retry_after = self._retry_after(response)
+
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+
+            attempt += 1
+            if attempt > self.max_retries:
+                self._count('errors')
+                raise RemoteEmbeddingError(f"Giving up after {self.max_retries} retries ({error})")
+
+            # Exponential backoff with full jitter, unless the server says how long to wait
+            delay = retry_after if retry_after is not None else random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+            logger.warning(f"Embedding request failed ({error}), retry {attempt} in {delay:.1f}s")
+            self._count('retries')
+            time.sleep(delay)
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> Optional[float]:
+        try:
+            return min(60.0, float(response.headers["retry-after"]))
+        except (KeyError, ValueError):
+            return None
+
+    def _count(self, key: str, value: float = 1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._client.close()
+
+
+_clients: Dict[Tuple[str, str], RemoteEmbeddingClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_remote_embedding_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> RemoteEmbeddingClient:
+    """Shared client per endpoint, so the concurrency limit and token budget are process-wide"""
+    base_url = base_url or settings.remote_embedding_base_url
+    api_key = settings.openai_api_key if api_key is None else api_key
+
+    with _clients_lock:
+        client = _clients.get((base_url, api_key))
+        if client is None:
+            client = _clients[(base_url, api_key)] = RemoteEmbeddingClient(
+                base_url,
+                api_key=api_key,
+                max_batch_size=settings.remote_embedding_max_batch_size,
+                max_batch_tokens=settings.remote_embedding_max_batch_tokens,
+                max_concurrency=settings.remote_embedding_concurrency,
+                max_retries=settings.remote_embedding_max_retries,
+                tokens_per_minute=settings.remote_embedding_tokens_per_minute,
+                timeout=settings.remote_embedding_timeout_seconds
+            )
+        return client
+
+
+def remote_embedding_stats() -> Dict[str, Dict]:
+    """Stats of every client created in this process, by endpoint"""
+    with _clients_lock:
+        return {base_url: dict(client.stats) for (base_url, _), client in _clients.items()}
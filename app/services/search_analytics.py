@@ -0,0 +1,316 @@
+"""
+Incremental search analytics rollups
+A background job folds new search_logs rows into hourly per-restaurant, per-type
+aggregates (counts, sums, latency and similarity histograms) and daily per-query
+counts. Dashboards read only the rollups, so their cost depends on the number of
+hours asked for, not on the number of searches logged.
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import literal_column, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.search_analytics import AnalyticsRollupState, SearchQueryStatsDaily, SearchStatsHourly
+from app.services.latency_stats import get_latency_percentiles
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency buckets; one more bucket catches everything above
+LATENCY_BOUNDS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+LATENCY_BUCKETS = len(LATENCY_BOUNDS_MS) + 1
+
+# top_similarity in ten equal bins over [0, 1]
+SIMILARITY_BUCKETS = 10
+
+ROLLUP_NAME = 'search_logs'
+
+HourKey = Tuple[int, str, datetime]
+
+
+def _add_arrays(column: str) -> Any:
+    # Element-wise sum of the stored and the incoming histogram
+    return literal_column(
+        f"ARRAY(SELECT COALESCE(a, 0) + COALESCE(b, 0) "
+        f"FROM unnest(search_stats_hourly.{column}, excluded.{column}) WITH ORDINALITY AS u(a, b, n) "
+        f"ORDER BY n)"
+    )
+
+
+class SearchAnalyticsRollup:
+    """Thread that keeps the rollups current, a bounded batch of log rows at a time"""
+
+    def __init__(self, interval_seconds: float = 60, lag_seconds: float = 60, batch_rows: int = 50000):
+        self.interval = interval_seconds
+        self.lag_seconds = lag_seconds
+        self.batch_rows = batch_rows
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+
+        self.stats = {'runs': 0, 'rows_rolled_up': 0, 'errors': 0, 'last_id': 0}
+
+    def start(self):
+        """Start the rollup thread"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._thread = threading.Thread(target=self._run, name="search-analytics-rollup", daemon=True)
+            self._thread.start()
+            logger.info("Search analytics rollup started")
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+        if self._thread:
+            self._thread.join(timeout=10)
+        logger.info("Search analytics rollup stopped")
+
+    def _run(self):
+        while self.running:
+            try:
+                # Catch up in full batches, then wait for the next interval
+                while self.running and self.run_once() >= self.batch_rows:
+                    pass
+            except Exception as e:
+                logger.error(f"Error rolling up search analytics: {e}")
+                self.stats['errors'] += 1
+            time.sleep(self.interval)
+
+    def run_once(self) -> int:
+        """Fold the next batch of log rows into the rollups; returns the number of rows"""
+        db = SessionLocal()
+        try:
+            # Short statements only: this shares the database with live chat traffic
+            db.execute(text("SET LOCAL statement_timeout = '30s'"))
+
+            # The watermark row lock also keeps two processes from rolling up the same rows
+            db.execute(
+                insert(AnalyticsRollupState)
+                .values(name=ROLLUP_NAME, last_id=0)
+                .on_conflict_do_nothing(index_elements=[AnalyticsRollupState.name])
+            )
+            state = db.query(AnalyticsRollupState).filter(
+                AnalyticsRollupState.name == ROLLUP_NAME
+            ).with_for_update().one()
+
+            # created_at is stamped by the server as the row is inserted, right after its id
+            # was drawn. A row with a lower id still uncommitted would have to sit between
+            # its INSERT and COMMIT for longer than the lag, so every id up to the bound is
+            # final; rows younger than the lag are picked up on a later run
+            bounds = db.execute(text("""
+                SELECT MAX(id) AS upto_id, COUNT(*) AS row_count FROM (
+                    SELECT id FROM search_logs
+                    WHERE id > :after_id
+                        AND created_at < NOW() - make_interval(secs => :lag)
+                    ORDER BY id
+                    LIMIT :batch_rows
+                ) batch
+            """), {'after_id': state.last_id, 'lag': self.lag_seconds, 'batch_rows': self.batch_rows}).fetchone()
+
+            if not bounds.row_count:
+                db.rollback()
+                return 0
+
+            params = {'after_id': state.last_id, 'upto_id': bounds.upto_id}
+            self._roll_up_hours(db, params)
+            self._roll_up_queries(db, params)
+
+            state.last_id = bounds.upto_id
+            db.commit()
+
+            self.stats['runs'] += 1
+            self.stats['rows_rolled_up'] += bounds.row_count
+            self.stats['last_id'] = bounds.upto_id
+            return bounds.row_count
+
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _roll_up_hours(self, db: Session, params: Dict[str, int]):
+        # Grouped down to (hour, latency bucket, similarity bucket) in the database,
+        # folded into one histogram row per hour here
+        rows = db.execute(text(f"""
+            SELECT
+                restaurant_id,
+                COALESCE(search_type, 'products') AS search_type,
+                date_trunc('hour', created_at) AS hour,
+                width_bucket(COALESCE(search_time_ms, 0), ARRAY{LATENCY_BOUNDS_MS}) AS latency_bucket,
+                LEAST(GREATEST(width_bucket(COALESCE(top_similarity, 0), 0, 1, {SIMILARITY_BUCKETS}), 1),
+                    {SIMILARITY_BUCKETS}) - 1 AS similarity_bucket,
+                COUNT(*) AS searches,
+                COUNT(*) FILTER (WHERE COALESCE(results_found, 0) = 0) AS zero_results,
+                COALESCE(SUM(results_found), 0) AS results_found_sum,
+                COALESCE(SUM(search_time_ms), 0) AS search_time_ms_sum,
+                COALESCE(SUM(embedding_time_ms), 0) AS embedding_time_ms_sum
+            FROM search_logs
+            WHERE id > :after_id AND id <= :upto_id AND restaurant_id IS NOT NULL
+            GROUP BY 1, 2, 3, 4, 5
+        """), params).fetchall()
+
+        hours: Dict[HourKey, Dict[str, Any]] = {}
+        for row in rows:
+            key = (row.restaurant_id, row.search_type, row.hour)
+            hour = hours.get(key)
+            if hour is None:
+                hour = hours[key] = {
+                    'restaurant_id': row.restaurant_id,
+                    'search_type': row.search_type,
+                    'hour': row.hour,
+                    'searches': 0,
+                    'zero_results': 0,
+                    'results_found_sum': 0,
+                    'search_time_ms_sum': 0,
+                    'embedding_time_ms_sum': 0,
+                    'latency_histogram': [0] * LATENCY_BUCKETS,
+                    'similarity_histogram': [0] * SIMILARITY_BUCKETS
+                }
+            for column in ('searches', 'zero_results', 'results_found_sum', 'search_time_ms_sum', 'embedding_time_ms_sum'):
+                hour[column] += int(getattr(row, column))
+            hour['latency_histogram'][row.latency_bucket] += row.searches
+            hour['similarity_histogram'][row.similarity_bucket] += row.searches
+
+        if not hours:
+            return
+
+        stmt = insert(SearchStatsHourly).values(list(hours.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SearchStatsHourly.restaurant_id, SearchStatsHourly.search_type, SearchStatsHourly.hour],
+            set_={
+                'searches': SearchStatsHourly.searches + stmt.excluded.searches,
+                'zero_results': SearchStatsHourly.zero_results + stmt.excluded.zero_results,
+                'results_found_sum': SearchStatsHourly.results_found_sum + stmt.excluded.results_found_sum,
+                'search_time_ms_sum': SearchStatsHourly.search_time_ms_sum + stmt.excluded.search_time_ms_sum,
+                'embedding_time_ms_sum': SearchStatsHourly.embedding_time_ms_sum + stmt.excluded.embedding_time_ms_sum,
+                'latency_histogram': _add_arrays('latency_histogram'),
+                'similarity_histogram': _add_arrays('similarity_histogram'),
+                'updated_at': literal_column('now()')
+            }
+        )
+        db.execute(stmt)
+
+    def _roll_up_queries(self, db: Session, params: Dict[str, int]):
+        # Query text is already normalized in search_queries
+        rows = db.execute(text("""
+            SELECT
+                l.restaurant_id,
+                date_trunc('day', l.created_at) AS day,
+                q.query,
+                COUNT(*) AS searches,
+                COALESCE(SUM(l.top_similarity), 0) AS top_similarity_sum
+            FROM search_logs l
+            JOIN search_queries q ON q.id = l.query_id
+            WHERE l.id > :after_id AND l.id <= :upto_id
+                AND l.restaurant_id IS NOT NULL
+            GROUP BY 1, 2, 3
+        """), params).fetchall()
+
+        if not rows:
+            return
+
+        values = [
+            {
+                'restaurant_id': row.restaurant_id,
+                'day': row.day,
+                'query': row.query,
+                'searches': row.searches,
+                'top_similarity_sum': float(row.top_similarity_sum)
+            }
+            for row in rows
+        ]
+        # Postgres caps bind parameters per statement
+        for offset in range(0, len(values), 5000):
+            stmt = insert(SearchQueryStatsDaily).values(values[offset:offset + 5000])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[SearchQueryStatsDaily.restaurant_id, SearchQueryStatsDaily.day, SearchQueryStatsDaily.query],
+                set_={
+                    'searches': SearchQueryStatsDaily.searches + stmt.excluded.searches,
+                    'top_similarity_sum': SearchQueryStatsDaily.top_similarity_sum + stmt.excluded.top_similarity_sum
+                }
+            )
+            db.execute(stmt)
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        return {**self.stats, 'running': self.running}
+
+
+def get_search_analytics(restaurant_id: int, db: Session, days: int = 7) -> Dict[str, Any]:
+    """Dashboard analytics for the last `days` days, read from the rollups only"""
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+
+    hours = db.query(SearchStatsHourly).filter(
+        SearchStatsHourly.restaurant_id == restaurant_id,
+        SearchStatsHourly.hour >= since
+    ).all()
+
+    common_queries = db.execute(text("""
+        SELECT query, SUM(searches) AS count, SUM(top_similarity_sum) / SUM(searches) AS avg_similarity
+        FROM search_query_stats_daily
+        WHERE restaurant_id = :restaurant_id AND day >= date_trunc('day', CAST(:since AS timestamptz))
+        GROUP BY query
+        ORDER BY count DESC
+        LIMIT 10
+    """), {'restaurant_id': restaurant_id, 'since': since}).fetchall()
+
+    by_type: Dict[str, Dict[str, int]] = defaultdict(lambda: {'searches': 0, 'zero_results': 0})
+    latency = [0] * LATENCY_BUCKETS
+    similarity = [0] * SIMILARITY_BUCKETS
+    totals = defaultdict(int)
+    for hour in hours:
+        for column in ('searches', 'zero_results', 'results_found_sum', 'search_time_ms_sum', 'embedding_time_ms_sum'):
+            totals[column] += getattr(hour, column)
+        by_type[hour.search_type]['searches'] += hour.searches
+        by_type[hour.search_type]['zero_results'] += hour.zero_results
+        latency = [a + b for a, b in zip(latency, hour.latency_histogram)]
+        similarity = [a + b for a, b in zip(similarity, hour.similarity_histogram)]
+
+    searches = totals['searches']
+    rolled_up_to = db.query(AnalyticsRollupState.updated_at).filter(
+        AnalyticsRollupState.name == ROLLUP_NAME
+    ).scalar()
+
+    return {
+        'common_queries': [
+            {'query': row.query, 'count': int(row.count), 'avg_similarity': round(row.avg_similarity or 0, 3)}
+            for row in common_queries
+        ],
+        'performance': {
+            'avg_search_time_ms': round(totals['search_time_ms_sum'] / searches, 1) if searches else 0,
+            'avg_embedding_time_ms': round(totals['embedding_time_ms_sum'] / searches, 1) if searches else 0,
+            'avg_results': round(totals['results_found_sum'] / searches, 1) if searches else 0,
+            'total_searches': searches,
+            'zero_result_rate': round(totals['zero_results'] / searches, 3) if searches else 0
+        },
+        'by_type': dict(by_type),
+        # p50/p95/p99 per stage: search, embedding, vector_sql, log_write, llm, llm_first_token
+        'latency_percentiles': get_latency_percentiles(restaurant_id, db, days),
+        'latency_histogram': {
+            'bounds_ms': LATENCY_BOUNDS_MS,
+            'counts': latency
+        },
+        'similarity_histogram': {
+            'bins': SIMILARITY_BUCKETS,
+            'counts': similarity
+        },
+        'rolled_up_at': rolled_up_to.isoformat() if rolled_up_to else None
+    }
+
+
+# Global rollup instance
+search_analytics_rollup = SearchAnalyticsRollup(
+    interval_seconds=settings.analytics_rollup_interval_seconds,
+    lag_seconds=settings.analytics_rollup_lag_seconds,
+    batch_rows=settings.analytics_rollup_batch_rows
+)
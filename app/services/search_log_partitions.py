@@ -0,0 +1,174 @@
+"""
+Daily partitions of search_logs
+Keeps partitions created a few days ahead and enforces retention by dropping whole
+partitions, which is instant and leaves no dead rows to vacuum. A partition is only
+dropped once the analytics rollup has read every row in it.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import text
+from app.core.config import settings
+from app.core.database import engine
+from app.services.search_analytics import ROLLUP_NAME
+import logging
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = 'search_logs_p'
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def _utc_midnight(day: date) -> str:
+    return f"{day.isoformat()} 00:00:00+00"
+
+
+def list_partitions(conn) -> List[Tuple[str, date]]:
+    """Daily partitions of search_logs with the day they hold, oldest first"""
+    rows = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'search_logs'
+    """)).fetchall()
+
+    partitions = []
+    for (name,) in rows:
+        if not name.startswith(PARTITION_PREFIX):
+            continue  # the default partition
+        try:
+            partitions.append((name, datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date()))
+        except ValueError:
+            continue
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def ensure_partitions(conn, days_ahead: int) -> List[str]:
+    """Create the partitions for today and the next days_ahead days (UTC)"""
+    today = datetime.now(timezone.utc).date()
+    created = []
+    for offset in range(days_ahead + 1):
+        day = today + timedelta(days=offset)
+        name = partition_name(day)
+        exists = conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': name}).scalar()
+        if exists:
+            continue
+        # Fails if the default partition already holds rows for that day; they stay there
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF search_logs "
+            f"FOR VALUES FROM ('{_utc_midnight(day)}') TO ('{_utc_midnight(day + timedelta(days=1))}')"
+        ))
+        created.append(name)
+    return created
+
+
+def drop_expired_partitions(conn, retention_days: int) -> List[str]:
+    """Drop partitions entirely older than the retention window and already rolled up"""
+    if retention_days <= 0:
+        return []
+
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+    rolled_up_to = conn.execute(
+        text("SELECT last_id FROM analytics_rollup_state WHERE name = :name"), {'name': ROLLUP_NAME}
+    ).scalar() or 0
+
+    dropped = []
+    for name, day in list_partitions(conn):
+        if day >= cutoff:
+            break
+        max_id = conn.execute(text(f"SELECT MAX(id) FROM {name}")).scalar()
+        if max_id is not None and max_id > rolled_up_to:
+            logger.warning(f"Keeping expired partition {name}: not rolled up into analytics yet")
+            break
+        conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        dropped.append(name)
+    return dropped
+
+
+def prune_search_queries(conn, retention_days: int) -> int:
+    """Delete distinct queries that no remaining log row references"""
+    if retention_days <= 0:
+        return 0
+    result = conn.execute(text("""
+        DELETE FROM search_queries q
+        WHERE q.created_at < NOW() - make_interval(days => :retention_days)
+            AND NOT EXISTS (SELECT 1 FROM search_logs l WHERE l.query_id = q.id)
+    """), {'retention_days': retention_days})
+    return result.rowcount or 0
+
+
+class SearchLogPartitionMaintenance:
+    """Thread that creates upcoming partitions and drops expired ones"""
+
+    def __init__(self, interval_seconds: float = 3600, days_ahead: int = 7, retention_days: int = 90):
+        self.interval = interval_seconds
+        self.days_ahead = days_ahead
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+
+        self.stats = {'runs': 0, 'created': 0, 'dropped': 0, 'queries_pruned': 0, 'errors': 0}
+
+    def start(self):
+        """Start the maintenance thread"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._thread = threading.Thread(target=self._run, name="search-log-partitions", daemon=True)
+            self._thread.start()
+            logger.info("Search log partition maintenance started")
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+        logger.info("Search log partition maintenance stopped")
+
+    def _run(self):
+        while self.running:
+            self.run_once()
+            # Sleep in short steps so stop() does not wait for a full interval
+            deadline = time.monotonic() + self.interval
+            while self.running and time.monotonic() < deadline:
+                time.sleep(1)
+
+    def run_once(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {'created': [], 'dropped': [], 'queries_pruned': 0}
+        try:
+            # DDL one statement at a time, so a partition lock is never held across steps
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                result['created'] = ensure_partitions(conn, self.days_ahead)
+                result['dropped'] = drop_expired_partitions(conn, self.retention_days)
+                if result['dropped']:
+                    result['queries_pruned'] = prune_search_queries(conn, self.retention_days)
+
+            self.stats['runs'] += 1
+            self.stats['created'] += len(result['created'])
+            self.stats['dropped'] += len(result['dropped'])
+            self.stats['queries_pruned'] += result['queries_pruned']
+            if result['created'] or result['dropped']:
+                logger.info(f"Search log partitions: {result}")
+        except Exception as e:
+            logger.error(f"Error maintaining search log partitions: {e}")
+            self.stats['errors'] += 1
+        return result
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        return {**self.stats, 'running': self.running, 'retention_days': self.retention_days}
+
+
+# Global maintenance instance
+search_log_partitions = SearchLogPartitionMaintenance(
+    interval_seconds=settings.search_log_maintenance_interval_seconds,
+    days_ahead=settings.search_log_partition_days_ahead,
+    retention_days=settings.search_log_retention_days
+)
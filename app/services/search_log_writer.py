@@ -0,0 +1,217 @@
+"""
+Asynchronous, buffered writer for search analytics
+Search events go to a bounded in-memory queue and are flushed in bulk by a background thread.
+Query text and embedding are stored once per normalized query in search_queries; log
+rows only reference it by id.
+"""
+import hashlib
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.embeddings import SearchLog, SearchQuery
+from app.services.latency_stats import latency_recorder
+from app.services.search_result_cache import normalize_query
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SearchLogWriter:
+    """Background sink for SearchLog rows that never blocks the request path"""
+
+    def __init__(
+        self,
+        max_queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval_seconds: float = 2.0,
+        sample_above: float = 0.8,
+        query_id_cache_entries: int = 10000
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_seconds
+        self.sample_above = sample_above  # queue fill ratio where sampling starts
+
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue_size)
+        self._max_queue_size = max_queue_size
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.running = False
+
+        # Only touched by the flushing thread (or stop() after it has exited)
+        self._query_ids: "OrderedDict[str, int]" = OrderedDict()
+        self._query_id_cache_entries = query_id_cache_entries
+
+        self.stats = {'enqueued': 0, 'sampled_out': 0, 'dropped': 0, 'written': 0, 'flushes': 0, 'errors': 0}
+
+    def log(self, **event) -> bool:
+        """Queue a search event; returns False if it was sampled out or dropped"""
+        self._ensure_started()
+
+        # Shed load progressively once the queue passes the sampling threshold
+        fill = self._queue.qsize() / self._max_queue_size
+        if fill > self.sample_above:
+            keep_probability = max(0.0, (1 - fill) / (1 - self.sample_above))
+            if random.random() >= keep_probability:
+                self.stats['sampled_out'] += 1
+                return False
+
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+
+        self.stats['enqueued'] += 1
+        return True
+
+    def start(self):
+        """Start the flush thread"""
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            self._thread = threading.Thread(target=self._run, name="search-log-writer", daemon=True)
+            self._thread.start()
+            logger.info("Search log writer started")
+
+    def stop(self):
+        """Stop the flush thread after writing what is still queued"""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.flush()
+        logger.info("Search log writer stopped")
+
+    def _ensure_started(self):
+        if not self.running:
+            self.start()
+
+    def _drain(self, max_items: int) -> List[Dict[str, Any]]:
+        events = []
+        while len(events) < max_items:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def flush(self):
+        """Write everything currently queued"""
+        while True:
+            events = self._drain(self.batch_size)
+            if not events:
+                return
+            self._write(events)
+
+    def _run(self):
+        """Flush when a full batch is waiting or the interval has elapsed"""
+        last_flush = time.monotonic()
+        while self.running:
+            if self._queue.qsize() >= self.batch_size or time.monotonic() - last_flush >= self.flush_interval:
+                events = self._drain(self.batch_size)
+                if events:
+                    self._write(events)
+                last_flush = time.monotonic()
+            else:
+                time.sleep(0.05)
+
+    def _write(self, events: List[Dict[str, Any]], retry: bool = True):
+        """Insert a batch with a single multi-row INSERT"""
+        start = time.perf_counter()
+        db = SessionLocal()
+        try:
+            query_ids = self._resolve_queries(db, events)
+            rows = []
+            for event in events:
+                row = {key: value for key, value in event.items() if key not in ('query', 'embedding', 'query_hash')}
+                row['query_id'] = query_ids.get(event.get('query_hash'))
+                rows.append(row)
+
+            # Last statement before the commit: the analytics rollup lag only has to cover the commit
+            db.execute(insert(SearchLog).values(rows))
+            db.commit()
+            self._remember(query_ids)
+            # A batch is shared by several restaurants; each sees the whole batch write
+            latency_recorder.record_many(
+                'log_write', (event.get('restaurant_id') for event in events), (time.perf_counter() - start) * 1000
+            )
+            self.stats['written'] += len(events)
+            self.stats['flushes'] += 1
+        except Exception as e:
+            db.rollback()
+            if retry and self._query_ids:
+                # A cached id may belong to a query pruned by retention; resolve again from the table
+                self._query_ids.clear()
+                db.close()
+                return self._write(events, retry=False)
+            logger.error(f"Error writing {len(events)} search logs: {e}")
+            self.stats['errors'] += 1
+        finally:
+            db.close()
+
+    def _resolve_queries(self, db: Session, events: List[Dict[str, Any]]) -> Dict[str, int]:
+        """search_queries ids for the batch, inserting queries seen for the first time"""
+        query_ids: Dict[str, int] = {}
+        missing: Dict[str, Dict[str, Any]] = {}
+
+        for event in events:
+            if not event.get('query'):
+                continue
+            normalized = normalize_query(event['query'])
+            digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+            event['query_hash'] = digest
+
+            if digest in self._query_ids:
+                query_ids[digest] = self._query_ids[digest]
+                self._query_ids.move_to_end(digest)
+            elif digest not in missing or missing[digest]['embedding'] is None:
+                missing[digest] = {
+                    'query_hash': digest,
+                    'query': normalized,
+                    'embedding': event.get('embedding')
+                }
+
+        if missing:
+            stmt = pg_insert(SearchQuery).values(list(missing.values()))
+            # Fill in an embedding for a query first logged without one
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[SearchQuery.query_hash],
+                set_={'embedding': stmt.excluded.embedding},
+                where=SearchQuery.embedding.is_(None) & stmt.excluded.embedding.isnot(None)
+            )
+            db.execute(stmt)
+
+            # Existing and untouched rows are not RETURNed by ON CONFLICT, so read them back
+            for query_id, digest in db.query(SearchQuery.id, SearchQuery.query_hash).filter(
+                SearchQuery.query_hash.in_(list(missing))
+            ).all():
+                query_ids[digest] = query_id
+
+        return query_ids
+
+    def _remember(self, query_ids: Dict[str, int]):
+        for digest, query_id in query_ids.items():
+            self._query_ids[digest] = query_id
+            self._query_ids.move_to_end(digest)
+        while len(self._query_ids) > self._query_id_cache_entries:
+            self._query_ids.popitem(last=False)
+
+
+# Global writer instance
+search_log_writer = SearchLogWriter(
+    max_queue_size=settings.search_log_queue_size,
+    batch_size=settings.search_log_batch_size,
+    flush_interval_seconds=settings.search_log_flush_seconds,
+    query_id_cache_entries=settings.search_query_id_cache_entries
+)
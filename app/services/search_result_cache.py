@@ -0,0 +1,139 @@
+"""
+Semantic search result cache
+Results are keyed by (kind, restaurant, normalized query, limit, threshold, menu epoch),
+so a menu change makes old entries unreachable without scanning the cache.
+Concurrent identical lookups are collapsed into a single computation.
+"""
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.services.menu_epoch import menu_epochs
+import logging
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, int, str, int, float, int]
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, fold accents and collapse whitespace"""
+    decomposed = unicodedata.normalize("NFKD", query.lower())
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(folded.split())
+
+
+def _copy_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Callers decorate result dicts; never hand out the cached ones
+    return [dict(item) for item in results]
+
+
+class SearchResultCache:
+    """LRU of search results with singleflight on misses"""
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[CacheKey, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._in_flight: Dict[CacheKey, Future] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, kind: str, restaurant_id: int, query: str, limit: int, threshold: float) -> CacheKey:
+        return (
+            kind, restaurant_id, normalize_query(query), limit, round(threshold, 4),
+            menu_epochs.current(restaurant_id)
+        )
+
+    def get(self, key: CacheKey) -> Optional[List[Dict[str, Any]]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, results = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return _copy_results(results)
+
+    def put(self, key: CacheKey, results: List[Dict[str, Any]]):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), _copy_results(results))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def get_or_compute(
+        self,
+        key: CacheKey,
+        compute: Callable[[], List[Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
+        """Cached results, or compute them once for every concurrent caller of the same key
+
+        Exceptions reach every waiting caller and are not cached.
+        """
+        if not self.enabled:
+            return compute()
+
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            return _copy_results(future.result())
+
+        try:
+            results = compute()
+            self.put(key, results)
+            future.set_result(results)
+            return _copy_results(results)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        lookups = self.stats['hits'] + self.stats['misses'] + self.stats['coalesced']
+        return {
+            **self.stats,
+            'entries': len(self._entries),
+            'hit_rate': round(self.stats['hits'] / lookups, 3) if lookups else 0.0
+        }
+
+
+# Global cache instance
+search_result_cache = SearchResultCache(
+    max_entries=settings.search_result_cache_entries,
+    ttl_seconds=settings.search_result_cache_ttl_seconds
+)
@@ -5,14 +5,29 @@ Uses native Supabase functions for better performance
 import time
 import numpy as np
 from typing import List, Dict, Any, Optional
-from sentence_transformers import SentenceTransformer
+from app.services.embedding_backends import backend_identity
+from app.services.embedding_cache import EmbeddingCache
+from app.services.embedding_models import (
+    DEFAULT_EMBEDDING_MODEL, EmbeddingModelUnavailable, LoadedEmbeddingModel, embedding_model_registry
+)
+from app.services.vector_index import restaurant_vector_index
+from app.services.ann_indexes import apply_search_tuning
+from app.services.embedding_content import upsert_product_embeddings
+from app.services.search_log_writer import search_log_writer
+from app.services.access_stats import access_stats
+from app.services.latency_stats import latency_recorder
+from app.services.memory_ranking import rerank_memories
+from app.services.vector_quantization import first_pass_order, rerank_distance, candidate_count
+from app.services.model_embeddings import (
+    active_embedding_model, search_model_embeddings, source_items, stored_models, write_model_embeddings
+)
 from sqlalchemy.orm import Session
 from sqlalchemy import text, func
 from app.models.embeddings import ProductEmbedding, ConversationMemory, KnowledgeBase, SearchLog
 from app.models.product import Product
 from app.core.config import settings
+from app.core.database import vector_param
 import logging
-import openai
 
 logger = logging.getLogger(__name__)
 
@@ -21,130 +36,80 @@ class SupabaseVectorSearchService:
     """Enhanced vector search service optimized for Supabase"""
     
     def __init__(self):
-        # Initialize embedding model
-        self.embedding_model = None
+        # The native embedding columns are vector(384) and always hold the default local model.
+        # Other models (OpenAI included) are chosen per restaurant and stored in
+        # model_embeddings, see app.services.model_embeddings
         self.embedding_dimension = 384
-        self.model_name = "sentence-transformers/all-MiniLM-L6-v2"
-        
-        # Initialize OpenAI if available
+        self.model_name = DEFAULT_EMBEDDING_MODEL
         self.use_openai_embeddings = False
-        if hasattr(settings, 'openai_api_key') and settings.openai_api_key:
-            openai.api_key = settings.openai_api_key
-            self.use_openai_embeddings = True
-            self.embedding_dimension = 1536
         
-        self._load_embedding_model()
+        self.embedding_cache = EmbeddingCache(
+            backend_identity(self.model_name),
+            self.embedding_dimension,
+            cache_dir=settings.embedding_cache_dir,
+            memory_entries=settings.embedding_cache_memory_entries,
+            disk_entries=settings.embedding_cache_disk_entries
+        )
     
-    def _load_embedding_model(self):
-        """Load the sentence transformer model"""
-        try:
-            if not self.use_openai_embeddings:
-                self.embedding_model = SentenceTransformer(self.model_name)
-                logger.info(f"Loaded embedding model: {self.model_name}")
-            else:
-                logger.info("Using OpenAI embeddings")
-        except Exception as e:
-            logger.error(f"Error loading embedding model: {e}")
-            self.embedding_model = None
+    @property
+    def embedding_model(self) -> Optional[LoadedEmbeddingModel]:
+        """Shared local embedding model, loaded on first use"""
+        return embedding_model_registry.get(self.model_name)
     
     def get_embedding(self, text: str) -> np.ndarray:
         """Generate embedding for text"""
         start_time = time.time()
         
+        cached = self.embedding_cache.get(text)
+        if cached is not None:
+            return cached
+        
+        # No stand-in vector: searches would rank by noise and writes would store it
+        model = self.embedding_model
+        if model is None:
+            raise EmbeddingModelUnavailable(self.model_name)
+        
         try:
-            if self.use_openai_embeddings:
-                response = openai.Embedding.create(
-                    input=text,
-                    model="text-embedding-ada-002"
-                )
-                embedding = np.array(response['data'][0]['embedding'])
-            else:
-                if self.embedding_model is None:
-                    logger.warning("Embedding model not loaded, using random vector")
-                    embedding = np.random.rand(self.embedding_dimension)
-                else:
-                    embedding = self.embedding_model.encode(text)
-            
-            embedding_time = int((time.time() - start_time) * 1000)
-            logger.debug(f"Generated embedding in {embedding_time}ms")
-            
-            return embedding
-            
+            embedding = model.batcher.encode(text)
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
-            return np.random.rand(self.embedding_dimension)
+            raise
+        self.embedding_cache.put(text, embedding)
+        
+        embedding_time = int((time.time() - start_time) * 1000)
+        logger.debug(f"Generated embedding in {embedding_time}ms")
+        
+        return embedding
     
-    def create_product_embeddings(self, restaurant_id: int, db: Session) -> Dict[str, int]:
-        """Create embeddings for all products in a restaurant"""
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Generate embeddings for many texts, encoding all cache misses in one model call"""
         
-        products = db.query(Product).filter(
-            Product.restaurant_id == restaurant_id,
-            Product.available == True
-        ).all()
+        embeddings = [self.embedding_cache.get(text) for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
         
-        stats = {'created': 0, 'updated': 0, 'errors': 0}
+        if missing:
+            model = self.embedding_model
+            if model is None:
+                # Random vectors would be stored as if they were real and never re-embedded
+                raise EmbeddingModelUnavailable(self.model_name)
+            encoded = model.encode_batch([texts[i] for i in missing])
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+                self.embedding_cache.put(texts[i], embedding)
         
-        for product in products:
-            try:
-                # Check if embedding already exists
-                existing_embedding = db.query(ProductEmbedding).filter(
-                    ProductEmbedding.product_id == product.id
-                ).first()
-                
-                # Create searchable content
-                content_parts = [product.name]
-                if product.description:
-                    content_parts.append(product.description)
-                content_parts.append(product.category)
-                
-                # Add price context in Spanish
-                if product.price < 10000:
-                    content_parts.append("económico barato accesible")
-                elif product.price > 25000:
-                    content_parts.append("premium caro exclusivo")
-                else:
-                    content_parts.append("precio medio estándar")
-                
-                # Add Colombian food context
-                if 'bandeja' in product.name.lower():
-                    content_parts.append("típico tradicional colombiano completo")
-                elif 'empanada' in product.name.lower():
-                    content_parts.append("frito entrada aperitivo")
-                elif 'sancocho' in product.name.lower():
-                    content_parts.append("sopa caliente tradicional familiar")
-                elif 'arepa' in product.name.lower():
-                    content_parts.append("maíz tradicional desayuno")
-                
-                content = " ".join(content_parts)
-                
-                # Generate embedding
-                embedding = self.get_embedding(content)
-                embedding_str = f"[{','.join(map(str, embedding.tolist()))}]"
-                
-                if existing_embedding:
-                    # Update existing
-                    existing_embedding.content = content
-                    existing_embedding.embedding = embedding_str
-                    existing_embedding.embedding_model = self.model_name
-                    stats['updated'] += 1
-                else:
-                    # Create new
-                    new_embedding = ProductEmbedding(
-                        product_id=product.id,
-                        restaurant_id=restaurant_id,
-                        content=content,
-                        embedding=embedding_str,
-                        embedding_model=self.model_name
-                    )
-                    db.add(new_embedding)
-                    stats['created'] += 1
-                
-            except Exception as e:
-                logger.error(f"Error creating embedding for product {product.id}: {e}")
-                stats['errors'] += 1
+        return np.vstack(embeddings) if embeddings else np.zeros((0, self.embedding_dimension))
+    
+    def create_product_embeddings(self, restaurant_id: int, db: Session) -> Dict[str, int]:
+        """Create embeddings for products whose content changed since the last run"""
+        
+        stats = upsert_product_embeddings(restaurant_id, db, self.get_embeddings, self.model_name)
         
-        db.commit()
-        logger.info(f"Product embeddings: {stats}")
+        if stats['created'] or stats['updated']:
+            restaurant_vector_index.invalidate(restaurant_id, 'products')
+        
+        # Restaurants on (or migrating to) another model keep its vectors current too
+        if stored_models(restaurant_id, db):
+            write_model_embeddings(restaurant_id, 'product', source_items('product', restaurant_id, db), db)
         return stats
     
     def search_products_semantic_supabase(
@@ -153,37 +118,50 @@ class SupabaseVectorSearchService:
         restaurant_id: int, 
         db: Session,
         limit: int = 5,
-        similarity_threshold: float = 0.3
+        similarity_threshold: float = 0.3,
+        query_embedding: Optional[np.ndarray] = None,
+        ef_search: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """Search products using Supabase native vector functions"""
         
         start_time = time.time()
         
         try:
-            # Generate embedding for query
+            # Restaurants on another embedding model search model_embeddings instead
+            model_name = active_embedding_model(restaurant_id, db)
+            if model_name != self.model_name:
+                return search_model_embeddings(
+                    'products', model_name, query, restaurant_id, db, limit, similarity_threshold,
+                    ef_search=ef_search
+                )
+            
+            # Generate embedding for query unless the caller already has it
             embedding_start = time.time()
-            query_embedding = self.get_embedding(query)
+            if query_embedding is None:
+                query_embedding = self.get_embedding(query)
             embedding_time = int((time.time() - embedding_start) * 1000)
             
-            # Format embedding as Supabase vector string
-            embedding_str = f"[{','.join(map(str, query_embedding.tolist()))}]"
-            
             # Use Supabase function for optimized search
             search_start = time.time()
             
-            results = db.execute(text("""
-                SELECT * FROM match_products(
-                    CAST(:query_embedding AS vector),
-                    :restaurant_id,
-                    :match_threshold,
-                    :match_count
-                )
-            """), {
-                'query_embedding': embedding_str,
-                'restaurant_id': restaurant_id,
-                'match_threshold': similarity_threshold,
-                'match_count': limit
-            }).fetchall()
+            apply_search_tuning(db, ef_search)
+            
+            with latency_recorder.measure('vector_sql', restaurant_id):
+                results = db.execute(text("""
+                    SELECT * FROM match_products(
+                        CAST(:query_embedding AS vector),
+                        :restaurant_id,
+                        :match_threshold,
+                        :match_count,
+                        :candidate_count
+                    )
+                """), {
+                    'query_embedding': vector_param(query_embedding),
+                    'restaurant_id': restaurant_id,
+                    'match_threshold': similarity_threshold,
+                    'match_count': limit,
+                    'candidate_count': limit * max(1, settings.vector_rerank_factor)
+                }).fetchall()
             
             search_time = int((time.time() - search_start) * 1000)
             total_time = int((time.time() - start_time) * 1000)
@@ -205,7 +183,8 @@ class SupabaseVectorSearchService:
             self._log_search(
                 query, 'products', restaurant_id, db,
                 len(products), max([p['similarity_score'] for p in products] + [0]),
-                total_time, embedding_time
+                total_time, embedding_time,
+                query_embedding=query_embedding
             )
             
             logger.info(f"Supabase semantic search '{query}' found {len(products)} products in {total_time}ms")
@@ -214,7 +193,10 @@ class SupabaseVectorSearchService:
         except Exception as e:
             logger.error(f"Error in Supabase semantic search: {e}")
             # Fallback to regular search
-            return self._fallback_search_products(query, restaurant_id, db, limit, similarity_threshold)
+            db.rollback()
+            return self._fallback_search_products(
+                query, restaurant_id, db, limit, similarity_threshold, query_embedding, ef_search
+            )
     
     def search_knowledge_base_supabase(
         self,
@@ -222,27 +204,41 @@ class SupabaseVectorSearchService:
         restaurant_id: int,
         db: Session,
         limit: int = 3,
-        similarity_threshold: float = 0.4
+        similarity_threshold: float = 0.4,
+        query_embedding: Optional[np.ndarray] = None,
+        ef_search: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """Search knowledge base using Supabase native functions"""
         
         try:
-            query_embedding = self.get_embedding(query)
-            embedding_str = f"[{','.join(map(str, query_embedding.tolist()))}]"
-            
-            results = db.execute(text("""
-                SELECT * FROM match_knowledge(
-                    CAST(:query_embedding AS vector),
-                    :restaurant_id,
-                    :match_threshold,
-                    :match_count
+            model_name = active_embedding_model(restaurant_id, db)
+            if model_name != self.model_name:
+                return search_model_embeddings(
+                    'knowledge', model_name, query, restaurant_id, db, limit, similarity_threshold,
+                    ef_search=ef_search
                 )
-            """), {
-                'query_embedding': embedding_str,
-                'restaurant_id': restaurant_id,
-                'match_threshold': similarity_threshold,
-                'match_count': limit
-            }).fetchall()
+            
+            if query_embedding is None:
+                query_embedding = self.get_embedding(query)
+            
+            apply_search_tuning(db, ef_search)
+            
+            with latency_recorder.measure('vector_sql', restaurant_id):
+                results = db.execute(text("""
+                    SELECT * FROM match_knowledge(
+                        CAST(:query_embedding AS vector),
+                        :restaurant_id,
+                        :match_threshold,
+                        :match_count,
+                        :candidate_count
+                    )
+                """), {
+                    'query_embedding': vector_param(query_embedding),
+                    'restaurant_id': restaurant_id,
+                    'match_threshold': similarity_threshold,
+                    'match_count': limit,
+                    'candidate_count': limit * max(1, settings.vector_rerank_factor)
+                }).fetchall()
             
             knowledge_items = []
             for row in results:
@@ -254,6 +250,7 @@ class SupabaseVectorSearchService:
                     'similarity_score': round(row.similarity, 3)
                 })
             
+            access_stats.record_knowledge(item['id'] for item in knowledge_items)
             return knowledge_items
             
         except Exception as e:
@@ -266,49 +263,63 @@ class SupabaseVectorSearchService:
         customer_phone: str,
         restaurant_id: int,
         db: Session,
-        limit: int = 3
+        limit: int = 3,
+        query_embedding: Optional[np.ndarray] = None,
+        ef_search: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """Search conversation memories using Supabase functions"""
         
         try:
-            query_embedding = self.get_embedding(query)
-            embedding_str = f"[{','.join(map(str, query_embedding.tolist()))}]"
-            
-            results = db.execute(text("""
-                SELECT * FROM match_memories(
-                    CAST(:query_embedding AS vector),
-                    :customer_phone,
-                    :restaurant_id,
-                    :match_count
+            model_name = active_embedding_model(restaurant_id, db)
+            if model_name != self.model_name:
+                memories = search_model_embeddings(
+                    'memories', model_name, query, restaurant_id, db, limit,
+                    customer_phone=customer_phone, ef_search=ef_search
                 )
-            """), {
-                'query_embedding': embedding_str,
-                'customer_phone': customer_phone,
-                'restaurant_id': restaurant_id,
-                'match_count': limit
-            }).fetchall()
-            
-            memories = []
+                access_stats.record_memories(memory['id'] for memory in memories)
+                return memories
+            
+            if query_embedding is None:
+                query_embedding = self.get_embedding(query)
+            
+            apply_search_tuning(db, ef_search)
+            
+            # Stage one: nearest candidates from the SQL function
+            with latency_recorder.measure('vector_sql', restaurant_id):
+                results = db.execute(text("""
+                    SELECT * FROM match_memories(
+                        CAST(:query_embedding AS vector),
+                        :customer_phone,
+                        :restaurant_id,
+                        :match_count,
+                        :candidate_factor
+                    )
+                """), {
+                    'query_embedding': vector_param(query_embedding),
+                    'customer_phone': customer_phone,
+                    'restaurant_id': restaurant_id,
+                    'match_count': limit,
+                    'candidate_factor': max(1, settings.memory_candidate_factor)
+                }).fetchall()
+            
+            candidates = []
             for row in results:
-                memories.append({
+                candidates.append({
                     'id': row.id,
                     'memory_type': row.memory_type,
                     'content': row.content,
                     'summary': row.summary,
                     'importance_score': row.importance_score,
+                    'access_count': row.access_count,
                     'similarity_score': round(row.similarity, 3),
                     'created_at': row.created_at
                 })
             
-            # Update access count
-            for memory in memories:
-                db.execute(text("""
-                    UPDATE conversation_memories 
-                    SET access_count = access_count + 1, last_accessed = NOW()
-                    WHERE id = :memory_id
-                """), {'memory_id': memory['id']})
+            # Stage two: same ranking as VectorSearchService.search_conversation_memory
+            memories = rerank_memories(candidates, limit)
             
-            db.commit()
+            # Access counts are written later in bulk, not inside the chat turn
+            access_stats.record_memories(memory['id'] for memory in memories)
             return memories
             
         except Exception as e:
@@ -331,7 +342,6 @@ class SupabaseVectorSearchService:
         try:
             # Generate embedding
             embedding = self.get_embedding(content + " " + summary)
-            embedding_str = f"[{','.join(map(str, embedding.tolist()))}]"
             
             memory = ConversationMemory(
                 conversation_id=conversation_id,
@@ -341,11 +351,14 @@ class SupabaseVectorSearchService:
                 content=content,
                 summary=summary,
                 importance_score=importance_score,
-                embedding=embedding_str
+                embedding=vector_param(embedding)
             )
             
             db.add(memory)
             db.commit()
+            write_model_embeddings(
+                restaurant_id, 'memory', [(memory.id, content + " " + summary, customer_phone)], db
+            )
             
             logger.info(f"Stored memory: {memory_type} for customer {customer_phone}")
             return True
@@ -369,7 +382,6 @@ class SupabaseVectorSearchService:
             # Create searchable content
             searchable_content = f"{question} {answer} {' '.join(tags)}"
             embedding = self.get_embedding(searchable_content)
-            embedding_str = f"[{','.join(map(str, embedding.tolist()))}]"
             
             kb_entry = KnowledgeBase(
                 restaurant_id=restaurant_id,
@@ -378,11 +390,13 @@ class SupabaseVectorSearchService:
                 category=category,
                 tags=tags,
                 searchable_content=searchable_content,
-                embedding=embedding_str
+                embedding=vector_param(embedding)
             )
             
             db.add(kb_entry)
             db.commit()
+            restaurant_vector_index.invalidate(restaurant_id, 'knowledge')
+            write_model_embeddings(restaurant_id, 'knowledge', [(kb_entry.id, searchable_content, None)], db)
             
             logger.info(f"Created knowledge base entry: {category}")
             return True
@@ -397,37 +411,53 @@ class SupabaseVectorSearchService:
         restaurant_id: int, 
         db: Session,
         limit: int,
-        similarity_threshold: float
+        similarity_threshold: float,
+        query_embedding: Optional[np.ndarray] = None,
+        ef_search: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """Fallback search when Supabase functions are not available"""
         
         try:
-            query_embedding = self.get_embedding(query)
-            embedding_str = f"[{','.join(map(str, query_embedding.tolist()))}]"
-            
-            results = db.execute(text("""
-                SELECT 
-                    pe.product_id,
-                    pe.content,
-                    p.name,
-                    p.description,
-                    p.price,
-                    p.category,
-                    p.available,
-                    (pe.embedding <=> CAST(:query_embedding AS vector)) as distance
-                FROM product_embeddings pe
-                JOIN products p ON pe.product_id = p.id
-                WHERE pe.restaurant_id = :restaurant_id 
-                    AND p.available = true
-                    AND (pe.embedding <=> CAST(:query_embedding AS vector)) < :threshold
-                ORDER BY pe.embedding <=> CAST(:query_embedding AS vector)
-                LIMIT :limit
-            """), {
-                'query_embedding': embedding_str,
-                'restaurant_id': restaurant_id,
-                'threshold': 1 - similarity_threshold,
-                'limit': limit
-            }).fetchall()
+            if query_embedding is None:
+                query_embedding = self.get_embedding(query)
+            
+            apply_search_tuning(db, ef_search)
+            
+            # Same two stages as VectorSearchService: compact candidates, full-precision rerank
+            with latency_recorder.measure('vector_sql', restaurant_id):
+                results = db.execute(text(f"""
+                    SELECT * FROM (
+                        SELECT 
+                            c.product_id,
+                            c.content,
+                            c.name,
+                            c.description,
+                            c.price,
+                            c.category,
+                            c.available,
+                            {rerank_distance('c.embedding')} AS distance
+                        FROM (
+                            SELECT pe.product_id, pe.content, pe.embedding,
+                                p.name, p.description, p.price, p.category, p.available
+                            FROM product_embeddings pe
+                            JOIN products p ON pe.product_id = p.id
+                            WHERE pe.restaurant_id = :restaurant_id 
+                                AND p.available = true
+                            ORDER BY {first_pass_order('pe.embedding')}
+                            LIMIT :candidates
+                        ) c
+                        ORDER BY distance
+                        LIMIT :limit
+                    ) ranked
+                    WHERE distance < :threshold
+                    ORDER BY distance
+                """), {
+                    'query_embedding': vector_param(query_embedding),
+                    'restaurant_id': restaurant_id,
+                    'threshold': 1 - similarity_threshold,
+                    'candidates': candidate_count(limit),
+                    'limit': limit
+                }).fetchall()
             
             products = []
             for row in results:
@@ -458,31 +488,29 @@ class SupabaseVectorSearchService:
         top_similarity: float,
         search_time_ms: int,
         embedding_time_ms: int,
-        conversation_id: Optional[int] = None
+        conversation_id: Optional[int] = None,
+        query_embedding: Optional[np.ndarray] = None
     ):
-        """Log search for analytics"""
+        """Queue search for analytics, written in bulk by the background log writer"""
         
-        try:
-            query_embedding = self.get_embedding(query)
-            embedding_str = f"[{','.join(map(str, query_embedding.tolist()))}]"
-            
-            log = SearchLog(
-                conversation_id=conversation_id,
-                restaurant_id=restaurant_id,
-                query=query,
-                search_type=search_type,
-                embedding=embedding_str,
-                results_found=results_found,
-                top_similarity=top_similarity,
-                search_time_ms=search_time_ms,
-                embedding_time_ms=embedding_time_ms
-            )
-            
-            db.add(log)
-            db.commit()
-            
-        except Exception as e:
-            logger.error(f"Error logging search: {e}")
+        # Percentiles come from the sketches, which see every search (the log writer may sample)
+        latency_recorder.record('search', restaurant_id, search_time_ms)
+        if embedding_time_ms:
+            # 0 means the embedding was cached or passed in; the stage only counts real encodes
+            latency_recorder.record('embedding', restaurant_id, embedding_time_ms)
+        
+        # Reuse the embedding computed by the search itself, no extra inference here
+        search_log_writer.log(
+            conversation_id=conversation_id,
+            restaurant_id=restaurant_id,
+            query=query,
+            search_type=search_type,
+            embedding=query_embedding,
+            results_found=results_found,
+            top_similarity=top_similarity,
+            search_time_ms=search_time_ms,
+            embedding_time_ms=embedding_time_ms
+        )
 
 
 # Global service instance optimized for Supabase
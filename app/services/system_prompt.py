@@ -0,0 +1,402 @@
+"""
+Compiled per-restaurant system prompts
+The static part of the agent's system prompt (instructions, restaurant facts and the
+formatted menu) is rendered once per restaurant and menu epoch. A turn only splices
+in the customer name, the current order and the semantic search hits.
+
+Restaurant facts come from Restaurant.config, with these defaults:
+
+    hours            "Lunes a Domingo, 10:00 AM - 10:00 PM"
+    delivery_time    "30-45 minutos"
+    delivery_fee     3000 (COP)
+    recommendations  lines of the "RECOMENDACIONES INTELIGENTES" section
+    example_reply    sample answer to "Hola, tengo hambre" (after the greeting)
+
+Changes to products, the restaurant's name, description or config advance the menu
+epoch, so the next turn compiles again. The whole menu is compiled, with the token count
+of every entry; how much of it a turn sends is decided by the context budget
+(app/services/context_budget.py).
+"""
+import itertools
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+from sqlalchemy.orm import Session
+from app.models.product import Product
+from app.models.restaurant import Restaurant
+from app.services.menu_epoch import menu_epochs
+from app.services.token_counter import count_tokens
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FACTS = {
+    'hours': "Lunes a Domingo, 10:00 AM - 10:00 PM",
+    'delivery_time': "30-45 minutos",
+    'delivery_fee': 3000,
+    'recommendations': [
+        'Si pide "algo típico": recomienda Bandeja Paisa o Sancocho',
+        'Si pregunta por entradas: sugiere empanadas o patacones',
+        'Si quiere bebidas: recomienda limonada de coco o jugos naturales',
+        'Para postres: sugiere tres leches o flan de coco',
+    ],
+    'example_reply': (
+        "¿Qué antojo tienes hoy? Tenemos deliciosos platos típicos colombianos. "
+        "¿Te provoca algo contundente como una Bandeja Paisa ($28,000) o prefieres "
+        "empezar con unas empanadas ($8,000)?"
+    ),
+}
+
+# Stands in for the customer name while compiling; split on when rendering
+_CUSTOMER = "\x00customer\x00"
+
+
+def _fact_text(value: Any) -> Optional[str]:
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        return str(value).strip() or None
+    return None
+
+
+def _fact_fee(value: Any) -> Optional[float]:
+    """Fee as a number; strings such as "5000" or "$5,000" are accepted"""
+    if isinstance(value, str):
+        value = value.replace('$', '').replace(',', '').strip()
+    if isinstance(value, bool):
+        return None
+    try:
+        fee = float(value)
+    except (TypeError, ValueError):
+        return None
+    return fee if fee >= 0 else None
+
+
+def _fact_lines(value: Any) -> Optional[List[str]]:
+    """Recommendation lines; a single string is one line"""
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        return None
+    lines = [text for text in (_fact_text(item) for item in value) if text]
+    return lines or None
+
+
+_FACT_PARSERS = {
+    'hours': _fact_text,
+    'delivery_time': _fact_text,
+    'delivery_fee': _fact_fee,
+    'recommendations': _fact_lines,
+    'example_reply': _fact_text,
+}
+
+
+def restaurant_facts(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Prompt facts from a restaurant config; missing or invalid values fall back to the defaults"""
+    config = config if isinstance(config, dict) else {}
+    facts = {}
+    for key, default in DEFAULT_FACTS.items():
+        value = config.get(key)
+        parsed = _FACT_PARSERS[key](value) if value is not None else None
+        if parsed is None:
+            if value not in (None, '', []):
+                logger.warning(f"Ignoring invalid restaurant config {key}={value!r}, using the default")
+            parsed = default
+        facts[key] = parsed
+    return facts
+
+
+def format_category(category: str) -> str:
+    return f"\n\n--- {category.upper()} ---"
+
+
+def format_menu_entry(product: Dict[str, Any]) -> str:
+    entry = f"\n• {product['name']} - ${product['price']:,.0f}"
+    if product['description']:
+        entry += f"\n  {product['description']}"
+    return entry
+
+
+def format_menu(products_by_category: Dict[str, List[Dict[str, Any]]]) -> str:
+    lines = []
+    for category, products in products_by_category.items():
+        lines.append(format_category(category))
+        lines.extend(format_menu_entry(product) for product in products)
+    return "".join(lines)
+
+
+def format_partial_menu_note(omitted: int) -> str:
+    return (
+        f"\n\n(Menú parcial: {omitted} productos más no aparecen aquí. Si el cliente pide algo "
+        "que no ves, no digas que no existe: ofrécele ver el menú completo.)"
+    )
+
+
+def format_order(current_order: Optional[Dict[str, Any]]) -> str:
+    if not current_order:
+        return "\n\nEL CLIENTE AÚN NO TIENE PRODUCTOS EN SU PEDIDO."
+    lines = ["\n\nPEDIDO ACTUAL DEL CLIENTE:"]
+    for item in current_order['items']:
+        lines.append(f"\n• {item['name']} x{item['quantity']} = ${item['total']:,.0f}")
+    lines.append(f"\nTotal actual: ${current_order['total']:,.0f}")
+    return "".join(lines)
+
+
+def _semantic_product(product: Dict[str, Any]) -> str:
+    line = f"\n• {product['name']} - ${product['price']:,.0f}"
+    if product['description']:
+        line += f" - {product['description']}"
+    return f"{line} (relevancia: {product['similarity_score']:.1f})"
+
+
+# Context key -> (section header, item formatter), in prompt order
+SEMANTIC_SECTIONS = {
+    'semantic_products': ("\n\n🎯 PRODUCTOS MÁS RELEVANTES PARA ESTA CONSULTA:", _semantic_product),
+    'relevant_knowledge': (
+        "\n\n📚 INFORMACIÓN RELEVANTE DEL RESTAURANTE:",
+        lambda item: f"\nP: {item['question']}\nR: {item['answer']}"
+    ),
+    'customer_memories': (
+        "\n\n🧠 RECORDAR SOBRE ESTE CLIENTE:",
+        lambda memory: f"\n• {memory['summary']} ({memory['memory_type']})"
+    ),
+}
+
+SEMANTIC_INSTRUCTION = (
+    "\n\n⚡ INSTRUCCIÓN ESPECIAL: Usa la información de relevancia semántica arriba "
+    "para dar respuestas más precisas y personalizadas."
+)
+
+
+def has_semantic_hits(context: Optional[Dict[str, Any]]) -> bool:
+    return bool(context) and any(context.get(key) for key in SEMANTIC_SECTIONS)
+
+
+def format_semantic_hits(context: Dict[str, Any]) -> str:
+    """Products, knowledge and customer memories found for this message"""
+    lines = []
+    for key, (header, format_item) in SEMANTIC_SECTIONS.items():
+        if context.get(key):
+            lines.append(header)
+            lines.extend(format_item(item) for item in context[key])
+    lines.append(SEMANTIC_INSTRUCTION)
+    return "".join(lines)
+
+
+class CompiledPrompt:
+    """System prompt of one restaurant at one menu epoch, minus the per-turn parts"""
+
+    def __init__(
+        self,
+        restaurant_id: int,
+        epoch: int,
+        restaurant: Dict[str, Any],
+        products_by_category: Dict[str, List[Dict[str, Any]]]
+    ):
+        self.restaurant_id = restaurant_id
+        self.epoch = epoch
+        self.restaurant = restaurant
+        self.products_by_category = products_by_category
+
+        facts = restaurant_facts(restaurant['config'])
+        name = restaurant['name']
+        fee = f"${facts['delivery_fee']:,.0f}"
+        recommendations = "".join(f"\n   - {line}" for line in facts['recommendations'])
+
+        self.intro = f"""Eres un asistente virtual especializado en ventas para {name}, un restaurante colombiano.
+
+TU OBJETIVO PRINCIPAL: Ayudar al cliente a realizar pedidos de comida de manera amigable y eficiente.
+
+INFORMACIÓN DEL RESTAURANTE:
+- Nombre: {name}
+- Descripción: {restaurant.get('description') or 'Restaurante colombiano tradicional'}
+- Horario: {facts['hours']}
+- Entrega: {facts['delivery_time']} en toda la ciudad
+- Costo de entrega: {fee} COP
+
+MENÚ DISPONIBLE:"""
+        self.menu = format_menu(products_by_category)
+
+        instructions = f"""
+
+INSTRUCCIONES DE COMPORTAMIENTO:
+
+1. PERSONALIZACIÓN:
+   - Dirígete al cliente como "{_CUSTOMER}" cuando sea apropiado
+   - Sé cálido, amigable y profesional
+   - Usa el contexto colombiano naturalmente
+
+2. PROCESO DE VENTA:
+   - Saluda al cliente y presenta el restaurante
+   - Pregunta por sus preferencias o antoja
+   - Recomienda productos específicos del menú
+   - Explica los productos cuando lo pidas
+   - Ayuda a construir el pedido paso a paso
+   - Confirma cada item agregado
+   - Sugiere complementos apropiados
+
+3. RECOMENDACIONES INTELIGENTES:{recommendations}
+   - Siempre menciona el precio cuando recomiendes
+
+4. RESPUESTAS A CONSULTAS:
+   - Horarios: "Nuestro horario es {facts['hours']}"
+   - Entrega: "Hacemos entregas en {facts['delivery_time']} por {fee} adicionales"
+   - Precios: Siempre menciona precios específicos del menú
+   - Disponibilidad: Solo ofrece productos que están en el menú actual
+
+5. MANEJO DEL PEDIDO:
+   - Usa frases como "perfecto, he agregado..." cuando confirmes items
+   - Mantén un resumen claro del pedido
+   - Sugiere cuando el pedido esté completo para proceder al pago
+   - Pregunta por detalles de entrega si es necesario
+
+6. TONO Y ESTILO:
+   - Natural y conversacional
+   - Entusiasta pero no agresivo
+   - Usa emojis moderadamente (🍽️ 🥘 😊)
+   - Evita ser repetitivo
+   - Responde de manera concisa pero completa
+
+7. LIMITACIONES:
+   - NO agregues productos automáticamente al pedido
+   - NO inventes productos que no están en el menú
+   - NO prometas tiempos de entrega diferentes a {facts['delivery_time']}
+   - Si no sabes algo específico, ofrece contactar directamente
+
+EJEMPLO DE CONVERSACIÓN IDEAL:
+Cliente: "Hola, tengo hambre"
+Tú: "¡Hola {_CUSTOMER}! 😊 {facts['example_reply']}"
+
+RESPONDE SIEMPRE EN ESPAÑOL y mantén el foco en ayudar al cliente a completar su pedido de manera natural y eficiente."""
+
+        # Joined with the customer name on every turn
+        self.instructions = instructions.split(_CUSTOMER)
+
+        # Token counts for the context budget, paid once per epoch
+        self.menu_entries = [
+            (category, format_menu_entry(product))
+            for category, products in products_by_category.items()
+            for product in products
+        ]
+        self.menu_entry_tokens = [count_tokens(entry) for _, entry in self.menu_entries]
+        self.category_tokens = {
+            category: count_tokens(format_category(category)) for category in products_by_category
+        }
+        self.menu_tokens = sum(self.menu_entry_tokens) + sum(self.category_tokens.values())
+        self.base_tokens = count_tokens(self.intro) + sum(count_tokens(segment) for segment in self.instructions)
+
+        # Order in which a cut menu is filled: one product per category per round,
+        # so every category stays represented
+        indexes_by_category: Dict[str, List[int]] = {}
+        for index, (category, _) in enumerate(self.menu_entries):
+            indexes_by_category.setdefault(category, []).append(index)
+        self.menu_fill_order = [
+            index
+            for round_ in itertools.zip_longest(*indexes_by_category.values())
+            for index in round_ if index is not None
+        ]
+
+    def render_menu(self, selected: Iterable[int]) -> str:
+        """Menu with only the entries at the given indexes of menu_entries, plus a note on the rest"""
+        selected = set(selected)
+        lines = []
+        current_category = None
+        for index, (category, entry) in enumerate(self.menu_entries):
+            if index not in selected:
+                continue
+            if category != current_category:
+                lines.append(format_category(category))
+                current_category = category
+            lines.append(entry)
+        omitted = len(self.menu_entries) - len(selected)
+        if omitted:
+            lines.append(format_partial_menu_note(omitted))
+        return "".join(lines)
+
+    def render(
+        self,
+        customer_name: Optional[str],
+        current_order: Optional[Dict[str, Any]],
+        context: Optional[Dict[str, Any]] = None,
+        menu: Optional[str] = None
+    ) -> str:
+        """Full system prompt for a turn; semantic hits are appended when context has them
+
+        `menu` replaces the whole compiled menu (see render_menu).
+        """
+        parts = [
+            self.intro,
+            self.menu if menu is None else menu,
+            format_order(current_order),
+            (customer_name or "cliente").join(self.instructions)
+        ]
+        if has_semantic_hits(context):
+            parts.append(format_semantic_hits(context))
+        return "".join(parts)
+
+
+def compile_system_prompt(restaurant_id: int, epoch: int, db: Session) -> CompiledPrompt:
+    restaurant = db.query(Restaurant).filter(Restaurant.id == restaurant_id).first()
+
+    # Stable order so the prompt text only changes when the menu does
+    products = db.query(Product).filter(
+        Product.restaurant_id == restaurant_id,
+        Product.available == True
+    ).order_by(Product.category, Product.id).all()
+
+    products_by_category: Dict[str, List[Dict[str, Any]]] = {}
+    for product in products:
+        products_by_category.setdefault(product.category, []).append({
+            'id': product.id,
+            'name': product.name,
+            'description': product.description,
+            'price': product.price
+        })
+
+    return CompiledPrompt(
+        restaurant_id,
+        epoch,
+        {
+            'name': restaurant.name if restaurant else 'Restaurante',
+            'description': restaurant.description if restaurant else '',
+            'config': (restaurant.config if restaurant else None) or {}
+        },
+        products_by_category
+    )
+
+
+class SystemPromptCache:
+    """Compiled prompt per restaurant, recompiled when the menu epoch moves"""
+
+    def __init__(self):
+        self._compiled: Dict[int, CompiledPrompt] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {'hits': 0, 'compiles': 0}
+
+    def get(self, restaurant_id: int, db: Session) -> CompiledPrompt:
+        # Epoch read before the queries: a change committed meanwhile only costs a recompile
+        epoch = menu_epochs.current(restaurant_id)
+        compiled = self._compiled.get(restaurant_id)
+        if compiled is not None and compiled.epoch == epoch:
+            self.stats['hits'] += 1
+            return compiled
+
+        compiled = compile_system_prompt(restaurant_id, epoch, db)
+        with self._lock:
+            self._compiled[restaurant_id] = compiled
+            self.stats['compiles'] += 1
+        logger.debug(f"Compiled system prompt for restaurant {restaurant_id} at epoch {epoch}")
+        return compiled
+
+    def invalidate(self, restaurant_id: Optional[int] = None):
+        with self._lock:
+            if restaurant_id is None:
+                self._compiled.clear()
+            else:
+                self._compiled.pop(restaurant_id, None)
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        return {**self.stats, 'restaurants': len(self._compiled)}
+
+
+# Global compiled prompt cache
+system_prompt_cache = SystemPromptCache()
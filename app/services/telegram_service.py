@@ -1,4 +1,5 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 from sqlalchemy.orm import Session
 from app.core.database import get_db
@@ -8,8 +9,11 @@ from app.models.message import Message
 from app.models.product import Product
 from app.models.order import Order, OrderItem, OrderStatus
 from app.core.config import settings
+import asyncio
 import logging
 import json
+import time
+from typing import AsyncIterator, Optional
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -17,7 +21,13 @@ logger = logging.getLogger(__name__)
 
 class TelegramBot:
     def __init__(self):
-        self.application = Application.builder().token(settings.telegram_bot_token).build()
+        # Updates from different chats are handled concurrently instead of one at a time
+        self.application = (
+            Application.builder()
+            .token(settings.telegram_bot_token)
+            .concurrent_updates(settings.telegram_concurrent_updates)
+            .build()
+        )
         self.setup_handlers()
 
     def setup_handlers(self):
@@ -371,34 +381,111 @@ Lunes a Domingo: 10:00 AM - 10:00 PM
         user = update.effective_user
         chat_id = str(update.effective_chat.id)
         
+        from app.services.conversational_agent import conversational_agent
+        
+        # Blocking DB work goes to the agent's threads so other chats keep being served
         db = next(get_db())
-        conversation = self.get_or_create_conversation(db, chat_id, user.first_name)
+        conversation = await conversational_agent.run_blocking(
+            self.start_turn, db, chat_id, user.first_name, user_message
+        )
         
-        # Save user message
-        self.save_message(db, conversation.id, user_message, True)
+        # Create buttons
+        keyboard = [
+            [InlineKeyboardButton("🍽️ Ver Menú", callback_data="show_menu")],
+            [InlineKeyboardButton("🛒 Ver Pedido", callback_data="show_order")],
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
         
+        sent = False
         try:
             # Generate intelligent response using LLM agent
-            from app.services.conversational_agent import conversational_agent
-            response = conversational_agent.generate_response(user_message, conversation, db)
+            if settings.telegram_stream_responses:
+                response = await self.stream_reply(
+                    update, conversational_agent.stream_response(user_message, conversation, db), reply_markup
+                )
+                sent = True
+            else:
+                response = await conversational_agent.generate_response(user_message, conversation, db)
             
             # Save bot response
-            self.save_message(db, conversation.id, response, False)
+            await conversational_agent.run_blocking(
+                lambda: self.save_message(db, conversation.id, response, False)
+            )
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             # Rollback the transaction to recover from error
-            db.rollback()
-            response = self.generate_response(user_message)
+            await conversational_agent.run_blocking(db.rollback)
+            if not sent:
+                response = self.generate_response(user_message)
+        
+        if not sent:
+            await update.message.reply_text(response, reply_markup=reply_markup)
+        await conversational_agent.run_blocking(db.close)
+
+    async def stream_reply(
+        self, update: Update, deltas: AsyncIterator[str], reply_markup: InlineKeyboardMarkup
+    ) -> str:
+        """Show the reply while it is generated: one message, edited at a limited rate
+        
+        The first text is sent as soon as it arrives; edits follow at most every
+        telegram_stream_edit_interval_seconds (Telegram throttles frequent edits)
+        and the buttons are attached with the final text. Raises only if nothing
+        was shown; once a message is on screen, errors are logged and the text
+        shown so far is returned.
+        """
+        text = ""
+        message = None
+        shown = ""
+        next_edit = 0.0
         
-        # Create buttons
-        keyboard = [
-            [InlineKeyboardButton("🍽️ Ver Menú", callback_data="show_menu")],
-            [InlineKeyboardButton("🛒 Ver Pedido", callback_data="show_order")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        try:
+            async for delta in deltas:
+                text += delta
+                if not text.strip():
+                    continue
+                if message is None:
+                    message = await update.message.reply_text(text)
+                    shown = text
+                    next_edit = time.monotonic() + settings.telegram_stream_edit_interval_seconds
+                elif time.monotonic() >= next_edit and text != shown:
+                    retry_after = await self._edit_reply(message, text)
+                    if retry_after is None:
+                        shown = text
+                    next_edit = time.monotonic() + max(retry_after or 0, settings.telegram_stream_edit_interval_seconds)
+            
+            text = text.strip()
+            if message is None:
+                await update.message.reply_text(text, reply_markup=reply_markup)
+                return text
+            
+            # The final edit must land: wait out a flood limit once if Telegram asks for it
+            retry_after = await self._edit_reply(message, text, reply_markup)
+            if retry_after is not None:
+                await asyncio.sleep(retry_after)
+                await self._edit_reply(message, text, reply_markup)
+            return text
         
-        await update.message.reply_text(response, reply_markup=reply_markup)
-        db.close()
+        except Exception as e:
+            if message is None:
+                # Nothing reached the chat; the caller sends its fallback
+                raise
+            # Part of the reply is already on screen: a failed edit must not add a second message
+            logger.error(f"Error updating streamed reply: {e}")
+            return shown.strip()
+
+    async def _edit_reply(
+        self, message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None
+    ) -> Optional[float]:
+        """Edit a streamed reply; returns the seconds Telegram asks to wait when rate limited"""
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+        except RetryAfter as e:
+            return float(e.retry_after)
+        except BadRequest as e:
+            # Raised when the text did not change since the last edit
+            if "not modified" not in str(e).lower():
+                raise
+        return None
 
     def generate_response(self, message: str) -> str:
         """Generate response based on user message (simple keyword matching for MVP)"""
@@ -456,6 +543,12 @@ Lunes a Domingo: 10:00 AM - 10:00 PM
         
         return conversation
 
+    def start_turn(self, db: Session, chat_id: str, customer_name: str, user_message: str) -> Conversation:
+        """Active conversation for the chat with the customer's message saved"""
+        conversation = self.get_or_create_conversation(db, chat_id, customer_name)
+        self.save_message(db, conversation.id, user_message, True)
+        return conversation
+
     def save_message(self, db: Session, conversation_id: int, content: str, is_from_customer: bool):
         """Save message to database"""
         message = Message(
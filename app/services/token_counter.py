@@ -0,0 +1,70 @@
+"""
+Local token counting for LLM prompts
+Uses tiktoken (pip install tiktoken) with the encoding in llm_tokenizer_encoding, which
+matches the OpenAI chat model; counts for Claude are close enough for budgeting. Without
+tiktoken the count is estimated from the text length.
+"""
+import threading
+from typing import Optional
+from app.core.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Added per chat message for the role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English, fewer for Spanish)"""
+    return len(text) // 3 + 1
+
+
+class TokenCounter:
+    """tiktoken encoding loaded on first use, length estimate when it is not installed"""
+
+    def __init__(self, encoding_name: str):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+                logger.info(f"Counting prompt tokens with tiktoken {self.encoding_name}")
+            except Exception as e:
+                logger.warning(f"tiktoken unavailable ({e}), estimating prompt tokens from length")
+            self._loaded = True
+
+    def count(self, text: Optional[str]) -> int:
+        if not text:
+            return 0
+        if not self._loaded:
+            self._load()
+        if self._encoding is None:
+            return estimate_tokens(text)
+        # Prompt text is data: special-token markers in it are counted as plain text
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def count_message(self, content: Optional[str]) -> int:
+        return self.count(content) + MESSAGE_OVERHEAD_TOKENS
+
+    @property
+    def info(self):
+        return {
+            'encoding': self.encoding_name,
+            'backend': 'tiktoken' if self._encoding is not None else 'estimate' if self._loaded else 'not_loaded'
+        }
+
+
+# Global counter
+token_counter = TokenCounter(settings.llm_tokenizer_encoding)
+
+
+def count_tokens(text: Optional[str]) -> int:
+    return token_counter.count(text)
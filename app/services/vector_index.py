@@ -0,0 +1,286 @@
+"""
+In-process vector index for product and knowledge base search
+Each restaurant's vectors are kept as a contiguous, L2-normalized float32 matrix
+saved as .npy snapshots and memory-mapped, so every worker shares the same pages.
+A snapshot records the menu epoch read before its rows were; one older than the
+restaurant's current epoch is never served.
+"""
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.services.menu_epoch import menu_epochs
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+SNAPSHOT_QUERIES = {
+    'products': """
+        SELECT
+            pe.product_id,
+            pe.content,
+            p.name,
+            p.description,
+            p.price,
+            p.category,
+            pe.embedding
+        FROM product_embeddings pe
+        JOIN products p ON pe.product_id = p.id
+        WHERE pe.restaurant_id = :restaurant_id
+            AND p.available = true
+            AND pe.embedding IS NOT NULL
+        ORDER BY pe.product_id
+    """,
+    'knowledge': """
+        SELECT
+            kb.id,
+            kb.question,
+            kb.answer,
+            kb.category,
+            kb.usage_count,
+            kb.embedding
+        FROM knowledge_base kb
+        WHERE kb.restaurant_id = :restaurant_id
+            AND kb.active = true
+            AND kb.embedding IS NOT NULL
+        ORDER BY kb.id
+    """
+}
+
+
+def _to_vector(value: Any) -> np.ndarray:
+    """Convert a pgvector value (text literal or sequence) to a float32 array"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row so a dot product equals cosine similarity"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class _Snapshot:
+    """A loaded snapshot: memory-mapped matrix plus the row payloads"""
+
+    def __init__(self, version: str, epoch: int, vectors: np.ndarray, items: List[Dict[str, Any]]):
+        self.version = version
+        self.epoch = epoch
+        self.vectors = vectors
+        self.items = items
+        self.loaded_at = time.time()
+
+
+class RestaurantVectorIndex:
+    """Brute-force top-k over per-restaurant snapshots instead of a pgvector round trip"""
+
+    def __init__(self, snapshot_dir: Optional[str] = None, max_age_seconds: int = 3600):
+        self.snapshot_dir = snapshot_dir
+        self.max_age_seconds = max_age_seconds
+        self.enabled = bool(snapshot_dir)
+
+        self._snapshots: Dict[Tuple[str, int], _Snapshot] = {}
+        self._lock = threading.Lock()  # guards the two dicts only, never held across I/O
+        self._build_locks: Dict[Tuple[str, int], threading.Lock] = {}
+        self.stats = {'searches': 0, 'rebuilds': 0, 'invalidations': 0}
+
+        if self.enabled:
+            try:
+                os.makedirs(snapshot_dir, exist_ok=True)
+            except Exception as e:
+                logger.error(f"Error creating vector index directory: {e}")
+                self.enabled = False
+
+    def _base_path(self, kind: str, restaurant_id: int) -> str:
+        return os.path.join(self.snapshot_dir, f"{kind}_{restaurant_id}")
+
+    def _current_version(self, kind: str, restaurant_id: int, epoch: int) -> Optional[Tuple[str, int]]:
+        """(version, epoch) from the pointer file naming the live snapshot
+
+        None if the pointer is missing, expired or older than `epoch`.
+        """
+        pointer = self._base_path(kind, restaurant_id) + ".current"
+        try:
+            if self.max_age_seconds and time.time() - os.path.getmtime(pointer) > self.max_age_seconds:
+                return None
+            with open(pointer) as f:
+                fields = f.read().split()
+        except FileNotFoundError:
+            return None
+        if len(fields) != 2 or int(fields[1]) < epoch:
+            return None
+        return fields[0], int(fields[1])
+
+    def _load(self, kind: str, restaurant_id: int, version: str, epoch: int) -> _Snapshot:
+        base = self._base_path(kind, restaurant_id)
+        vectors = np.load(f"{base}.{version}.npy", mmap_mode='r')
+        with open(f"{base}.{version}.json") as f:
+            items = json.load(f)
+        return _Snapshot(version, epoch, vectors, items)
+
+    def _build(self, kind: str, restaurant_id: int, epoch: int, db: Session) -> str:
+        """Read vectors from the database and publish a new snapshot version for `epoch`
+
+        `epoch` must have been read before the query: a write committed meanwhile
+        advances the epoch past it, so the snapshot is rebuilt on the next search.
+        """
+        rows = db.execute(text(SNAPSHOT_QUERIES[kind]), {'restaurant_id': restaurant_id}).fetchall()
+
+        items = []
+        vectors = []
+        for row in rows:
+            payload = dict(row._mapping)
+            vectors.append(_to_vector(payload.pop('embedding')))
+            items.append(payload)
+
+        matrix = np.vstack(vectors) if vectors else np.zeros((0, 1), dtype=np.float32)
+        matrix = np.ascontiguousarray(_normalize_rows(matrix), dtype=np.float32)
+
+        base = self._base_path(kind, restaurant_id)
+        version = str(time.time_ns())
+
+        # Write data files first, then atomically swap the pointer
+        with open(f"{base}.{version}.npy.tmp", "wb") as f:
+            np.save(f, matrix)
+        os.replace(f"{base}.{version}.npy.tmp", f"{base}.{version}.npy")
+        with open(f"{base}.{version}.json", "w") as f:
+            json.dump(items, f, default=str)
+        with open(f"{base}.current.tmp", "w") as f:
+            f.write(f"{version} {epoch}")
+        os.replace(f"{base}.current.tmp", f"{base}.current")
+
+        # Older versions can go; workers that still map them keep their pages until they reload
+        for path in glob.glob(f"{base}.*.npy") + glob.glob(f"{base}.*.json"):
+            if f".{version}." not in path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        self.stats['rebuilds'] += 1
+        logger.info(f"Built {kind} vector snapshot for restaurant {restaurant_id}: {len(items)} rows")
+        return version
+
+    def _build_lock(self, key: Tuple[str, int]) -> threading.Lock:
+        with self._lock:
+            lock = self._build_locks.get(key)
+            if lock is None:
+                lock = self._build_locks[key] = threading.Lock()
+            return lock
+
+    def _get_snapshot(self, kind: str, restaurant_id: int, db: Session) -> _Snapshot:
+        """Return the live snapshot, building it if it is missing, expired or older than the menu epoch"""
+        key = (kind, restaurant_id)
+        epoch = menu_epochs.current(restaurant_id)
+        current = self._current_version(kind, restaurant_id, epoch)
+
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None and current is not None and snapshot.version == current[0]:
+            return snapshot
+
+        # One thread per restaurant and kind; other restaurants keep searching meanwhile
+        with self._build_lock(key):
+            snapshot = self._snapshots.get(key)
+            current = self._current_version(kind, restaurant_id, epoch)
+            if current is None:
+                # Only one worker rebuilds, the others wait and pick up its result
+                with open(self._base_path(kind, restaurant_id) + ".lock", "a+") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        epoch = menu_epochs.current(restaurant_id)
+                        current = self._current_version(kind, restaurant_id, epoch)
+                        if current is None:
+                            current = (self._build(kind, restaurant_id, epoch, db), epoch)
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            if snapshot is None or snapshot.version != current[0]:
+                snapshot = self._load(kind, restaurant_id, *current)
+                with self._lock:
+                    self._snapshots[key] = snapshot
+            return snapshot
+
+    def search(
+        self,
+        kind: str,
+        restaurant_id: int,
+        query_embedding: np.ndarray,
+        db: Session,
+        limit: int,
+        similarity_threshold: float
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Top-k rows above the similarity threshold, or None if the index cannot answer"""
+        if not self.enabled:
+            return None
+
+        try:
+            snapshot = self._get_snapshot(kind, restaurant_id, db)
+            self.stats['searches'] += 1
+
+            count = len(snapshot.items)
+            if count == 0 or limit <= 0:
+                return []
+
+            query = np.asarray(query_embedding, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if norm > 0:
+                query = query / norm
+
+            similarities = snapshot.vectors @ query
+            k = min(limit, count)
+            top = np.argpartition(-similarities, k - 1)[:k]
+            top = top[np.argsort(-similarities[top])]
+
+            results = []
+            for i in top:
+                similarity = float(similarities[i])
+                if similarity <= similarity_threshold:
+                    break
+                item = dict(snapshot.items[i])
+                item['similarity_score'] = round(similarity, 3)
+                results.append(item)
+            return results
+
+        except Exception as e:
+            logger.error(f"Error in in-process {kind} vector search: {e}")
+            return None
+
+    def invalidate(self, restaurant_id: int, kind: Optional[str] = None):
+        """Drop the live snapshot so the next search rebuilds it from the database
+
+        Call after the write committed. The menu epoch is advanced too, so a rebuild
+        that read its rows before the write cannot publish a snapshot that is served.
+        """
+        if not self.enabled:
+            return
+
+        menu_epochs.bump(restaurant_id)
+
+        kinds = [kind] if kind else list(SNAPSHOT_QUERIES)
+        for k in kinds:
+            try:
+                os.remove(self._base_path(k, restaurant_id) + ".current")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Error invalidating {k} vector snapshot: {e}")
+            with self._lock:
+                self._snapshots.pop((k, restaurant_id), None)
+        self.stats['invalidations'] += 1
+
+
+# Global index instance shared by the vector search services
+restaurant_vector_index = RestaurantVectorIndex(
+    settings.vector_index_dir,
+    settings.vector_index_max_age_seconds
+)
@@ -0,0 +1,58 @@
+"""
+Compact vector search helpers
+First-pass candidate search on halfvec or binary-quantized embeddings, then a
+full-precision rerank. Stored embeddings are unit-normalized, so the negative
+inner product (<#>) replaces cosine distance: cosine distance = 1 + (a <#> b).
+"""
+import numpy as np
+from app.core.config import settings
+
+VECTOR_STORAGE_MODES = ('full', 'halfvec', 'binary')
+
+# Default query vector expression: the bound :query_embedding parameter
+QUERY_PARAM = "CAST(:query_embedding AS vector)"
+
+
+def unit_normalize(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize a vector or each row of a matrix"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def storage_mode() -> str:
+    mode = settings.vector_storage
+    return mode if mode in VECTOR_STORAGE_MODES else 'full'
+
+
+def first_pass_order(column: str, dimension: int = 384, query: str = QUERY_PARAM) -> str:
+    """ORDER BY expression for the candidate scan; matches the expression indexes in the migrations"""
+    mode = storage_mode()
+    if mode == 'halfvec':
+        return f"({column})::halfvec({dimension}) <#> ({query})::halfvec({dimension})"
+    if mode == 'binary':
+        return f"binary_quantize({column})::bit({dimension}) <~> binary_quantize({query})"
+    return f"{column} <#> {query}"
+
+
+def index_method(column: str = "embedding", dimension: int = 384) -> str:
+    """HNSW index definition whose expression first_pass_order can use"""
+    mode = storage_mode()
+    if mode == 'halfvec':
+        return f"hnsw ((({column})::halfvec({dimension})) halfvec_ip_ops)"
+    if mode == 'binary':
+        return f"hnsw ((binary_quantize({column})::bit({dimension})) bit_hamming_ops)"
+    return f"hnsw ({column} vector_ip_ops)"
+
+
+def rerank_distance(column: str, query: str = QUERY_PARAM) -> str:
+    """Full-precision cosine distance for unit vectors"""
+    return f"1 + ({column} <#> {query})"
+
+
+def candidate_count(limit: int) -> int:
+    """How many compact-scan candidates to rerank for a final top-k"""
+    if storage_mode() == 'full':
+        return limit
+    return limit * max(1, settings.vector_rerank_factor)
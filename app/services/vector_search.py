@@ -1,14 +1,33 @@
 import time
 import numpy as np
+from datetime import datetime
 from typing import List, Dict, Any, Optional, Tuple
-from sentence_transformers import SentenceTransformer
+from app.services.embedding_backends import backend_identity
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.embedding_cache import EmbeddingCache
+from app.services.embedding_models import (
+    DEFAULT_EMBEDDING_MODEL, EmbeddingModelUnavailable, LoadedEmbeddingModel, embedding_model_registry
+)
+from app.services.vector_index import restaurant_vector_index
+from app.services.ann_indexes import apply_search_tuning
+from app.services.embedding_content import upsert_product_embeddings
+from app.services.search_log_writer import search_log_writer
+from app.services.search_analytics import get_search_analytics
+from app.services.search_result_cache import search_result_cache
+from app.services.access_stats import access_stats
+from app.services.latency_stats import latency_recorder
+from app.services.memory_ranking import rerank_memories
+from app.services.model_embeddings import (
+    active_embedding_model, search_model_embeddings, source_items, stored_models, write_model_embeddings
+)
+from app.services.vector_quantization import first_pass_order, rerank_distance, candidate_count
 from sqlalchemy.orm import Session
 from sqlalchemy import text, func, desc
 from app.models.embeddings import ProductEmbedding, ConversationMemory, KnowledgeBase, SearchLog
 from app.models.product import Product
 from app.models.conversation import Conversation
 from app.models.restaurant import Restaurant
-from app.core.database import get_db
+from app.core.database import get_db, vector_array_param, vector_param
 import logging
 import openai
 from app.core.config import settings
@@ -20,110 +39,91 @@ class VectorSearchService:
     """Service for semantic search using pgvector and embeddings"""
     
     def __init__(self):
-        # Initialize embedding model
-        self.embedding_model = None
+        # The model itself lives in the shared registry and loads on first use
         self.embedding_dimension = 384
-        self.model_name = "sentence-transformers/all-MiniLM-L6-v2"
+        self.model_name = DEFAULT_EMBEDDING_MODEL
         
         # Force use of sentence-transformers (no OpenAI embeddings)
         self.use_openai_embeddings = False
         
-        self._load_embedding_model()
+        self.embedding_cache = EmbeddingCache(
+            backend_identity(self.model_name),
+            self.embedding_dimension,
+            cache_dir=settings.embedding_cache_dir,
+            memory_entries=settings.embedding_cache_memory_entries,
+            disk_entries=settings.embedding_cache_disk_entries
+        )
     
-    def _load_embedding_model(self):
-        """Load the sentence transformer model"""
-        try:
-            if not self.use_openai_embeddings:
-                self.embedding_model = SentenceTransformer(self.model_name)
-                logger.info(f"Loaded embedding model: {self.model_name}")
-            else:
-                logger.info("Using OpenAI embeddings")
-        except Exception as e:
-            logger.error(f"Error loading embedding model: {e}")
-            self.embedding_model = None
+    @property
+    def embedding_model(self) -> Optional[LoadedEmbeddingModel]:
+        """Shared embedding model, loaded on first use; None if it could not be loaded"""
+        return embedding_model_registry.get(self.model_name)
+    
+    @property
+    def embedding_batcher(self) -> Optional[EmbeddingBatcher]:
+        """Batcher of the shared model if it is already loaded (never triggers a load)"""
+        model = embedding_model_registry.peek(self.model_name)
+        return model.batcher if model else None
     
     def get_embedding(self, text: str) -> np.ndarray:
-        """Generate embedding for text using sentence-transformers"""
+        """Generate embedding for text using sentence-transformers
+        
+        Raises EmbeddingModelUnavailable (or the encode error) instead of returning a
+        stand-in vector: results ranked by noise would be cached and stored as real.
+        Every search catches it and answers with no results.
+        """
         start_time = time.time()
         
+        cached = self.embedding_cache.get(text)
+        if cached is not None:
+            return cached
+        
+        model = self.embedding_model
+        if model is None:
+            raise EmbeddingModelUnavailable(self.model_name)
+        
         try:
-            if self.embedding_model is None:
-                # Fallback to random vector if model failed to load
-                logger.warning("Embedding model not loaded, using random vector")
-                embedding = np.random.rand(self.embedding_dimension)
-            else:
-                embedding = self.embedding_model.encode(text)
-            
-            embedding_time = int((time.time() - start_time) * 1000)
-            logger.debug(f"Generated embedding in {embedding_time}ms")
-            
-            return embedding
-            
+            embedding = model.batcher.encode(text)
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
-            # Return random vector as fallback
-            return np.random.rand(self.embedding_dimension)
+            raise
+        self.embedding_cache.put(text, embedding)
+        
+        embedding_time = int((time.time() - start_time) * 1000)
+        logger.debug(f"Generated embedding in {embedding_time}ms")
+        
+        return embedding
     
-    def create_product_embeddings(self, restaurant_id: int, db: Session) -> Dict[str, int]:
-        """Create embeddings for all products in a restaurant"""
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Generate embeddings for many texts, encoding all cache misses in one model call"""
         
-        products = db.query(Product).filter(
-            Product.restaurant_id == restaurant_id,
-            Product.available == True
-        ).all()
+        embeddings = [self.embedding_cache.get(text) for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
         
-        stats = {'created': 0, 'updated': 0, 'errors': 0}
+        if missing:
+            model = self.embedding_model
+            if model is None:
+                # Random vectors would be stored as if they were real and never re-embedded
+                raise EmbeddingModelUnavailable(self.model_name)
+            
+            encoded = model.encode_batch([texts[i] for i in missing])
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+                self.embedding_cache.put(texts[i], embedding)
         
-        for product in products:
-            try:
-                # Check if embedding already exists
-                existing_embedding = db.query(ProductEmbedding).filter(
-                    ProductEmbedding.product_id == product.id
-                ).first()
-                
-                # Create searchable content
-                content_parts = [product.name]
-                if product.description:
-                    content_parts.append(product.description)
-                content_parts.append(product.category)
-                
-                # Add price range context
-                if product.price < 10000:
-                    content_parts.append("económico barato")
-                elif product.price > 25000:
-                    content_parts.append("premium caro")
-                else:
-                    content_parts.append("precio medio")
-                
-                content = " ".join(content_parts)
-                
-                # Generate embedding
-                embedding = self.get_embedding(content)
-                
-                if existing_embedding:
-                    # Update existing
-                    existing_embedding.content = content
-                    existing_embedding.embedding = embedding.tolist()
-                    existing_embedding.embedding_model = "sentence-transformers/all-MiniLM-L6-v2"
-                    stats['updated'] += 1
-                else:
-                    # Create new
-                    new_embedding = ProductEmbedding(
-                        product_id=product.id,
-                        restaurant_id=restaurant_id,
-                        content=content,
-                        embedding=embedding.tolist(),
-                        embedding_model="sentence-transformers/all-MiniLM-L6-v2"
-                    )
-                    db.add(new_embedding)
-                    stats['created'] += 1
-                
-            except Exception as e:
-                logger.error(f"Error creating embedding for product {product.id}: {e}")
-                stats['errors'] += 1
+        return np.vstack(embeddings) if embeddings else np.zeros((0, self.embedding_dimension))
+    
+    def create_product_embeddings(self, restaurant_id: int, db: Session) -> Dict[str, int]:
+        """Create embeddings for products whose content changed since the last run"""
+        
+        stats = upsert_product_embeddings(restaurant_id, db, self.get_embeddings, self.model_name)
         
-        db.commit()
-        logger.info(f"Product embeddings: {stats}")
+        if stats['created'] or stats['updated']:
+            restaurant_vector_index.invalidate(restaurant_id, 'products')
+        
+        # Restaurants on (or migrating to) another model keep its vectors current too
+        if stored_models(restaurant_id, db):
+            write_model_embeddings(restaurant_id, 'product', source_items('product', restaurant_id, db), db)
         return stats
     
     def search_products_semantic(
@@ -132,68 +132,58 @@ class VectorSearchService:
         restaurant_id: int, 
         db: Session,
         limit: int = 5,
-        similarity_threshold: float = 0.3
+        similarity_threshold: float = 0.3,
+        query_embedding: Optional[np.ndarray] = None,
+        ef_search: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """Search products using semantic similarity"""
         
         start_time = time.time()
         
         try:
-            # Generate embedding for query
-            embedding_start = time.time()
-            query_embedding = self.get_embedding(query)
-            embedding_time = int((time.time() - embedding_start) * 1000)
-            
-            # Perform vector similarity search
-            search_start = time.time()
+            timings = {'embedding': 0}
+            
+            def search():
+                nonlocal query_embedding
+                # Restaurants on another embedding model search model_embeddings instead
+                model_name = active_embedding_model(restaurant_id, db)
+                if model_name != self.model_name:
+                    return search_model_embeddings(
+                        'products', model_name, query, restaurant_id, db, limit, similarity_threshold,
+                        ef_search=ef_search
+                    )
+                
+                # Generate embedding for query unless the caller already has it
+                embedding_start = time.time()
+                if query_embedding is None:
+                    query_embedding = self.get_embedding(query)
+                timings['embedding'] = int((time.time() - embedding_start) * 1000)
+                
+                # Answer from the in-process snapshot, fall back to pgvector
+                products = restaurant_vector_index.search(
+                    'products', restaurant_id, query_embedding, db, limit, similarity_threshold
+                )
+                if products is None:
+                    products = self._search_products_sql(
+                        query_embedding, restaurant_id, db, limit, similarity_threshold, ef_search
+                    )
+                return products
             
-            # Using cosine similarity with pgvector (Supabase compatible)
-            results = db.execute(text("""
-                SELECT 
-                    pe.product_id,
-                    pe.content,
-                    p.name,
-                    p.description,
-                    p.price,
-                    p.category,
-                    p.available,
-                    (pe.embedding <=> CAST(:query_embedding AS vector)) as distance
-                FROM product_embeddings pe
-                JOIN products p ON pe.product_id = p.id
-                WHERE pe.restaurant_id = :restaurant_id 
-                    AND p.available = true
-                    AND (pe.embedding <=> CAST(:query_embedding AS vector)) < :threshold
-                ORDER BY pe.embedding <=> CAST(:query_embedding AS vector)
-                LIMIT :limit
-            """), {
-                'query_embedding': query_embedding.tolist(),
-                'restaurant_id': restaurant_id,
-                'threshold': 1 - similarity_threshold,  # Convert similarity to distance
-                'limit': limit
-            }).fetchall()
+            # Repeated questions against an unchanged menu skip embedding and search entirely
+            products = search_result_cache.get_or_compute(
+                search_result_cache.key('products', restaurant_id, query, limit, similarity_threshold),
+                search
+            )
+            embedding_time = timings['embedding']
             
-            search_time = int((time.time() - search_start) * 1000)
             total_time = int((time.time() - start_time) * 1000)
             
-            # Format results
-            products = []
-            for row in results:
-                similarity_score = 1 - row.distance  # Convert distance back to similarity
-                products.append({
-                    'product_id': row.product_id,
-                    'name': row.name,
-                    'description': row.description,
-                    'price': row.price,
-                    'category': row.category,
-                    'similarity_score': round(similarity_score, 3),
-                    'content': row.content
-                })
-            
             # Log search
             self._log_search(
                 query, 'products', restaurant_id, db,
                 len(products), max([p['similarity_score'] for p in products] + [0]),
-                total_time, embedding_time
+                total_time, embedding_time,
+                query_embedding=query_embedding
             )
             
             logger.info(f"Semantic search '{query}' found {len(products)} products in {total_time}ms")
@@ -203,50 +193,248 @@ class VectorSearchService:
             logger.error(f"Error in semantic product search: {e}")
             return []
     
+    def _search_products_sql(
+        self,
+        query_embedding: np.ndarray,
+        restaurant_id: int,
+        db: Session,
+        limit: int,
+        similarity_threshold: float,
+        ef_search: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Product search with a pgvector query"""
+        
+        apply_search_tuning(db, ef_search)
+        
+        # Nearest candidates on the compact form (index-friendly ORDER BY ... LIMIT),
+        # reranked at full precision, threshold applied last
+        with latency_recorder.measure('vector_sql', restaurant_id):
+            results = db.execute(text(f"""
+                SELECT * FROM (
+                    SELECT 
+                        c.product_id,
+                        c.content,
+                        c.name,
+                        c.description,
+                        c.price,
+                        c.category,
+                        c.available,
+                        {rerank_distance('c.embedding')} AS distance
+                    FROM (
+                        SELECT pe.product_id, pe.content, pe.embedding,
+                            p.name, p.description, p.price, p.category, p.available
+                        FROM product_embeddings pe
+                        JOIN products p ON pe.product_id = p.id
+                        WHERE pe.restaurant_id = :restaurant_id 
+                            AND p.available = true
+                        ORDER BY {first_pass_order('pe.embedding')}
+                        LIMIT :candidates
+                    ) c
+                    ORDER BY distance
+                    LIMIT :limit
+                ) ranked
+                WHERE distance < :threshold
+                ORDER BY distance
+            """), {
+                'query_embedding': vector_param(query_embedding),
+                'restaurant_id': restaurant_id,
+                'threshold': 1 - similarity_threshold,  # Convert similarity to distance
+                'candidates': candidate_count(limit),
+                'limit': limit
+            }).fetchall()
+        
+        # Format results
+        products = []
+        for row in results:
+            similarity_score = 1 - row.distance  # Convert distance back to similarity
+            products.append({
+                'product_id': row.product_id,
+                'name': row.name,
+                'description': row.description,
+                'price': row.price,
+                'category': row.category,
+                'similarity_score': round(similarity_score, 3),
+                'content': row.content
+            })
+        
+        return products
+    
+    def search_products_batch(
+        self,
+        queries: List[Tuple[str, int]],
+        db: Session,
+        limit: int = 5,
+        similarity_threshold: float = 0.3,
+        ef_search: Optional[int] = None,
+        log_searches: bool = False,
+        chunk_size: int = 256
+    ) -> List[List[Dict[str, Any]]]:
+        """Search many (query, restaurant_id) pairs: one encode call and one statement per chunk
+        
+        Results come back in the order of the queries.
+        """
+        
+        if not queries:
+            return []
+        
+        start_time = time.time()
+        
+        # Restaurants on another embedding model are answered one by one from model_embeddings
+        model_names = {
+            restaurant_id: active_embedding_model(restaurant_id, db)
+            for restaurant_id in {restaurant_id for _, restaurant_id in queries}
+        }
+        native = [i for i, (_, restaurant_id) in enumerate(queries) if model_names[restaurant_id] == self.model_name]
+        native_queries = [queries[i] for i in native]
+        
+        embeddings = self.get_embeddings([query for query, _ in native_queries])
+        embedding_time = int((time.time() - start_time) * 1000)
+        
+        results: List[List[Dict[str, Any]]] = [
+            [] if model_names[restaurant_id] == self.model_name else search_model_embeddings(
+                'products', model_names[restaurant_id], query, restaurant_id, db, limit, similarity_threshold,
+                ef_search=ef_search
+            )
+            for query, restaurant_id in queries
+        ]
+        for offset in range(0, len(native_queries), chunk_size):
+            chunk = native_queries[offset:offset + chunk_size]
+            chunk_results = self._search_products_batch_sql(
+                [restaurant_id for _, restaurant_id in chunk],
+                embeddings[offset:offset + chunk_size],
+                db, limit, similarity_threshold, ef_search
+            )
+            for i, products in zip(native[offset:offset + chunk_size], chunk_results):
+                results[i] = products
+        
+        total_time = int((time.time() - start_time) * 1000)
+        
+        if log_searches:
+            per_query_time = total_time // len(queries)
+            native_embeddings = dict(zip(native, embeddings))
+            for i, ((query, restaurant_id), products) in enumerate(zip(queries, results)):
+                embedding = native_embeddings.get(i)
+                self._log_search(
+                    query, 'products', restaurant_id, db,
+                    len(products), max([p['similarity_score'] for p in products] + [0]),
+                    per_query_time, embedding_time // len(queries),
+                    query_embedding=embedding
+                )
+        
+        logger.info(f"Batch semantic search answered {len(queries)} queries in {total_time}ms")
+        return results
+    
+    def _search_products_batch_sql(
+        self,
+        restaurant_ids: List[int],
+        embeddings: np.ndarray,
+        db: Session,
+        limit: int,
+        similarity_threshold: float,
+        ef_search: Optional[int] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """One statement for many queries: each query row drives a LATERAL nearest-neighbour scan"""
+        
+        apply_search_tuning(db, ef_search)
+        
+        # Same compact first pass and full-precision rerank as _search_products_sql,
+        # with the query vector coming from the unnested row instead of a parameter
+        results = db.execute(text(f"""
+            WITH q AS (
+                SELECT (t.ordinality - 1)::int AS idx, t.restaurant_id, t.embedding
+                FROM unnest(CAST(:restaurant_ids AS integer[]), CAST(:embeddings AS vector[]))
+                    WITH ORDINALITY AS t(restaurant_id, embedding, ordinality)
+            )
+            SELECT q.idx, hit.*
+            FROM q
+            CROSS JOIN LATERAL (
+                SELECT * FROM (
+                    SELECT 
+                        c.product_id,
+                        c.content,
+                        c.name,
+                        c.description,
+                        c.price,
+                        c.category,
+                        {rerank_distance('c.embedding', 'q.embedding')} AS distance
+                    FROM (
+                        SELECT pe.product_id, pe.content, pe.embedding,
+                            p.name, p.description, p.price, p.category
+                        FROM product_embeddings pe
+                        JOIN products p ON pe.product_id = p.id
+                        WHERE pe.restaurant_id = q.restaurant_id 
+                            AND p.available = true
+                        ORDER BY {first_pass_order('pe.embedding', query='q.embedding')}
+                        LIMIT :candidates
+                    ) c
+                    ORDER BY distance
+                    LIMIT :limit
+                ) ranked
+                WHERE distance < :threshold
+            ) hit
+            ORDER BY q.idx, hit.distance
+        """), {
+            'restaurant_ids': [int(restaurant_id) for restaurant_id in restaurant_ids],
+            'embeddings': vector_array_param(embeddings),
+            'threshold': 1 - similarity_threshold,
+            'candidates': candidate_count(limit),
+            'limit': limit
+        }).fetchall()
+        
+        grouped: List[List[Dict[str, Any]]] = [[] for _ in restaurant_ids]
+        for row in results:
+            grouped[row.idx].append({
+                'product_id': row.product_id,
+                'name': row.name,
+                'description': row.description,
+                'price': row.price,
+                'category': row.category,
+                'similarity_score': round(1 - row.distance, 3),
+                'content': row.content
+            })
+        
+        return grouped
+    
     def search_knowledge_base(
         self,
         query: str,
         restaurant_id: int,
         db: Session,
         limit: int = 3,
-        similarity_threshold: float = 0.4
+        similarity_threshold: float = 0.4,
+        query_embedding: Optional[np.ndarray] = None,
+        ef_search: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """Search knowledge base using semantic similarity"""
         
         try:
-            query_embedding = self.get_embedding(query)
-            
-            results = db.execute(text("""
-                SELECT 
-                    kb.id,
-                    kb.question,
-                    kb.answer,
-                    kb.category,
-                    kb.usage_count,
-                    (kb.embedding <=> CAST(:query_embedding AS vector)) as distance
-                FROM knowledge_base kb
-                WHERE kb.restaurant_id = :restaurant_id 
-                    AND kb.active = true
-                    AND (kb.embedding <=> CAST(:query_embedding AS vector)) < :threshold
-                ORDER BY kb.embedding <=> CAST(:query_embedding AS vector)
-                LIMIT :limit
-            """), {
-                'query_embedding': query_embedding.tolist(),
-                'restaurant_id': restaurant_id,
-                'threshold': 1 - similarity_threshold,
-                'limit': limit
-            }).fetchall()
+            def search():
+                nonlocal query_embedding
+                model_name = active_embedding_model(restaurant_id, db)
+                if model_name != self.model_name:
+                    return search_model_embeddings(
+                        'knowledge', model_name, query, restaurant_id, db, limit, similarity_threshold,
+                        ef_search=ef_search
+                    )
+                
+                if query_embedding is None:
+                    query_embedding = self.get_embedding(query)
+                
+                # Answer from the in-process snapshot, fall back to pgvector
+                knowledge_items = restaurant_vector_index.search(
+                    'knowledge', restaurant_id, query_embedding, db, limit, similarity_threshold
+                )
+                if knowledge_items is None:
+                    knowledge_items = self._search_knowledge_sql(
+                        query_embedding, restaurant_id, db, limit, similarity_threshold, ef_search
+                    )
+                return knowledge_items
             
-            knowledge_items = []
-            for row in results:
-                knowledge_items.append({
-                    'id': row.id,
-                    'question': row.question,
-                    'answer': row.answer,
-                    'category': row.category,
-                    'similarity_score': round(1 - row.distance, 3),
-                    'usage_count': row.usage_count
-                })
+            knowledge_items = search_result_cache.get_or_compute(
+                search_result_cache.key('knowledge', restaurant_id, query, limit, similarity_threshold),
+                search
+            )
+            access_stats.record_knowledge(item['id'] for item in knowledge_items)
             
             return knowledge_items
             
@@ -254,71 +442,370 @@ class VectorSearchService:
             logger.error(f"Error in knowledge base search: {e}")
             return []
     
+    def _search_knowledge_sql(
+        self,
+        query_embedding: np.ndarray,
+        restaurant_id: int,
+        db: Session,
+        limit: int,
+        similarity_threshold: float,
+        ef_search: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Knowledge base search with a pgvector query"""
+        
+        apply_search_tuning(db, ef_search)
+        
+        with latency_recorder.measure('vector_sql', restaurant_id):
+            results = db.execute(text(f"""
+                SELECT * FROM (
+                    SELECT 
+                        c.id,
+                        c.question,
+                        c.answer,
+                        c.category,
+                        c.usage_count,
+                        {rerank_distance('c.embedding')} AS distance
+                    FROM (
+                        SELECT kb.id, kb.question, kb.answer, kb.category, kb.usage_count, kb.embedding
+                        FROM knowledge_base kb
+                        WHERE kb.restaurant_id = :restaurant_id 
+                            AND kb.active = true
+                        ORDER BY {first_pass_order('kb.embedding')}
+                        LIMIT :candidates
+                    ) c
+                    ORDER BY distance
+                    LIMIT :limit
+                ) ranked
+                WHERE distance < :threshold
+                ORDER BY distance
+            """), {
+                'query_embedding': vector_param(query_embedding),
+                'restaurant_id': restaurant_id,
+                'threshold': 1 - similarity_threshold,
+                'candidates': candidate_count(limit),
+                'limit': limit
+            }).fetchall()
+        
+        knowledge_items = []
+        for row in results:
+            knowledge_items.append({
+                'id': row.id,
+                'question': row.question,
+                'answer': row.answer,
+                'category': row.category,
+                'similarity_score': round(1 - row.distance, 3),
+                'usage_count': row.usage_count
+            })
+        
+        return knowledge_items
+    
     def search_conversation_memory(
         self,
         query: str,
         customer_phone: str,
         restaurant_id: int,
         db: Session,
-        limit: int = 3
+        limit: int = 3,
+        query_embedding: Optional[np.ndarray] = None,
+        ef_search: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """Search conversation memories for a specific customer"""
         
         try:
-            query_embedding = self.get_embedding(query)
-            
-            results = db.execute(text("""
-                SELECT 
-                    cm.id,
-                    cm.memory_type,
-                    cm.content,
-                    cm.summary,
-                    cm.importance_score,
-                    cm.access_count,
-                    cm.created_at,
-                    (cm.embedding <=> CAST(:query_embedding AS vector)) as distance
-                FROM conversation_memories cm
-                WHERE cm.customer_phone = :customer_phone
-                    AND cm.restaurant_id = :restaurant_id
-                ORDER BY 
-                    cm.importance_score DESC,
-                    cm.embedding <=> CAST(:query_embedding AS vector),
-                    cm.created_at DESC
-                LIMIT :limit
-            """), {
-                'query_embedding': query_embedding.tolist(),
-                'customer_phone': customer_phone,
-                'restaurant_id': restaurant_id,
-                'limit': limit
-            }).fetchall()
-            
-            memories = []
-            for row in results:
-                memories.append({
-                    'id': row.id,
-                    'memory_type': row.memory_type,
-                    'content': row.content,
-                    'summary': row.summary,
-                    'importance_score': row.importance_score,
-                    'similarity_score': round(1 - row.distance, 3),
-                    'created_at': row.created_at
-                })
-            
-            # Update access count
-            for memory in memories:
-                db.execute(text("""
-                    UPDATE conversation_memories 
-                    SET access_count = access_count + 1, last_accessed = NOW()
-                    WHERE id = :memory_id
-                """), {'memory_id': memory['id']})
-            
-            db.commit()
+            model_name = active_embedding_model(restaurant_id, db)
+            if model_name != self.model_name:
+                memories = search_model_embeddings(
+                    'memories', model_name, query, restaurant_id, db, limit,
+                    customer_phone=customer_phone, ef_search=ef_search
+                )
+                access_stats.record_memories(memory['id'] for memory in memories)
+                return memories
+            
+            if query_embedding is None:
+                query_embedding = self.get_embedding(query)
+            
+            apply_search_tuning(db, ef_search)
+            
+            # Stage one: nearest candidates by vector distance (index-friendly ORDER BY ... LIMIT)
+            with latency_recorder.measure('vector_sql', restaurant_id):
+                results = db.execute(text(f"""
+                    SELECT 
+                        cm.id,
+                        cm.memory_type,
+                        cm.content,
+                        cm.summary,
+                        cm.importance_score,
+                        cm.access_count,
+                        cm.created_at,
+                        {rerank_distance('cm.embedding')} AS distance
+                    FROM conversation_memories cm
+                    WHERE cm.customer_phone = :customer_phone
+                        AND cm.restaurant_id = :restaurant_id
+                    ORDER BY {first_pass_order('cm.embedding')}
+                    LIMIT :candidates
+                """), {
+                    'query_embedding': vector_param(query_embedding),
+                    'customer_phone': customer_phone,
+                    'restaurant_id': restaurant_id,
+                    'candidates': limit * max(1, settings.memory_candidate_factor)
+                }).fetchall()
+            
+            candidates = [self._memory_from_row(row) for row in results]
+            
+            # Stage two: similarity, importance, recency and access frequency
+            memories = rerank_memories(candidates, limit)
+            
+            # Access counts are written later in bulk, not inside the chat turn
+            access_stats.record_memories(memory['id'] for memory in memories)
             return memories
             
         except Exception as e:
             logger.error(f"Error in memory search: {e}")
             return []
-    
+
+    @staticmethod
+    def _memory_from_row(row) -> Dict[str, Any]:
+        return {
+            'id': row.id,
+            'memory_type': row.memory_type,
+            'content': row.content,
+            'summary': row.summary,
+            'importance_score': row.importance_score,
+            'access_count': row.access_count,
+            'similarity_score': round(1 - row.distance, 3),
+            'created_at': row.created_at
+        }
+
+    def search_all(
+        self,
+        query: str,
+        restaurant_id: int,
+        db: Session,
+        customer_phone: Optional[str] = None,
+        product_limit: int = 3,
+        knowledge_limit: int = 2,
+        memory_limit: int = 2,
+        product_threshold: float = 0.3,
+        knowledge_threshold: float = 0.4,
+        query_embedding: Optional[np.ndarray] = None,
+        ef_search: Optional[int] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Search products, knowledge base and customer memories with one embedding and one round trip"""
+
+        start_time = time.time()
+
+        try:
+            model_name = active_embedding_model(restaurant_id, db)
+            if model_name != self.model_name:
+                # The single-statement path reads the native columns; go through the per-kind searches
+                return {
+                    'products': self.search_products_semantic(
+                        query, restaurant_id, db, product_limit, product_threshold, ef_search=ef_search
+                    ),
+                    'knowledge': self.search_knowledge_base(
+                        query, restaurant_id, db, knowledge_limit, knowledge_threshold, ef_search=ef_search
+                    ),
+                    'memories': self.search_conversation_memory(
+                        query, customer_phone, restaurant_id, db, memory_limit, ef_search=ef_search
+                    ) if customer_phone else []
+                }
+            
+            product_key = search_result_cache.key('products', restaurant_id, query, product_limit, product_threshold)
+            knowledge_key = search_result_cache.key('knowledge', restaurant_id, query, knowledge_limit, knowledge_threshold)
+            cached_products = search_result_cache.get(product_key)
+            cached_knowledge = search_result_cache.get(knowledge_key) if cached_products is not None else None
+
+            # Memories are per customer and never cached, only they may still need an embedding
+            embedding_start = time.time()
+            if query_embedding is None and (cached_knowledge is None or customer_phone):
+                query_embedding = self.get_embedding(query)
+            embedding_time = int((time.time() - embedding_start) * 1000)
+
+            hits = None
+            if cached_knowledge is not None:
+                memories = self.search_conversation_memory(
+                    query, customer_phone, restaurant_id, db, memory_limit,
+                    query_embedding=query_embedding,
+                    ef_search=ef_search
+                ) if customer_phone else []
+                hits = {'products': cached_products, 'knowledge': cached_knowledge, 'memories': memories}
+
+            # Products and knowledge from the in-process snapshot when available,
+            # then only the per-customer memories still need the database
+            products = restaurant_vector_index.search(
+                'products', restaurant_id, query_embedding, db, product_limit, product_threshold
+            ) if hits is None else None
+            if products is not None:
+                knowledge = restaurant_vector_index.search(
+                    'knowledge', restaurant_id, query_embedding, db, knowledge_limit, knowledge_threshold
+                )
+                if knowledge is not None:
+                    memories = self.search_conversation_memory(
+                        query, customer_phone, restaurant_id, db, memory_limit,
+                        query_embedding=query_embedding,
+                        ef_search=ef_search
+                    ) if customer_phone else []
+                    hits = {'products': products, 'knowledge': knowledge, 'memories': memories}
+            
+            if hits is None:
+                hits = self._search_all_sql(
+                    query_embedding, restaurant_id, db, customer_phone,
+                    product_limit, knowledge_limit, memory_limit,
+                    product_threshold, knowledge_threshold, ef_search
+                )
+                # The other paths go through search_conversation_memory, which records its own
+                access_stats.record_memories(memory['id'] for memory in hits['memories'])
+
+            if cached_knowledge is None:
+                search_result_cache.put(product_key, hits['products'])
+                search_result_cache.put(knowledge_key, hits['knowledge'])
+            
+            access_stats.record_knowledge(item['id'] for item in hits['knowledge'])
+
+            total_time = int((time.time() - start_time) * 1000)
+
+            self._log_search(
+                query, 'products', restaurant_id, db,
+                len(hits['products']), max([p['similarity_score'] for p in hits['products']] + [0]),
+                total_time, embedding_time,
+                query_embedding=query_embedding
+            )
+
+            logger.info(
+                f"Combined search '{query}' found {len(hits['products'])} products, "
+                f"{len(hits['knowledge'])} knowledge items, {len(hits['memories'])} memories in {total_time}ms"
+            )
+            return hits
+
+        except Exception as e:
+            logger.error(f"Error in combined semantic search: {e}")
+            db.rollback()
+            return {'products': [], 'knowledge': [], 'memories': []}
+
+    def _search_all_sql(
+        self,
+        query_embedding: np.ndarray,
+        restaurant_id: int,
+        db: Session,
+        customer_phone: Optional[str],
+        product_limit: int,
+        knowledge_limit: int,
+        memory_limit: int,
+        product_threshold: float,
+        knowledge_threshold: float,
+        ef_search: Optional[int] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Products, knowledge and memories in a single pgvector statement"""
+
+        apply_search_tuning(db, ef_search)
+
+        # Each CTE is an ORDER BY ... LIMIT scan on the compact form against the bound
+        # query vector (a parameter, so ANN indexes apply), reranked at full precision;
+        # thresholds are applied to the k nearest rows, which gives the same rows as
+        # filtering first
+        with latency_recorder.measure('vector_sql', restaurant_id):
+            results = db.execute(text(f"""
+                WITH product_candidates AS (
+                    SELECT pe.product_id, pe.content, pe.embedding,
+                        p.name, p.description, p.price, p.category
+                    FROM product_embeddings pe
+                    JOIN products p ON pe.product_id = p.id
+                    WHERE pe.restaurant_id = :restaurant_id
+                        AND p.available = true
+                    ORDER BY {first_pass_order('pe.embedding')}
+                    LIMIT :product_candidates
+                ),
+                product_hits AS (
+                    SELECT
+                        'products' AS source,
+                        {rerank_distance('c.embedding')} AS distance,
+                        json_build_object(
+                            'product_id', c.product_id,
+                            'name', c.name,
+                            'description', c.description,
+                            'price', c.price,
+                            'category', c.category,
+                            'content', c.content
+                        ) AS payload
+                    FROM product_candidates c
+                    ORDER BY distance
+                    LIMIT :product_limit
+                ),
+                knowledge_candidates AS (
+                    SELECT kb.id, kb.question, kb.answer, kb.category, kb.usage_count, kb.embedding
+                    FROM knowledge_base kb
+                    WHERE kb.restaurant_id = :restaurant_id
+                        AND kb.active = true
+                    ORDER BY {first_pass_order('kb.embedding')}
+                    LIMIT :knowledge_candidates
+                ),
+                knowledge_hits AS (
+                    SELECT
+                        'knowledge' AS source,
+                        {rerank_distance('c.embedding')} AS distance,
+                        json_build_object(
+                            'id', c.id,
+                            'question', c.question,
+                            'answer', c.answer,
+                            'category', c.category,
+                            'usage_count', c.usage_count
+                        ) AS payload
+                    FROM knowledge_candidates c
+                    ORDER BY distance
+                    LIMIT :knowledge_limit
+                ),
+                memory_hits AS (
+                    SELECT
+                        'memories' AS source,
+                        {rerank_distance('cm.embedding')} AS distance,
+                        json_build_object(
+                            'id', cm.id,
+                            'memory_type', cm.memory_type,
+                            'content', cm.content,
+                            'summary', cm.summary,
+                            'importance_score', cm.importance_score,
+                            'access_count', cm.access_count,
+                            'created_at', cm.created_at
+                        ) AS payload
+                    FROM conversation_memories cm
+                    WHERE cm.customer_phone = :customer_phone
+                        AND cm.restaurant_id = :restaurant_id
+                    ORDER BY {first_pass_order('cm.embedding')}
+                    LIMIT :memory_candidates
+                )
+                SELECT source, distance, payload FROM product_hits WHERE distance < :product_threshold
+                UNION ALL
+                SELECT source, distance, payload FROM knowledge_hits WHERE distance < :knowledge_threshold
+                UNION ALL
+                SELECT source, distance, payload FROM memory_hits
+                ORDER BY source, distance
+            """), {
+                'query_embedding': vector_param(query_embedding),
+                'restaurant_id': restaurant_id,
+                'customer_phone': customer_phone,
+                'product_candidates': candidate_count(product_limit),
+                'knowledge_candidates': candidate_count(knowledge_limit),
+                'product_limit': product_limit,
+                'knowledge_limit': knowledge_limit,
+                'memory_candidates': memory_limit * max(1, settings.memory_candidate_factor),
+                'product_threshold': 1 - product_threshold,
+                'knowledge_threshold': 1 - knowledge_threshold
+            }).fetchall()
+
+        hits = {'products': [], 'knowledge': [], 'memories': []}
+        for row in results:
+            item = dict(row.payload)
+            item['similarity_score'] = round(1 - row.distance, 3)
+            hits[row.source].append(item)
+
+        # Memory candidates get the same rerank as search_conversation_memory
+        for memory in hits['memories']:
+            if memory['created_at']:
+                memory['created_at'] = datetime.fromisoformat(memory['created_at'])
+        hits['memories'] = rerank_memories(hits['memories'], memory_limit)
+
+        return hits
+
     def store_conversation_memory(
         self,
         conversation_id: int,
@@ -344,11 +831,14 @@ class VectorSearchService:
                 content=content,
                 summary=summary,
                 importance_score=importance_score,
-                embedding=embedding.tolist()
+                embedding=vector_param(embedding)
             )
             
             db.add(memory)
             db.commit()
+            write_model_embeddings(
+                restaurant_id, 'memory', [(memory.id, content + " " + summary, customer_phone)], db
+            )
             
             logger.info(f"Stored memory: {memory_type} for customer {customer_phone}")
             return True
@@ -380,11 +870,13 @@ class VectorSearchService:
                 category=category,
                 tags=tags,
                 searchable_content=searchable_content,
-                embedding=embedding.tolist()
+                embedding=vector_param(embedding)
             )
             
             db.add(kb_entry)
             db.commit()
+            restaurant_vector_index.invalidate(restaurant_id, 'knowledge')
+            write_model_embeddings(restaurant_id, 'knowledge', [(kb_entry.id, searchable_content, None)], db)
             
             logger.info(f"Created knowledge base entry: {category}")
             return True
@@ -403,71 +895,35 @@ class VectorSearchService:
         top_similarity: float,
         search_time_ms: int,
         embedding_time_ms: int,
-        conversation_id: Optional[int] = None
+        conversation_id: Optional[int] = None,
+        query_embedding: Optional[np.ndarray] = None
     ):
-        """Log search for analytics"""
+        """Queue search for analytics, written in bulk by the background log writer"""
         
-        try:
-            query_embedding = self.get_embedding(query)
-            
-            log = SearchLog(
-                conversation_id=conversation_id,
-                restaurant_id=restaurant_id,
-                query=query,
-                search_type=search_type,
-                embedding=query_embedding.tolist(),
-                results_found=results_found,
-                top_similarity=top_similarity,
-                search_time_ms=search_time_ms,
-                embedding_time_ms=embedding_time_ms
-            )
-            
-            db.add(log)
-            db.commit()
-            
-        except Exception as e:
-            logger.error(f"Error logging search: {e}")
+        # Percentiles come from the sketches, which see every search (the log writer may sample)
+        latency_recorder.record('search', restaurant_id, search_time_ms)
+        if embedding_time_ms:
+            # 0 means the embedding was cached or passed in; the stage only counts real encodes
+            latency_recorder.record('embedding', restaurant_id, embedding_time_ms)
+        
+        # Reuse the embedding computed by the search itself, no extra inference here
+        search_log_writer.log(
+            conversation_id=conversation_id,
+            restaurant_id=restaurant_id,
+            query=query,
+            search_type=search_type,
+            embedding=query_embedding,
+            results_found=results_found,
+            top_similarity=top_similarity,
+            search_time_ms=search_time_ms,
+            embedding_time_ms=embedding_time_ms
+        )
     
     def get_search_analytics(self, restaurant_id: int, db: Session, days: int = 7) -> Dict[str, Any]:
-        """Get search analytics for the restaurant"""
+        """Get search analytics for the restaurant, from the hourly rollups"""
         
         try:
-            # Most common search terms
-            common_queries = db.execute(text("""
-                SELECT query, COUNT(*) as count, AVG(top_similarity) as avg_similarity
-                FROM search_logs 
-                WHERE restaurant_id = :restaurant_id 
-                    AND created_at > NOW() - INTERVAL '%s days'
-                GROUP BY query
-                ORDER BY count DESC
-                LIMIT 10
-            """ % days), {'restaurant_id': restaurant_id}).fetchall()
-            
-            # Performance stats
-            performance = db.execute(text("""
-                SELECT 
-                    AVG(search_time_ms) as avg_search_time,
-                    AVG(embedding_time_ms) as avg_embedding_time,
-                    AVG(results_found) as avg_results,
-                    COUNT(*) as total_searches
-                FROM search_logs 
-                WHERE restaurant_id = :restaurant_id 
-                    AND created_at > NOW() - INTERVAL '%s days'
-            """ % days), {'restaurant_id': restaurant_id}).fetchone()
-            
-            return {
-                'common_queries': [
-                    {'query': row.query, 'count': row.count, 'avg_similarity': round(row.avg_similarity, 3)}
-                    for row in common_queries
-                ],
-                'performance': {
-                    'avg_search_time_ms': round(performance.avg_search_time or 0, 1),
-                    'avg_embedding_time_ms': round(performance.avg_embedding_time or 0, 1),
-                    'avg_results': round(performance.avg_results or 0, 1),
-                    'total_searches': performance.total_searches or 0
-                }
-            }
-            
+            return get_search_analytics(restaurant_id, db, days)
         except Exception as e:
             logger.error(f"Error getting search analytics: {e}")
             return {'common_queries': [], 'performance': {}}
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Compare embedding backends against the PyTorch output
+Reports per-sentence latency, RSS growth and the minimum / mean cosine similarity
+of ONNX fp32 and int8 embeddings to sentence-transformers.
+
+Usage: python benchmark_embedding_backends.py [threads]
+"""
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+
+from app.services.embedding_backends import (
+    ONNX_COSINE_TOLERANCE, OnnxEmbeddingBackend, SentenceTransformerBackend
+)
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+SENTENCES = [
+    "Quiero una bandeja paisa",
+    "¿Tienen algo vegetariano?",
+    "Empanadas de carne para llevar",
+    "¿Cuánto cuesta el domicilio?",
+    "Algo económico para el almuerzo",
+    "Sancocho de gallina para cuatro personas",
+    "¿A qué hora cierran hoy?",
+    "Una arepa con queso y un jugo de mora",
+    "Postre que no sea muy dulce",
+    "¿Aceptan pagos con tarjeta?",
+] * 10
+
+
+def rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_per_sentence(backend, batch_size: int) -> float:
+    backend.encode(SENTENCES[:batch_size])  # warm up
+    start = time.perf_counter()
+    for i in range(0, len(SENTENCES), batch_size):
+        backend.encode(SENTENCES[i:i + batch_size])
+    return (time.perf_counter() - start) * 1000 / len(SENTENCES)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    model_dir = tempfile.mkdtemp(prefix="onnx_benchmark_")
+
+    rss_before = rss_mb()
+    torch_backend = SentenceTransformerBackend(MODEL_NAME)
+    print(f"torch       loaded, peak RSS +{rss_mb() - rss_before:.0f} MB")
+    reference = torch_backend.encode(SENTENCES)
+
+    backends = {'torch': torch_backend}
+    for variant, quantize in (('onnx-fp32', False), ('onnx-int8', True)):
+        rss_before = rss_mb()
+        backends[variant] = OnnxEmbeddingBackend(MODEL_NAME, model_dir, quantize=quantize, intra_op_threads=threads)
+        print(f"{variant:11s} loaded, peak RSS +{rss_mb() - rss_before:.0f} MB")
+
+    print(f"\n{'backend':11s} {'ms/sent b=1':>12s} {'ms/sent b=32':>13s} {'min cos':>8s} {'mean cos':>9s} {'tolerance':>10s}")
+    for name, backend in backends.items():
+        single = time_per_sentence(backend, 1)
+        batched = time_per_sentence(backend, 32)
+        cosine = np.sum(backend.encode(SENTENCES) * reference, axis=1)
+        tolerance = ONNX_COSINE_TOLERANCE.get(name.split('-')[-1], ONNX_COSINE_TOLERANCE['fp32'])
+        status = "ok" if cosine.min() >= tolerance else "FAIL"
+        print(
+            f"{name:11s} {single:12.2f} {batched:13.2f} {cosine.min():8.5f} {cosine.mean():9.5f} "
+            f"{tolerance:>6} {status}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Exercise the remote embedding client against a local stub /embeddings server
+Embeds a synthetic catalog and reports how many HTTP requests it took, retries after
+injected 429 / 503 responses, and the time spent waiting on the token budget.
+
+Usage: python benchmark_remote_embeddings.py [items] [failure_rate] [latency_ms]
+"""
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+from app.services.remote_embeddings import RemoteEmbeddingClient
+
+DIMENSION = 1536
+
+
+class StubEmbeddingsHandler(BaseHTTPRequestHandler):
+    """OpenAI-shaped /embeddings responses with deterministic vectors"""
+
+    failure_rate = 0.0
+    latency_ms = 50
+    requests = 0
+    max_in_flight = 0
+    in_flight = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        cls = type(self)
+        with cls.lock:
+            cls.requests += 1
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            time.sleep(cls.latency_ms / 1000)
+
+            if random.random() < cls.failure_rate:
+                status = random.choice([429, 503])
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "0.2")
+                self.end_headers()
+                return
+
+            data = []
+            for index, text in enumerate(body["input"]):
+                seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+                vector = np.random.default_rng(seed).standard_normal(DIMENSION).round(6).tolist()
+                data.append({"object": "embedding", "index": index, "embedding": vector})
+
+            payload = json.dumps({"object": "list", "data": data, "model": body["model"]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    StubEmbeddingsHandler.failure_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    StubEmbeddingsHandler.latency_ms = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubEmbeddingsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    texts = [
+        f"Producto {i} bandeja paisa empanada arepa sancocho jugo de mora postre {'x' * (i % 40)}"
+        for i in range(items)
+    ]
+
+    client = RemoteEmbeddingClient(
+        base_url, max_batch_size=64, max_batch_tokens=8000, max_concurrency=4,
+        max_retries=8, tokens_per_minute=200000
+    )
+
+    start = time.perf_counter()
+    embeddings = client.embed(texts, "text-embedding-3-small")
+    elapsed = time.perf_counter() - start
+
+    # Same text, same vector: order must survive batching and concurrency
+    again = client.embed(texts[:5], "text-embedding-3-small")
+    assert np.allclose(embeddings[:5], again, atol=1e-5), "embeddings out of order"
+
+    print(f"{items} texts -> {embeddings.shape} in {elapsed:.2f}s")
+    print(f"batches planned:   {len(client.batches(texts))}")
+    print(f"HTTP requests:     {StubEmbeddingsHandler.requests} (max {StubEmbeddingsHandler.max_in_flight} in flight)")
+    print(f"client stats:      {client.stats}")
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
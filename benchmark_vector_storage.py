@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Benchmark compact vector storage against full precision
+Builds a scratch table of random unit vectors, then reports index size, query
+latency and recall@k for full, halfvec and binary first passes (with rerank).
+
+Usage: python benchmark_vector_storage.py [rows] [queries]
+"""
+import sys
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from sqlalchemy import text
+from app.core.database import engine
+from app.services.vector_quantization import unit_normalize
+
+DIMENSION = 384
+TABLE = "vector_storage_benchmark"
+K = 5
+RERANK_FACTOR = 4
+
+INDEXES = {
+    'full': "hnsw (embedding vector_ip_ops)",
+    'halfvec': f"hnsw ((embedding::halfvec({DIMENSION})) halfvec_ip_ops)",
+    'binary': f"hnsw ((binary_quantize(embedding)::bit({DIMENSION})) bit_hamming_ops)",
+}
+
+FIRST_PASS = {
+    'full': "embedding <#> CAST(:q AS vector)",
+    'halfvec': f"embedding::halfvec({DIMENSION}) <#> CAST(:q AS halfvec({DIMENSION}))",
+    'binary': f"binary_quantize(embedding)::bit({DIMENSION}) <~> binary_quantize(CAST(:q AS vector({DIMENSION})))",
+}
+
+
+def vector_literal(vector: np.ndarray) -> str:
+    return "[" + ",".join(f"{x:.7f}" for x in vector) + "]"
+
+
+def create_table(conn, rows: int):
+    print(f"Loading {rows} random unit vectors into {TABLE}...")
+    conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    conn.execute(text(f"CREATE TABLE {TABLE} (id serial PRIMARY KEY, embedding vector({DIMENSION}))"))
+
+    rng = np.random.default_rng(42)
+    for start in range(0, rows, 1000):
+        batch = unit_normalize(rng.standard_normal((min(1000, rows - start), DIMENSION)))
+        conn.execute(
+            text(f"INSERT INTO {TABLE} (embedding) SELECT CAST(v AS vector) FROM unnest(CAST(:vectors AS text[])) v"),
+            {'vectors': [vector_literal(v) for v in batch]}
+        )
+    conn.execute(text(f"ANALYZE {TABLE}"))
+
+
+def column_sizes(conn) -> dict:
+    row = conn.execute(text(f"""
+        SELECT
+            SUM(pg_column_size(embedding)) AS full_bytes,
+            SUM(pg_column_size(embedding::halfvec({DIMENSION}))) AS halfvec_bytes,
+            SUM(pg_column_size(binary_quantize(embedding)::bit({DIMENSION}))) AS binary_bytes
+        FROM {TABLE}
+    """)).fetchone()
+    return {'full': row.full_bytes, 'halfvec': row.halfvec_bytes, 'binary': row.binary_bytes}
+
+
+def exact_neighbours(conn, query: np.ndarray) -> list:
+    conn.execute(text("SET LOCAL enable_indexscan = off"))
+    rows = conn.execute(
+        text(f"SELECT id FROM {TABLE} ORDER BY embedding <#> CAST(:q AS vector) LIMIT :k"),
+        {'q': vector_literal(query), 'k': K}
+    ).fetchall()
+    conn.execute(text("SET LOCAL enable_indexscan = on"))
+    return [row.id for row in rows]
+
+
+def run_mode(conn, mode: str, queries: np.ndarray, truth: list) -> dict:
+    index_name = f"ix_{TABLE}_{mode}"
+    build_start = time.time()
+    conn.execute(text(f"CREATE INDEX {index_name} ON {TABLE} USING {INDEXES[mode]}"))
+    build_seconds = time.time() - build_start
+    index_bytes = conn.execute(text(f"SELECT pg_relation_size('{index_name}')")).scalar()
+
+    candidates = K if mode == 'full' else K * RERANK_FACTOR
+    latencies = []
+    recall_hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        rows = conn.execute(text(f"""
+            SELECT id FROM (
+                SELECT id, embedding FROM {TABLE}
+                ORDER BY {FIRST_PASS[mode]}
+                LIMIT :candidates
+            ) c
+            ORDER BY embedding <#> CAST(:q AS vector)
+            LIMIT :k
+        """), {'q': vector_literal(query), 'candidates': candidates, 'k': K}).fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+        recall_hits += len(set(row.id for row in rows) & set(expected))
+
+    conn.execute(text(f"DROP INDEX {index_name}"))
+    latencies.sort()
+    return {
+        'index_mb': index_bytes / 1024 / 1024,
+        'build_s': build_seconds,
+        'p50_ms': latencies[len(latencies) // 2],
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1],
+        'recall': recall_hits / (len(queries) * K),
+    }
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    with engine.begin() as conn:
+        create_table(conn, rows)
+
+        sizes = column_sizes(conn)
+        print("\nEmbedding storage (sum of values):")
+        for mode, size in sizes.items():
+            print(f"  {mode:8s} {size / 1024 / 1024:8.2f} MB")
+
+        queries = unit_normalize(np.random.default_rng(7).standard_normal((query_count, DIMENSION)))
+        truth = [exact_neighbours(conn, q) for q in queries]
+
+        print(f"\nTop-{K} search over {rows} rows, {query_count} queries (rerank x{RERANK_FACTOR}):")
+        print(f"  {'mode':8s} {'index MB':>9s} {'build s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'recall':>7s}")
+        for mode in INDEXES:
+            result = run_mode(conn, mode, queries, truth)
+            print(
+                f"  {mode:8s} {result['index_mb']:9.2f} {result['build_s']:8.1f} "
+                f"{result['p50_ms']:8.2f} {result['p95_ms']:8.2f} {result['recall']:7.3f}"
+            )
+
+        conn.execute(text(f"DROP TABLE {TABLE}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,13 +12,18 @@ SELECT '[1,2,3]'::vector;
 SELECT vector_dims('[1,2,3,4]'::vector);
 
 -- 4. Crear funciones optimizadas para búsqueda semántica
+-- Las búsquedas recorren los índices HNSW halfvec de alembic/versions/add_quantized_vectors.py
+-- (pgvector >= 0.7) y reordenan los candidatos a precisión completa. Los embeddings se guardan
+-- normalizados, así que distancia coseno = 1 + (a <#> b).
 
 -- Función para búsqueda de productos
+DROP FUNCTION IF EXISTS match_products(vector, integer, float, integer);
 CREATE OR REPLACE FUNCTION match_products(
   query_embedding vector(384),
   restaurant_id_param integer,
   match_threshold float DEFAULT 0.3,
-  match_count int DEFAULT 5
+  match_count int DEFAULT 5,
+  candidate_count int DEFAULT 20
 )
 RETURNS TABLE (
   product_id integer,
@@ -31,30 +36,49 @@ RETURNS TABLE (
 LANGUAGE plpgsql
 AS $$
 BEGIN
+  -- Nearest candidates on the halfvec index, reranked at full precision,
+  -- threshold applied last
   RETURN QUERY
   SELECT
-    pe.product_id,
-    p.name,
-    p.description,
-    p.price,
-    p.category,
-    1 - (pe.embedding <=> query_embedding) as similarity
-  FROM product_embeddings pe
-  JOIN products p ON pe.product_id = p.id
-  WHERE pe.restaurant_id = restaurant_id_param
-    AND p.available = true
-    AND 1 - (pe.embedding <=> query_embedding) > match_threshold
-  ORDER BY pe.embedding <=> query_embedding
-  LIMIT match_count;
+    r.product_id,
+    r.name,
+    r.description,
+    r.price,
+    r.category,
+    1 - r.distance as similarity
+  FROM (
+    SELECT
+      c.product_id,
+      c.name,
+      c.description,
+      c.price,
+      c.category,
+      1 + (c.embedding <#> query_embedding) as distance
+    FROM (
+      SELECT pe.product_id, pe.embedding, p.name, p.description, p.price, p.category
+      FROM product_embeddings pe
+      JOIN products p ON pe.product_id = p.id
+      WHERE pe.restaurant_id = restaurant_id_param
+        AND p.available = true
+      ORDER BY (pe.embedding)::halfvec(384) <#> query_embedding::halfvec(384)
+      LIMIT GREATEST(candidate_count, match_count)
+    ) c
+    ORDER BY distance
+    LIMIT match_count
+  ) r
+  WHERE r.distance < 1 - match_threshold
+  ORDER BY r.distance;
 END;
 $$;
 
 -- Función para búsqueda en base de conocimiento
+DROP FUNCTION IF EXISTS match_knowledge(vector, integer, float, integer);
 CREATE OR REPLACE FUNCTION match_knowledge(
   query_embedding vector(384),
   restaurant_id_param integer,
   match_threshold float DEFAULT 0.4,
-  match_count int DEFAULT 3
+  match_count int DEFAULT 3,
+  candidate_count int DEFAULT 12
 )
 RETURNS TABLE (
   id integer,
@@ -68,26 +92,44 @@ AS $$
 BEGIN
   RETURN QUERY
   SELECT
-    kb.id,
-    kb.question,
-    kb.answer,
-    kb.category,
-    1 - (kb.embedding <=> query_embedding) as similarity
-  FROM knowledge_base kb
-  WHERE kb.restaurant_id = restaurant_id_param
-    AND kb.active = true
-    AND 1 - (kb.embedding <=> query_embedding) > match_threshold
-  ORDER BY kb.embedding <=> query_embedding
-  LIMIT match_count;
+    r.id,
+    r.question,
+    r.answer,
+    r.category,
+    1 - r.distance as similarity
+  FROM (
+    SELECT
+      c.id,
+      c.question,
+      c.answer,
+      c.category,
+      1 + (c.embedding <#> query_embedding) as distance
+    FROM (
+      SELECT kb.id, kb.embedding, kb.question, kb.answer, kb.category
+      FROM knowledge_base kb
+      WHERE kb.restaurant_id = restaurant_id_param
+        AND kb.active = true
+      ORDER BY (kb.embedding)::halfvec(384) <#> query_embedding::halfvec(384)
+      LIMIT GREATEST(candidate_count, match_count)
+    ) c
+    ORDER BY distance
+    LIMIT match_count
+  ) r
+  WHERE r.distance < 1 - match_threshold
+  ORDER BY r.distance;
 END;
 $$;
 
 -- Función para búsqueda de memorias conversacionales
+-- Devuelve las match_count * candidate_factor memorias más cercanas; la aplicación las reordena
+-- por similitud, importancia, antigüedad y accesos (app/services/memory_ranking.py)
+DROP FUNCTION IF EXISTS match_memories(vector, text, integer, integer);
 CREATE OR REPLACE FUNCTION match_memories(
   query_embedding vector(384),
   customer_phone_param text,
   restaurant_id_param integer,
-  match_count int DEFAULT 3
+  match_count int DEFAULT 3,
+  candidate_factor int DEFAULT 8
 )
 RETURNS TABLE (
   id integer,
@@ -95,6 +137,8 @@ RETURNS TABLE (
   content text,
   summary text,
   importance_score real,
+  access_count integer,
+  last_accessed timestamptz,
   similarity float,
   created_at timestamptz
 )
@@ -108,20 +152,21 @@ BEGIN
     cm.content,
     cm.summary,
     cm.importance_score,
-    1 - (cm.embedding <=> query_embedding) as similarity,
+    cm.access_count,
+    cm.last_accessed,
+    -(cm.embedding <#> query_embedding) as similarity,
     cm.created_at
   FROM conversation_memories cm
   WHERE cm.customer_phone = customer_phone_param
     AND cm.restaurant_id = restaurant_id_param
-  ORDER BY 
-    cm.importance_score DESC,
-    cm.embedding <=> query_embedding,
-    cm.created_at DESC
-  LIMIT match_count;
+  ORDER BY (cm.embedding)::halfvec(384) <#> query_embedding::halfvec(384)
+  LIMIT match_count * GREATEST(candidate_factor, 1);
 END;
 $$;
 
 -- 5. Función para analytics de búsqueda
+-- Lee los rollups por hora/día (search_stats_hourly, search_query_stats_daily) que mantiene
+-- el job de la aplicación, nunca search_logs directamente
 CREATE OR REPLACE FUNCTION get_search_analytics(
   restaurant_id_param integer,
   days_back integer DEFAULT 7
@@ -138,18 +183,18 @@ BEGIN
   RETURN QUERY
   WITH search_stats AS (
     SELECT 
-      COUNT(*) as total,
-      AVG(search_time_ms) as avg_time
-    FROM search_logs 
-    WHERE restaurant_id = restaurant_id_param 
-      AND created_at > NOW() - INTERVAL '1 day' * days_back
+      SUM(h.searches)::bigint as total,
+      SUM(h.search_time_ms_sum)::numeric / NULLIF(SUM(h.searches), 0) as avg_time
+    FROM search_stats_hourly h
+    WHERE h.restaurant_id = restaurant_id_param 
+      AND h.hour > NOW() - INTERVAL '1 day' * days_back
   ),
   top_query AS (
-    SELECT query, COUNT(*) as count
-    FROM search_logs 
-    WHERE restaurant_id = restaurant_id_param
-      AND created_at > NOW() - INTERVAL '1 day' * days_back
-    GROUP BY query
+    SELECT q.query, SUM(q.searches)::bigint as count
+    FROM search_query_stats_daily q
+    WHERE q.restaurant_id = restaurant_id_param
+      AND q.day > date_trunc('day', NOW() - INTERVAL '1 day' * days_back)
+    GROUP BY q.query
     ORDER BY count DESC
     LIMIT 1
   )
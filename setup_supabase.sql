@@ -20,11 +20,16 @@ SELECT '[1,2,3]'::vector <=> '[1,2,4]'::vector as cosine_distance;
 -- This will be done after creating tables via migrations
 
 -- Create custom vector search functions for better performance
+-- Searches scan the halfvec HNSW indexes from alembic/versions/add_quantized_vectors.py
+-- (pgvector >= 0.7) and rerank the candidates at full precision. Stored embeddings are
+-- unit vectors, so cosine distance = 1 + (a <#> b).
+DROP FUNCTION IF EXISTS match_products(vector, integer, float, integer);
 CREATE OR REPLACE FUNCTION match_products(
   query_embedding vector(384),
   restaurant_id_param integer,
   match_threshold float DEFAULT 0.3,
-  match_count int DEFAULT 5
+  match_count int DEFAULT 5,
+  candidate_count int DEFAULT 20
 )
 RETURNS TABLE (
   product_id integer,
@@ -37,30 +42,49 @@ RETURNS TABLE (
 LANGUAGE plpgsql
 AS $$
 BEGIN
+  -- Nearest candidates on the halfvec index, reranked at full precision,
+  -- threshold applied last
   RETURN QUERY
   SELECT
-    pe.product_id,
-    p.name,
-    p.description,
-    p.price,
-    p.category,
-    1 - (pe.embedding <=> query_embedding) as similarity
-  FROM product_embeddings pe
-  JOIN products p ON pe.product_id = p.id
-  WHERE pe.restaurant_id = restaurant_id_param
-    AND p.available = true
-    AND 1 - (pe.embedding <=> query_embedding) > match_threshold
-  ORDER BY pe.embedding <=> query_embedding
-  LIMIT match_count;
+    r.product_id,
+    r.name,
+    r.description,
+    r.price,
+    r.category,
+    1 - r.distance as similarity
+  FROM (
+    SELECT
+      c.product_id,
+      c.name,
+      c.description,
+      c.price,
+      c.category,
+      1 + (c.embedding <#> query_embedding) as distance
+    FROM (
+      SELECT pe.product_id, pe.embedding, p.name, p.description, p.price, p.category
+      FROM product_embeddings pe
+      JOIN products p ON pe.product_id = p.id
+      WHERE pe.restaurant_id = restaurant_id_param
+        AND p.available = true
+      ORDER BY (pe.embedding)::halfvec(384) <#> query_embedding::halfvec(384)
+      LIMIT GREATEST(candidate_count, match_count)
+    ) c
+    ORDER BY distance
+    LIMIT match_count
+  ) r
+  WHERE r.distance < 1 - match_threshold
+  ORDER BY r.distance;
 END;
 $$;
 
 -- Create function for knowledge base search
+DROP FUNCTION IF EXISTS match_knowledge(vector, integer, float, integer);
 CREATE OR REPLACE FUNCTION match_knowledge(
   query_embedding vector(384),
   restaurant_id_param integer,
   match_threshold float DEFAULT 0.4,
-  match_count int DEFAULT 3
+  match_count int DEFAULT 3,
+  candidate_count int DEFAULT 12
 )
 RETURNS TABLE (
   id integer,
@@ -74,26 +98,44 @@ AS $$
 BEGIN
   RETURN QUERY
   SELECT
-    kb.id,
-    kb.question,
-    kb.answer,
-    kb.category,
-    1 - (kb.embedding <=> query_embedding) as similarity
-  FROM knowledge_base kb
-  WHERE kb.restaurant_id = restaurant_id_param
-    AND kb.active = true
-    AND 1 - (kb.embedding <=> query_embedding) > match_threshold
-  ORDER BY kb.embedding <=> query_embedding
-  LIMIT match_count;
+    r.id,
+    r.question,
+    r.answer,
+    r.category,
+    1 - r.distance as similarity
+  FROM (
+    SELECT
+      c.id,
+      c.question,
+      c.answer,
+      c.category,
+      1 + (c.embedding <#> query_embedding) as distance
+    FROM (
+      SELECT kb.id, kb.embedding, kb.question, kb.answer, kb.category
+      FROM knowledge_base kb
+      WHERE kb.restaurant_id = restaurant_id_param
+        AND kb.active = true
+      ORDER BY (kb.embedding)::halfvec(384) <#> query_embedding::halfvec(384)
+      LIMIT GREATEST(candidate_count, match_count)
+    ) c
+    ORDER BY distance
+    LIMIT match_count
+  ) r
+  WHERE r.distance < 1 - match_threshold
+  ORDER BY r.distance;
 END;
 $$;
 
 -- Create function for memory search
+-- Returns the match_count * candidate_factor nearest memories; the application reranks
+-- them on similarity, importance, recency and access count (app/services/memory_ranking.py)
+DROP FUNCTION IF EXISTS match_memories(vector, text, integer, integer);
 CREATE OR REPLACE FUNCTION match_memories(
   query_embedding vector(384),
   customer_phone_param text,
   restaurant_id_param integer,
-  match_count int DEFAULT 3
+  match_count int DEFAULT 3,
+  candidate_factor int DEFAULT 8
 )
 RETURNS TABLE (
   id integer,
@@ -101,6 +143,8 @@ RETURNS TABLE (
   content text,
   summary text,
   importance_score real,
+  access_count integer,
+  last_accessed timestamptz,
   similarity float,
   created_at timestamptz
 )
@@ -114,21 +158,23 @@ BEGIN
     cm.content,
     cm.summary,
     cm.importance_score,
-    1 - (cm.embedding <=> query_embedding) as similarity,
+    cm.access_count,
+    cm.last_accessed,
+    -(cm.embedding <#> query_embedding) as similarity,
     cm.created_at
   FROM conversation_memories cm
   WHERE cm.customer_phone = customer_phone_param
     AND cm.restaurant_id = restaurant_id_param
-  ORDER BY 
-    cm.importance_score DESC,
-    cm.embedding <=> query_embedding,
-    cm.created_at DESC
-  LIMIT match_count;
+  ORDER BY (cm.embedding)::halfvec(384) <#> query_embedding::halfvec(384)
+  LIMIT match_count * GREATEST(candidate_factor, 1);
 END;
 $$;
 
--- Create indexes for better performance (run after creating tables)
--- These will be created after running the migrations
+-- ANN indexes (HNSW on halfvec and binary-quantized embeddings) are created by the Alembic
+-- migrations (run: alembic upgrade head).
+-- Per-query recall/latency can be tuned with:
+--   SET LOCAL hnsw.ef_search = 40;   -- HNSW candidate list size
+--   SET LOCAL ivfflat.probes = 10;   -- only if IVFFlat indexes are used instead
 
 -- Notifications for real-time updates (optional)
 -- You can enable these if you want real-time notifications when embeddings are updated